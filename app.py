@@ -1,12 +1,20 @@
-from flask import Flask, render_template, request, redirect, url_for, session, Response, make_response, flash, jsonify
-from xhtml2pdf import pisa
+from flask import Flask, render_template, request, redirect, url_for, session, Response, make_response, flash, jsonify, stream_with_context, send_file
 import mysql.connector
 import csv
 import random
 import string
 import sys
-from io import StringIO, BytesIO
+import threading
+import multiprocessing
+import json
+import re
+import gzip
+import hashlib
+import click
+import time
+from io import StringIO, TextIOWrapper
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from functools import wraps
 
 # Imports for image generation (although not directly used in the provided logic for now)
@@ -14,41 +22,584 @@ from PIL import Image, ImageDraw, ImageFont
 import requests
 import os 
 
+from db_pool import ConnectionPool
+from sequences import SequenceAllocator
+from search import search_clause
+from ref_cache import ReferenceCache, ALL_STORES
+from receipt_store import ReceiptStore
+from receipt_render import ReceiptRenderer
+from barcode_codec import encode, decode, encode_many, decode_many, validate_order_barcodes
+from barcodes import render_barcode_png, render_barcode_svg, barcode_data_uri, barcode_cache_stats
+from session_store import ServerSideSessionInterface, SQLiteSessionBackend
+from export_jobs import ExportJobRunner, ExportQueueFull
+from product_import import ProductImporter, ProductImportError
+from kiosk_queue import ScanJournal, ScanQueue, SCAN_QUEUED, SCAN_APPLIED, SCAN_REJECTED
+from live_events import EventBroker, TooManySubscribers, EVENT_RESET, format_sse
+
 app = Flask(__name__)
 app.secret_key = 'trash-for-coin-secret-key-2025' # *** สำคัญมาก: เปลี่ยนเป็นคีย์ลับที่ปลอดภัยของคุณ ***
 
-# --- Barcode Encoding/Decoding Functions ---
-def encode(x: int) -> int:
-    a = 982451653
-    b = 1234567891234
-    m = 10000000000039 # จำนวนเฉพาะที่ใกล้เคียง 10^13
-    return (a * x + b) % m
-
-def decode(y: int) -> int:
-    a = 982451653
-    b = 1234567891234
-    m = 10000000000039 # ต้องเป็นค่าเดียวกับ m ใน encode
-    a_inv = pow(a, m - 2, m) # หา inverse ของ a mod m โดยใช้ Fermat's Little Theorem
-    return (a_inv * (y - b)) % m
+# --- Session storage ---
+# 'sqlite' (default) and 'redis' keep session data on the server and put only a random
+# session id in the cookie; 'cookie' keeps Flask's signed-cookie sessions.
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'sqlite')
+app.config['SESSION_STORE_PATH'] = os.environ.get('SESSION_STORE_PATH', os.path.join(app.instance_path, 'sessions.sqlite3'))
+app.config['SESSION_REDIS_URL'] = os.environ.get('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+app.config['SESSION_TTL'] = int(os.environ.get('SESSION_TTL', 604800)) # seconds of inactivity before a session expires
+
+def create_session_interface():
+    """Builds the session interface selected by SESSION_BACKEND (None keeps Flask's cookie sessions)."""
+    backend_name = app.config['SESSION_BACKEND']
+    if backend_name == 'cookie':
+        return None
+    if backend_name == 'sqlite':
+        os.makedirs(os.path.dirname(app.config['SESSION_STORE_PATH']), exist_ok=True)
+        backend = SQLiteSessionBackend(app.config['SESSION_STORE_PATH'])
+    elif backend_name == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package (pip install redis)")
+        backend = redis.Redis.from_url(app.config['SESSION_REDIS_URL'])
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend_name}")
+    return ServerSideSessionInterface(backend, ttl=app.config['SESSION_TTL'])
+
+_session_interface = create_session_interface()
+if _session_interface:
+    app.session_interface = _session_interface
+
+def regenerate_session():
+    """Gives the current server-side session a new id and drops the old record (cookie sessions have no id)."""
+    regenerate = getattr(session, 'regenerate', None)
+    if regenerate:
+        regenerate()
 
 # --- Database Connection ---
+DB_CONFIG = {
+    'host': "localhost",
+    'user': "root",
+    'password': "",
+    'database': "project_bin" # Make sure this matches your database name
+}
+
+# Connection pool settings (can be overridden with environment variables)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_POOL_MAX_OVERFLOW'] = int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 3600)) # seconds
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 30)) # seconds
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+
+# Search backend for the management pages: 'like' (default) or 'fulltext' (after migrations/003)
+app.config['SEARCH_BACKEND'] = os.environ.get('SEARCH_BACKEND', 'like')
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Returns the shared connection pool, creating it from app.config on first use."""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(
+                    DB_CONFIG,
+                    pool_size=app.config['DB_POOL_SIZE'],
+                    max_overflow=app.config['DB_POOL_MAX_OVERFLOW'],
+                    recycle=app.config['DB_POOL_RECYCLE'],
+                    timeout=app.config['DB_POOL_TIMEOUT'],
+                    pre_ping=app.config['DB_POOL_PRE_PING']
+                )
+    return _db_pool
+
 def get_db_connection():
     """
-    Establishes a connection to the MySQL database.
+    Checks out a connection to the MySQL database from the shared pool.
+    Calling close() on the returned connection gives it back to the pool.
     Returns the connection object or None if connection fails.
     """
     try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="project_bin" # Make sure this matches your database name
-        )
-        return conn
+        return get_db_pool().connect()
     except mysql.connector.Error as err:
         print(f"Error connecting to database: {err}")
         return None
 
+# --- Order id / barcode allocation ---
+# Barcodes are encode(n) for n taken from the persistent 'order_barcode' sequence.
+# encode() is a bijection modulo m, so distinct sequence values always give distinct barcodes.
+app.config['ORDER_BARCODE_BLOCK_SIZE'] = int(os.environ.get('ORDER_BARCODE_BLOCK_SIZE', 100))
+ORDER_BARCODE_SEQUENCE_START = 10**12 # Past the random seed range [10^11, 10^12) used by older barcodes
+
+_sequence_allocator = None
+
+def get_sequence_allocator():
+    """Returns the process-wide sequence allocator backed by tbl_sequences."""
+    global _sequence_allocator
+    if _sequence_allocator is None:
+        with _db_pool_lock:
+            if _sequence_allocator is None:
+                _sequence_allocator = SequenceAllocator(lambda: get_db_pool().connect())
+    return _sequence_allocator
+
+app.config['ORDER_ID_BLOCK_SIZE'] = int(os.environ.get('ORDER_ID_BLOCK_SIZE', 1)) # 1 keeps per-store order ids consecutive
+ORDER_ID_SEQUENCE_START = 100001
+
+def _initial_order_id(store_id):
+    """Seeds a store's order-id sequence from existing numeric order ids (runs once per store)."""
+    def seed(cursor):
+        cursor.execute("SELECT MAX(CAST(order_id AS UNSIGNED)) FROM tbl_order WHERE order_id REGEXP '^[0-9]+$' AND store_id = %s", (store_id,))
+        result = cursor.fetchone()
+        return int(result[0]) + 1 if result and result[0] is not None else ORDER_ID_SEQUENCE_START
+    return seed
+
+def next_order_id(store_id, cursor):
+    """
+    Returns the next order id for a store from its atomic per-store sequence.
+    Values already used in tbl_order (typed in by hand while another worker still held
+    a block reserved below them, see SequenceAllocator.advance_past()) are skipped.
+    """
+    while True:
+        order_id = str(get_sequence_allocator().next_value(f'order_id:{store_id}',
+                                                           block_size=app.config['ORDER_ID_BLOCK_SIZE'],
+                                                           initial=_initial_order_id(store_id)))
+        cursor.execute("SELECT 1 FROM tbl_order WHERE store_id = %s AND order_id = %s LIMIT 1", (store_id, order_id))
+        if cursor.fetchone() is None:
+            return order_id
+
+def reserve_manual_order_id(store_id, order_id):
+    """Keeps the store's sequence ahead of a numeric order id that was typed in by hand."""
+    if str(order_id).isdigit():
+        get_sequence_allocator().advance_past(f'order_id:{store_id}', int(order_id))
+
+def next_order_barcode():
+    """Returns a new, globally unique 13-digit order barcode."""
+    seq = get_sequence_allocator().next_value('order_barcode',
+                                              block_size=app.config['ORDER_BARCODE_BLOCK_SIZE'],
+                                              initial=ORDER_BARCODE_SEQUENCE_START)
+    return str(encode(seq)).zfill(13)
+
+def validate_scanned_barcodes(cursor, values):
+    """
+    Returns the sequence number of each scanned order barcode, or None for values
+    that were never issued (checked against the current 'order_barcode' sequence).
+    """
+    cursor.execute("SELECT next_value FROM tbl_sequences WHERE seq_name = 'order_barcode'")
+    row = cursor.fetchone()
+    next_value = int(row[0]) if row else ORDER_BARCODE_SEQUENCE_START
+    return validate_order_barcodes(values, max_sequence=next_value - 1)
+
+@app.cli.command('check-barcodes')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def check_barcodes_command(path):
+    """Validates scanned barcodes (one per line in PATH) and prints barcode,sequence for each; exits 1 if any is invalid."""
+    with open(path, encoding='utf-8') as handle:
+        values = [line.strip() for line in handle if line.strip()]
+    conn = get_db_connection()
+    if not conn:
+        print("Error: Could not connect to DB.")
+        sys.exit(1)
+    cursor = conn.cursor()
+    try:
+        sequences = validate_scanned_barcodes(cursor, values)
+    except mysql.connector.Error as err:
+        print(f"Error reading the barcode sequence: {err}")
+        sys.exit(1)
+    finally:
+        cursor.close()
+        conn.close()
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['barcode_id', 'sequence'])
+    for value, sequence in zip(values, sequences):
+        writer.writerow([value, sequence if sequence is not None else 'INVALID'])
+    invalid = sequences.count(None)
+    print(f"{len(values) - invalid} valid, {invalid} invalid", file=sys.stderr)
+    if invalid:
+        sys.exit(1)
+
+@app.cli.command('bench-barcodes')
+@click.option('--count', default=1000000, help='Barcodes to encode and decode.')
+@click.option('--chunk-size', default=65536, help='Values per batch.')
+def bench_barcodes_command(count, chunk_size):
+    """Compares scalar encode()/decode() with encode_many()/decode_many() (Python and NumPy paths)."""
+    import barcode_codec
+    values = list(range(ORDER_BARCODE_SEQUENCE_START, ORDER_BARCODE_SEQUENCE_START + count))
+
+    def timed(label, function):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        print(f"{label:<34} {elapsed:8.3f}s  {count / elapsed:12,.0f}/s")
+        return result
+
+    codes = timed('encode() loop', lambda: [encode(value) for value in values])
+    # What decode() cost before the inverse was precomputed
+    timed('decode() loop, inverse per call', lambda: [(pow(barcode_codec.BARCODE_A, -1, barcode_codec.BARCODE_M) * (code - barcode_codec.BARCODE_B))
+                                                      % barcode_codec.BARCODE_M for code in codes])
+    timed('decode() loop', lambda: [decode(code) for code in codes])
+    paths = [('python', False)] + ([('numpy', True)] if barcode_codec.np is not None else [])
+    for name, use_numpy in paths:
+        if timed(f'encode_many() [{name}]', lambda: encode_many(values, chunk_size, use_numpy)) != codes:
+            print(f"Error: encode_many() [{name}] differs from encode()")
+            sys.exit(1)
+        if timed(f'decode_many() [{name}]', lambda: decode_many(codes, chunk_size, use_numpy)) != values:
+            print(f"Error: decode_many() [{name}] does not invert encode()")
+            sys.exit(1)
+    if barcode_codec.np is None:
+        print("NumPy is not installed: only the pure-Python batch path was measured.")
+
+# --- Statistics counters ---
+# Aggregates shown on the homepage are kept in tbl_stat_counters and updated by the write
+# paths in the same transaction as the change itself. Each counter is split over
+# STAT_COUNTER_SLOTS rows (a random slot per write) so concurrent writers rarely wait on
+# the same row lock; readers sum the slots.
+app.config['STAT_COUNTER_SLOTS'] = 8
+app.config['HOME_STATS_TTL'] = 30 # seconds the homepage statistics are served from memory
+
+_home_stats_cache = {'value': None, 'expires_at': 0.0}
+_home_stats_lock = threading.Lock()
+
+def bump_stat_counters(cursor, **deltas):
+    """Adds deltas to named counters (e.g. total_quantity=1) inside the caller's transaction."""
+    rows = [(name, delta) for name, delta in deltas.items() if delta]
+    if not rows:
+        return
+    slot = random.randrange(app.config['STAT_COUNTER_SLOTS'])
+    values_sql = ', '.join(['(%s, %s, %s)'] * len(rows))
+    params = [value for name, delta in rows for value in (name, slot, delta)]
+    cursor.execute(f"""
+        INSERT INTO tbl_stat_counters (stat_name, slot, value) VALUES {values_sql}
+        ON DUPLICATE KEY UPDATE value = value + VALUES(value)
+    """, tuple(params))
+
+def record_order_change(cursor, email, rows=0, quantity=0, disquantity=0):
+    """
+    Applies a change to tbl_order to the global counters and to the owner's row in
+    tbl_user_stats, inside the caller's transaction. rows is +1/-1 when an order row is
+    inserted/deleted, quantity/disquantity are the deltas of those columns.
+    """
+    bump_stat_counters(cursor, total_quantity=quantity, total_disquantity=disquantity)
+    if not email or not (rows or quantity or disquantity):
+        return
+    cursor.execute("""
+        INSERT INTO tbl_user_stats (email, order_count, total_quantity, total_disquantity) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE order_count = order_count + VALUES(order_count),
+                                total_quantity = total_quantity + VALUES(total_quantity),
+                                total_disquantity = total_disquantity + VALUES(total_disquantity)
+    """, (email, rows, quantity, disquantity))
+
+def move_user_stats(cursor, old_email, new_email):
+    """Follows UPDATE tbl_order SET email = new WHERE email = old; new_email may be None (user deleted)."""
+    if new_email:
+        cursor.execute("""
+            INSERT INTO tbl_user_stats (email, order_count, total_quantity, total_disquantity)
+            SELECT %s, order_count, total_quantity, total_disquantity FROM tbl_user_stats WHERE email = %s
+            ON DUPLICATE KEY UPDATE order_count = tbl_user_stats.order_count + VALUES(order_count),
+                                    total_quantity = tbl_user_stats.total_quantity + VALUES(total_quantity),
+                                    total_disquantity = tbl_user_stats.total_disquantity + VALUES(total_disquantity)
+        """, (new_email, old_email))
+    cursor.execute("DELETE FROM tbl_user_stats WHERE email = %s", (old_email,))
+
+# Per-user totals recomputed from tbl_order; filtered by the caller-supplied WHERE fragment
+_USER_STATS_SOURCE_QUERY = """
+    SELECT email, COUNT(*) AS order_count, COALESCE(SUM(quantity), 0) AS total_quantity, COALESCE(SUM(disquantity), 0) AS total_disquantity
+    FROM tbl_order
+    WHERE email IS NOT NULL {where}
+    GROUP BY email
+"""
+
+def rebuild_user_stats(cursor, emails=None):
+    """Recomputes tbl_user_stats from tbl_order, for all users or only `emails`. Caller commits."""
+    if emails is None:
+        cursor.execute("DELETE FROM tbl_user_stats")
+        where, params = '', ()
+    else:
+        emails = list(emails)
+        if not emails:
+            return
+        placeholders = ', '.join(['%s'] * len(emails))
+        cursor.execute(f"DELETE FROM tbl_user_stats WHERE email IN ({placeholders})", tuple(emails))
+        where, params = f"AND email IN ({placeholders})", tuple(emails)
+    cursor.execute("INSERT INTO tbl_user_stats (email, order_count, total_quantity, total_disquantity) "
+                   + _USER_STATS_SOURCE_QUERY.format(where=where), params)
+
+def find_user_stats_mismatches(cursor):
+    """Returns the emails whose tbl_user_stats row does not match tbl_order (missing, stale or orphaned)."""
+    cursor.execute(f"""
+        SELECT src.email
+        FROM ({_USER_STATS_SOURCE_QUERY.format(where='')}) src
+        LEFT JOIN tbl_user_stats us ON us.email = src.email
+        WHERE us.email IS NULL
+           OR us.order_count <> src.order_count
+           OR us.total_quantity <> src.total_quantity
+           OR us.total_disquantity <> src.total_disquantity
+        UNION
+        SELECT us.email
+        FROM tbl_user_stats us
+        WHERE NOT EXISTS (SELECT 1 FROM tbl_order o WHERE o.email = us.email)
+    """)
+    return [row[0] for row in cursor.fetchall()]
+
+def get_user_stats(cursor, email):
+    """Returns the profile statistics of one user from tbl_user_stats (zeros if the user has no orders)."""
+    cursor.execute("SELECT order_count, total_quantity, total_disquantity, recycling_rate FROM tbl_user_stats WHERE email = %s", (email,))
+    row = cursor.fetchone()
+    if not row:
+        return {'order_count': 0, 'total_quantity': 0, 'total_disquantity': 0, 'recycling_rate': 0}
+    order_count, total_quantity, total_disquantity, recycling_rate = row
+    return {
+        'order_count': int(order_count),
+        'total_quantity': int(total_quantity),
+        'total_disquantity': int(total_disquantity),
+        'recycling_rate': int(recycling_rate or 0),
+    }
+
+def rebuild_stat_counters(cursor):
+    """Recomputes every counter from the base tables (backfill / repair). Caller commits."""
+    cursor.execute("DELETE FROM tbl_stat_counters")
+    cursor.execute("INSERT INTO tbl_stat_counters (stat_name, slot, value) SELECT 'total_users', 0, COUNT(*) FROM tbl_users")
+    cursor.execute("""
+        INSERT INTO tbl_stat_counters (stat_name, slot, value)
+        SELECT 'total_quantity', 0, COALESCE(SUM(quantity), 0) FROM tbl_order
+        UNION ALL
+        SELECT 'total_disquantity', 0, COALESCE(SUM(disquantity), 0) FROM tbl_order
+    """)
+
+def get_home_stats():
+    """
+    Returns the homepage statistics, served from an in-process cache for HOME_STATS_TTL
+    seconds; a refresh is a single small GROUP BY over tbl_stat_counters.
+    """
+    now = time.monotonic()
+    cached = _home_stats_cache['value']
+    if cached is not None and now < _home_stats_cache['expires_at']:
+        return cached
+
+    with _home_stats_lock:
+        if _home_stats_cache['value'] is not None and time.monotonic() < _home_stats_cache['expires_at']:
+            return _home_stats_cache['value']
+
+        stats = {
+            'total_users': 0,
+            'recycled_waste': 0,
+            'satisfaction': 0
+        }
+        conn = get_db_connection()
+        if not conn:
+            return stats # Not cached: try again on the next request
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT stat_name, SUM(value) FROM tbl_stat_counters GROUP BY stat_name")
+            counters = {name: int(total or 0) for name, total in cursor.fetchall()}
+        except mysql.connector.Error as err:
+            print(f"An error occurred: {err}")
+            return stats
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
+
+        total_quantity = counters.get('total_quantity', 0)
+        total_disquantity = counters.get('total_disquantity', 0)
+        stats['total_users'] = counters.get('total_users', 0)
+        # ขยะที่รีไซเคิล (disquantity ทั้งหมด)
+        stats['recycled_waste'] = total_disquantity
+        # ค่าความพึงพอใจ (ป้องกันการหารด้วยศูนย์ถ้าไม่มี quantity เลย)
+        stats['satisfaction'] = int((100 / total_quantity) * total_disquantity) if total_quantity > 0 else 0
+
+        _home_stats_cache['value'] = stats
+        _home_stats_cache['expires_at'] = time.monotonic() + app.config['HOME_STATS_TTL']
+        return stats
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Rebuilds tbl_stat_counters and tbl_user_stats from tbl_users and tbl_order (backfill)."""
+    conn = get_db_connection()
+    if not conn:
+        print("Error: Could not connect to DB.")
+        return
+    cursor = conn.cursor()
+    try:
+        rebuild_stat_counters(cursor)
+        rebuild_user_stats(cursor)
+        conn.commit()
+        print("Statistics counters rebuilt.")
+    except mysql.connector.Error as err:
+        conn.rollback()
+        print(f"Error rebuilding statistics counters: {err}")
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.cli.command('check-user-stats')
+@click.option('--fix', is_flag=True, help='Rebuild the rows that do not match tbl_order.')
+def check_user_stats_command(fix):
+    """Compares tbl_user_stats with tbl_order and optionally repairs the differences."""
+    conn = get_db_connection()
+    if not conn:
+        print("Error: Could not connect to DB.")
+        sys.exit(1)
+    cursor = conn.cursor()
+    try:
+        mismatched = find_user_stats_mismatches(cursor)
+        if not mismatched:
+            print("tbl_user_stats is consistent with tbl_order.")
+            return
+        print(f"{len(mismatched)} user(s) out of sync: {', '.join(mismatched)}")
+        if not fix:
+            sys.exit(1)
+        rebuild_user_stats(cursor, mismatched)
+        conn.commit()
+        print("Mismatched rows rebuilt.")
+    except mysql.connector.Error as err:
+        conn.rollback()
+        print(f"Error checking user statistics: {err}")
+        sys.exit(1)
+    finally:
+        cursor.close()
+        conn.close()
+
+# --- Reference data cache ---
+# Dropdown lists (stores, categories, products, users) are served from an in-process
+# ReferenceCache. Write paths call invalidate_reference_data() after committing.
+app.config['REF_CACHE_TTL'] = int(os.environ.get('REF_CACHE_TTL', 60))
+
+_ref_cache = None
+
+def get_ref_cache():
+    """Returns the process-wide reference data cache, creating it on first use."""
+    global _ref_cache
+    if _ref_cache is None:
+        with _db_pool_lock:
+            if _ref_cache is None:
+                _ref_cache = ReferenceCache(ttl=app.config['REF_CACHE_TTL'])
+    return _ref_cache
+
+def invalidate_reference_data(*namespaces, store_id=None):
+    """Drops cached lists of the given namespaces for one store (or all stores when store_id is None)."""
+    cache = get_ref_cache()
+    for namespace in namespaces:
+        cache.invalidate(namespace, store_id)
+
+def _fetch_rows(cursor, query, params=()):
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+def get_store_options(cursor, own_store_roles=('moderator', 'member', 'viewer')):
+    """Stores for the dropdown: all for root_admin/administrator, only the assigned store for own_store_roles."""
+    cache = get_ref_cache()
+    if session.get('role') in ['root_admin', 'administrator']:
+        return cache.get('stores', ALL_STORES, 'options', lambda: _fetch_rows(
+            cursor, "SELECT store_id, store_name FROM tbl_stores ORDER BY store_name"))
+    if session.get('role') in own_store_roles and session.get('store_id'):
+        store_id = session['store_id']
+        return cache.get('stores', store_id, 'options', lambda: _fetch_rows(
+            cursor, "SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (store_id,)))
+    return []
+
+def get_category_options(cursor, store_id=None):
+    """Categories of one store (or of every store when store_id is None), ordered by name."""
+    if store_id is None:
+        return get_ref_cache().get('categories', ALL_STORES, 'options', lambda: _fetch_rows(
+            cursor, "SELECT category_id, category_name FROM tbl_category ORDER BY category_name"))
+    return get_ref_cache().get('categories', store_id, 'options', lambda: _fetch_rows(
+        cursor, "SELECT category_id, category_name FROM tbl_category WHERE store_id = %s ORDER BY category_name", (store_id,)))
+
+def get_product_options(cursor, store_id=None, order_by='products_name'):
+    """Products (with stock and price) of one store or of every store; order_by is products_name or products_id."""
+    if order_by not in ('products_name', 'products_id'):
+        raise ValueError(f"Unsupported product order: {order_by}")
+    query = "SELECT products_id, products_name, stock, price, barcode_id, store_id FROM tbl_products"
+    if store_id is None:
+        return get_ref_cache().get('products', ALL_STORES, order_by, lambda: _fetch_rows(
+            cursor, query + f" ORDER BY {order_by}"))
+    return get_ref_cache().get('products', store_id, order_by, lambda: _fetch_rows(
+        cursor, query + f" WHERE store_id = %s ORDER BY {order_by}", (store_id,)))
+
+def get_user_options(cursor, store_id=None, customers_only=False):
+    """
+    Users for the email dropdown: every user when store_id is None, otherwise the users
+    of that store (only members/viewers when customers_only).
+    """
+    query = "SELECT email, CONCAT(firstname, ' ', lastname) as fullname, store_id FROM tbl_users"
+    if store_id is None:
+        return get_ref_cache().get('users', ALL_STORES, 'all', lambda: _fetch_rows(
+            cursor, query + " ORDER BY firstname"))
+    if customers_only:
+        return get_ref_cache().get('users', store_id, 'customers', lambda: _fetch_rows(
+            cursor, query + " WHERE store_id = %s AND (role = 'member' OR role = 'viewer') ORDER BY firstname", (store_id,)))
+    return get_ref_cache().get('users', store_id, 'all', lambda: _fetch_rows(
+        cursor, query + " WHERE store_id = %s ORDER BY firstname", (store_id,)))
+
+def get_moderator_options(cursor):
+    """Moderators and administrators for the store moderator dropdown."""
+    return get_ref_cache().get('users', ALL_STORES, 'moderators', lambda: _fetch_rows(
+        cursor, "SELECT id, CONCAT(firstname, ' ', lastname) as fullname, email, role FROM tbl_users WHERE role = 'moderator' OR role = 'administrator'"))
+
+# --- Live event feed ---
+# Write paths publish what they changed (order-created, order-updated, order-deleted,
+# disquantity-changed, bin-level) to an in-process EventBroker after committing, and
+# /events/stream pushes the events of one store as Server-Sent Events. The tbl_order
+# page subscribes and updates its rows in place instead of reloading the whole table.
+# Order events carry the row's email, so members are only sent their own rows.
+# The broker lives in memory: with several web processes each stream only carries the
+# writes handled by its own process.
+app.config['LIVE_EVENTS_BUFFER'] = int(os.environ.get('LIVE_EVENTS_BUFFER', 1000)) # recent events kept for reconnecting clients
+app.config['LIVE_EVENTS_MAX_SUBSCRIBERS'] = int(os.environ.get('LIVE_EVENTS_MAX_SUBSCRIBERS', 50)) # open streams per web process
+app.config['LIVE_EVENTS_HEARTBEAT'] = 15 # seconds between keep-alive comments on an idle stream
+app.config['LIVE_EVENTS_STREAM_SECONDS'] = 300 # a stream is closed after this long; EventSource reconnects with Last-Event-ID
+app.config['LIVE_EVENTS_RETRY_MS'] = 3000 # reconnect delay suggested to EventSource
+
+_event_broker = None
+
+def get_event_broker():
+    """Returns the process-wide live event broker, creating it on first use."""
+    global _event_broker
+    if _event_broker is None:
+        with _db_pool_lock:
+            if _event_broker is None:
+                _event_broker = EventBroker(buffer_size=app.config['LIVE_EVENTS_BUFFER'],
+                                            max_subscribers=app.config['LIVE_EVENTS_MAX_SUBSCRIBERS'])
+    return _event_broker
+
+def publish_event(store_id, event_type, data):
+    """Publishes one live event for a store. Call after the change was committed."""
+    get_event_broker().publish(int(store_id) if store_id not in (None, '') else None, event_type, data)
+
+def publish_disposals(store_id, kiosk_id, results, barcode_id=None, owners=None):
+    """
+    Publishes one disquantity-changed event per order line with applied packages in
+    `results` (the per-item dicts of apply_disposals() or /kiosk/sync, in scan order).
+    `owners` maps (barcode_id, products_id) to the order row's id and email, which the
+    results do not carry because they are returned to the kiosk.
+    """
+    owners = owners or {}
+    lines = {}
+    for result in results:
+        if not result.get('applied'):
+            continue
+        key = (result.get('barcode_id', barcode_id), result['products_id'])
+        line = lines.get(key)
+        applied = result['applied'] + (line['applied'] if line else 0)
+        lines[key] = dict(owners.get(key, {}), barcode_id=key[0], products_id=key[1], products_name=result.get('products_name'),
+                          quantity=result.get('quantity'), disquantity=result.get('disquantity'),
+                          applied=applied, kiosk_id=kiosk_id)
+    for data in lines.values():
+        publish_event(store_id, 'disquantity-changed', data)
+
+def publish_bin_levels(cursor, bins):
+    """Publishes a bin-level event with the current row of each (store_id, kiosk_id, category_id) bin."""
+    bins = sorted(bins)
+    if not bins:
+        return
+    placeholders = ', '.join(['(%s, %s, %s)'] * len(bins))
+    cursor.execute(f"SELECT * FROM tbl_bin_levels WHERE (store_id, kiosk_id, category_id) IN ({placeholders})",
+                   tuple(value for key in bins for value in key))
+    for level in cursor.fetchall():
+        level['needs_collection'] = bool(level['needs_collection'])
+        publish_event(level['store_id'], 'bin-level', level)
+
 # --- Helper functions for Viewer's dynamic store ---
 def generate_unique_store_id(conn, cursor):
     """Generates a unique store ID and creates a new store for the viewer."""
@@ -69,6 +620,7 @@ def generate_unique_store_id(conn, cursor):
             cursor.execute("INSERT INTO tbl_stores (store_id, store_name, address, phone) VALUES (%s, %s, %s, %s)",
                            (new_store_id, new_store_name, new_address, new_phone))
             conn.commit()
+            invalidate_reference_data('stores')
             return new_store_id, new_store_name
         except mysql.connector.Error as err:
             conn.rollback()
@@ -92,9 +644,13 @@ def delete_viewer_store_and_data(store_id):
         cursor.execute("UPDATE tbl_category SET store_id = NULL WHERE store_id = %s", (store_id,))
         cursor.execute("UPDATE tbl_users SET store_id = NULL WHERE store_id = %s", (store_id,)) # Users can also be tied to a store
 
+        # Drop the temporary store's order-id sequence
+        cursor.execute("DELETE FROM tbl_sequences WHERE seq_name = %s", (f'order_id:{store_id}',))
+
         # Finally, delete the store itself
         cursor.execute("DELETE FROM tbl_stores WHERE store_id = %s", (store_id,))
         conn.commit()
+        invalidate_reference_data('stores', 'categories', 'products', 'catalog', 'users')
         print(f"Viewer store (ID: {store_id}) and its associated data deleted successfully.")
         return True
     except mysql.connector.Error as err:
@@ -142,52 +698,8 @@ def index():
     """
     หน้าแรกของระบบ แสดงสถิติการใช้งานโดยรวมจากฐานข้อมูล
     """
-    # สร้าง Dictionary สำหรับเก็บค่าสถิติ
-    stats = {
-        'total_users': 0,
-        'recycled_waste': 0,
-        'satisfaction': 0
-    }
-
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-
-            # 1. ดึงจำนวนผู้ใช้งานทั้งหมดจาก tbl_users
-            cursor.execute("SELECT COUNT(*) FROM tbl_users")
-            # fetchone() จะ trả về một tuple, เราจึงเลือก item แรก ([0])
-            total_users = cursor.fetchone()[0]
-            stats['total_users'] = total_users
-
-            # 2. ดึงผลรวมของ quantity และ disquantity จาก tbl_order
-            cursor.execute("SELECT SUM(quantity), SUM(disquantity) FROM tbl_order")
-            order_data = cursor.fetchone()
-            total_quantity, total_disquantity = order_data
-
-            # ตรวจสอบว่าค่าที่ได้ไม่เป็น None (กรณีตารางว่าง)
-            total_quantity = total_quantity or 0
-            total_disquantity = total_disquantity or 0
-            
-            # 3. คำนวณค่าขยะที่รีไซเคิล (disquantity ทั้งหมด)
-            stats['recycled_waste'] = int(total_disquantity)
-
-            # 4. คำนวณค่าความพึงพอใจ
-            if total_quantity > 0:
-                satisfaction_rate = (100 / total_quantity) * total_disquantity
-            else:
-                # ป้องกันการหารด้วยศูนย์ถ้าไม่มี quantity เลย
-                satisfaction_rate = 0
-            
-            # จัดรูปแบบให้เป็นจำนวนเต็ม
-            stats['satisfaction'] = int(satisfaction_rate)
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
-        finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+    # สถิติมาจากตัวนับที่อัปเดตทุกครั้งที่มีการเขียนข้อมูล (cache ในหน่วยความจำตาม HOME_STATS_TTL)
+    stats = get_home_stats()
 
     # ส่งค่า stats ไปยัง template 'index.html'
     return render_template("index.html", stats=stats)
@@ -215,6 +727,7 @@ def login():
                 account = cursor.fetchone()
                 
                 if account:
+                    regenerate_session() # Never keep a session id that existed before the login
                     session['loggedin'] = True
                     session['id'] = account['id']
                     session['email'] = account['email']
@@ -295,7 +808,9 @@ def register():
                     # Default role is 'member', store_id is NULL by default or can be set by admin later
                     # New user is offline by default
                     cursor.execute('INSERT INTO tbl_users (firstname, lastname, email, password, role, is_online) VALUES (%s, %s, %s, %s, %s, FALSE)', (firstname, lastname, email, password, 'member',))
+                    bump_stat_counters(cursor, total_users=1)
                     conn.commit()
+                    invalidate_reference_data('users')
                     msg = 'คุณสมัครสมาชิกสำเร็จแล้ว!'
                     flash(msg, 'success')
                     return redirect(url_for('login'))
@@ -337,30 +852,11 @@ def profile():
         if stats_conn:
             try:
                 cursor = stats_conn.cursor()
-                user_email = session['email']
-
-                # 1. Count total orders for the user
-                cursor.execute('SELECT COUNT(*) FROM tbl_order WHERE email = %s', (user_email,))
-                result = cursor.fetchone()
-                order_count = result[0] if result and result[0] is not None else 0
-
-                # 2. Sum quantity (deposit) and disquantity (recycled)
-                # NOTE: Changed column names to reflect 'deposit' and 'recycled' as per HTML context (₿ เงินมัดจำ, คะแนน)
-                # Assuming 'quantity' is deposit and 'disquantity' is recycled/rated.
-                cursor.execute('SELECT SUM(quantity), SUM(disquantity) FROM tbl_order WHERE email = %s', (user_email,))
-                sum_result = cursor.fetchone()
-                
-                db_total_quantity = sum_result[0] if sum_result and sum_result[0] is not None else 0
-                db_total_disquantity = sum_result[1] if sum_result and sum_result[1] is not None else 0
-                
-                total_quantity = int(db_total_quantity)
-
-                # 3. Calculate recycling rate: (100 / total_quantity) * disquantity
-                if db_total_quantity > 0:
-                    # Ensure total_quantity and total_disquantity are floats for division
-                    recycling_rate = int((100 / float(db_total_quantity)) * float(db_total_disquantity))
-                else:
-                    recycling_rate = 0
+                # สถิติรายผู้ใช้ถูกอัปเดตพร้อมกับการเขียน tbl_order (ดู record_order_change)
+                user_stats = get_user_stats(cursor, session['email'])
+                order_count = user_stats['order_count']
+                total_quantity = user_stats['total_quantity']
+                recycling_rate = user_stats['recycling_rate']
 
             except mysql.connector.Error as err:
                 flash(f"เกิดข้อผิดพลาดในการดึงข้อมูลสถิติ: {err}", 'danger')
@@ -496,14 +992,8 @@ def logout():
     if session.get('role') == 'viewer' and session.get('store_id'):
         delete_viewer_store_and_data(session['store_id'])
 
-    session.pop('loggedin', None)
-    session.pop('id', None)
-    session.pop('email', None)
-    session.pop('firstname', None)
-    session.pop('lastname', None)
-    session.pop('role', None)
-    session.pop('store_id', None) # Clear store_id from session
-    session.pop('store_name', None) # Clear store_name from session
+    session.clear()
+    regenerate_session() # Deletes the stored record of the logged-out session
     flash('คุณได้ออกจากระบบแล้ว', 'info')
     return redirect(url_for('login'))
 
@@ -549,8 +1039,7 @@ def tbl_stores():
         cursor = conn.cursor(dictionary=True)
         
         # Fetch all users (especially moderators) for the moderator dropdown
-        cursor.execute("SELECT id, CONCAT(firstname, ' ', lastname) as fullname, email, role FROM tbl_users WHERE role = 'moderator' OR role = 'administrator'")
-        users = cursor.fetchall()
+        users = get_moderator_options(cursor)
 
         if request.method == "POST":
             action = request.form.get('action')
@@ -564,6 +1053,7 @@ def tbl_stores():
                     cursor.execute("INSERT INTO tbl_stores (store_name, address, phone, moderator_user_id) VALUES (%s, %s, %s, %s)",
                                    (store_name, address, phone, moderator_user_id))
                     conn.commit()
+                    invalidate_reference_data('stores')
                     msg = 'เพิ่มร้านค้าสำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -580,6 +1070,7 @@ def tbl_stores():
                     cursor.execute("UPDATE tbl_stores SET store_name = %s, address = %s, phone = %s, moderator_user_id = %s WHERE store_id = %s",
                                    (store_name, address, phone, moderator_user_id, store_id))
                     conn.commit()
+                    invalidate_reference_data('stores')
                     msg = 'อัปเดตร้านค้าสำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -596,6 +1087,7 @@ def tbl_stores():
 
                     cursor.execute("DELETE FROM tbl_stores WHERE store_id = %s", (store_id,))
                     conn.commit()
+                    invalidate_reference_data('stores', 'categories', 'products', 'catalog', 'users')
                     msg = 'ลบร้านค้าสำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -603,13 +1095,14 @@ def tbl_stores():
                     flash(msg, 'danger')
             elif 'search' in request.form:
                 search_query = request.form['search']
+                search_sql, search_params = search_clause('stores', search_query, app.config['SEARCH_BACKEND'])
                 cursor.execute("""
                     SELECT s.*, u.firstname, u.lastname, u.email as moderator_email
                     FROM tbl_stores s
                     LEFT JOIN tbl_users u ON s.moderator_user_id = u.id
-                    WHERE s.store_name LIKE %s OR s.address LIKE %s OR s.phone LIKE %s OR u.email LIKE %s
+                    WHERE """ + search_sql + """
                     ORDER BY s.store_id DESC
-                """, ('%' + search_query + '%', '%' + search_query + '%', '%' + search_query + '%', '%' + search_query + '%'))
+                """, tuple(search_params))
                 stores = cursor.fetchall()
                 return render_template("tbl_stores.html", stores=stores, users=users, search=search_query, msg=msg)
 
@@ -650,16 +1143,7 @@ def tbl_category():
         cursor = conn.cursor(dictionary=True)
         
         # Fetch stores for dropdown (all for root_admin/administrator, only assigned for moderator/member/viewer)
-        stores = []
-        if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT store_id, store_name FROM tbl_stores ORDER BY store_name")
-            stores = cursor.fetchall()
-        elif session.get('role') in ['moderator', 'member', 'viewer']:
-            if session.get('store_id'):
-                cursor.execute("SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (session['store_id'],))
-                store_info = cursor.fetchone()
-                if store_info:
-                    stores = [store_info]
+        stores = get_store_options(cursor)
 
 
         if request.method == "POST":
@@ -684,6 +1168,7 @@ def tbl_category():
                 try:
                     cursor.execute("INSERT INTO tbl_category (category_id, category_name, store_id) VALUES (%s, %s, %s)", (category_id, category_name, op_store_id))
                     conn.commit()
+                    invalidate_reference_data('categories')
                     msg = 'เพิ่มหมวดหมู่สำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -709,6 +1194,7 @@ def tbl_category():
                     # Update category with new values, including store_id
                     cursor.execute("UPDATE tbl_category SET category_id = %s, category_name = %s, store_id = %s WHERE id = %s", (category_id, category_name, op_store_id, cat_db_id))
                     conn.commit()
+                    invalidate_reference_data('categories')
                     msg = 'อัปเดตหมวดหมู่สำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -731,6 +1217,7 @@ def tbl_category():
 
                     cursor.execute("DELETE FROM tbl_category WHERE id = %s", (cat_db_id,))
                     conn.commit()
+                    invalidate_reference_data('categories')
                     msg = 'ลบหมวดหมู่สำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -739,14 +1226,14 @@ def tbl_category():
             
             elif 'search' in request.form:
                 search_query = request.form['search']
+                search_sql, search_params = search_clause('categories', search_query, app.config['SEARCH_BACKEND'])
                 base_query = """
                     SELECT
                         c.id, c.category_id, c.category_name, c.store_id, s.store_name
                     FROM tbl_category c
                     LEFT JOIN tbl_stores s ON c.store_id = s.store_id
-                    WHERE (c.category_name LIKE %s OR c.category_id LIKE %s)
-                """
-                query_params = ('%' + search_query + '%', '%' + search_query + '%')
+                    WHERE """ + search_sql
+                query_params = tuple(search_params)
 
                 if session.get('role') in ['moderator', 'member', 'viewer']:
                     base_query += " AND c.store_id = %s"
@@ -799,28 +1286,14 @@ def tbl_products():
         cursor = conn.cursor(dictionary=True)
         
         # Fetch stores for dropdown (all for root_admin/administrator, only assigned for moderator/member/viewer)
-        stores = []
-        if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT store_id, store_name FROM tbl_stores ORDER BY store_name")
-            stores = cursor.fetchall()
-        elif session.get('role') in ['moderator', 'member', 'viewer']:
-            # Moderator/Member/Viewer can only see their own store
-            if session.get('store_id'):
-                cursor.execute("SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (session['store_id'],))
-                store_info = cursor.fetchone()
-                if store_info:
-                    stores = [store_info]
+        stores = get_store_options(cursor)
 
 
         # Fetch all categories for the product dropdowns in modals (filtered by store_id for moderators/members/viewers)
-        category_base_query = "SELECT category_id, category_name FROM tbl_category"
-        category_query_params = ()
         if session.get('role') in ['moderator', 'member', 'viewer']:
-            category_base_query += " WHERE store_id = %s"
-            category_query_params = (session.get('store_id'),)
-        category_base_query += " ORDER BY category_name"
-        cursor.execute(category_base_query, category_query_params)
-        categories = cursor.fetchall()
+            categories = get_category_options(cursor, session['store_id']) if session.get('store_id') else []
+        else:
+            categories = get_category_options(cursor)
 
         if request.method == "POST":
             action = request.form.get('action')
@@ -850,6 +1323,7 @@ def tbl_products():
                     cursor.execute("INSERT INTO tbl_products (products_id, products_name, stock, price, category_id, description, store_id) VALUES (%s, %s, %s, %s, %s, %s, %s)", 
                                    (products_id, product_name, stock, price, category_id, description, op_store_id))
                     conn.commit()
+                    invalidate_reference_data('products', 'catalog')
                     msg = 'เพิ่มสินค้าสำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -879,6 +1353,7 @@ def tbl_products():
                     cursor.execute("UPDATE tbl_products SET products_id = %s, products_name = %s, stock = %s, price = %s, category_id = %s, description = %s WHERE id = %s", 
                                    (products_id, product_name, stock, price, category_id, description, product_db_id))
                     conn.commit()
+                    invalidate_reference_data('products', 'catalog')
                     msg = 'อัปเดตสินค้าสำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -907,6 +1382,7 @@ def tbl_products():
 
                     cursor.execute("DELETE FROM tbl_products WHERE id = %s", (product_db_id,))
                     conn.commit()
+                    invalidate_reference_data('products', 'catalog')
                     msg = 'ลบสินค้าสำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -914,14 +1390,14 @@ def tbl_products():
                     flash(msg, 'danger')
             elif 'search' in request.form:
                 search_query = request.form['search']
+                search_sql, search_params = search_clause('products', search_query, app.config['SEARCH_BACKEND'])
                 base_query = """
                     SELECT p.*, c.category_name, s.store_name
                     FROM tbl_products p
                     LEFT JOIN tbl_category c ON p.category_id = c.category_id
                     LEFT JOIN tbl_stores s ON p.store_id = s.store_id
-                    WHERE (p.products_name LIKE %s OR p.products_id LIKE %s OR c.category_name LIKE %s)
-                """
-                query_params = ('%' + search_query + '%', '%' + search_query + '%', '%' + search_query + '%')
+                    WHERE """ + search_sql
+                query_params = tuple(search_params)
 
                 if session.get('role') in ['moderator', 'member', 'viewer']: # Filter by store for moderator/member/viewer
                     base_query += " AND p.store_id = %s"
@@ -958,6 +1434,71 @@ def tbl_products():
 
 
 # --- Order Management ---
+app.config['ORDER_PAGE_SIZE'] = 50
+app.config['ORDER_PAGE_SIZE_MAX'] = 200
+
+def fetch_orders_page(cursor, search_query='', before_id=None, per_page=None):
+    """
+    Fetches one page of orders visible to the current user, newest first, using keyset
+    pagination on o.id (WHERE o.id < before_id) so the cost does not grow with history.
+    Returns (orders, total_count, next_before_id); next_before_id is None on the last page.
+    """
+    per_page = per_page or app.config['ORDER_PAGE_SIZE']
+    per_page = max(1, min(per_page, app.config['ORDER_PAGE_SIZE_MAX']))
+
+    conditions = []
+    query_params = []
+    if search_query:
+        search_sql, search_params = search_clause('orders', search_query, app.config['SEARCH_BACKEND'])
+        conditions.append(search_sql)
+        query_params.extend(search_params)
+    if session.get('role') == 'member' and search_query:
+        conditions.append("o.email = %s AND o.store_id = %s")
+        query_params.extend([session['email'], session['store_id']])
+    elif session.get('role') in ['moderator', 'member', 'viewer']: # For moderator/member/viewer, filter by their store
+        conditions.append("o.store_id = %s")
+        query_params.append(session.get('store_id'))
+
+    where_clause = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    # Lightweight count: same filters, no joins
+    cursor.execute("SELECT COUNT(*) AS total FROM tbl_order o" + where_clause, tuple(query_params))
+    total_count = cursor.fetchone()['total']
+
+    page_conditions = list(conditions)
+    page_params = list(query_params)
+    if before_id:
+        page_conditions.append("o.id < %s")
+        page_params.append(before_id)
+    page_where = (" WHERE " + " AND ".join(page_conditions)) if page_conditions else ""
+
+    cursor.execute("""
+        SELECT 
+            o.*, 
+            p.category_id,
+            p.price,
+            s.store_name,
+            """ + PENDING_DISPOSALS_SQL + """ AS pending_disquantity
+        FROM tbl_order o
+        LEFT JOIN tbl_products p ON o.products_id = p.products_id
+        LEFT JOIN tbl_stores s ON o.store_id = s.store_id
+    """ + page_where + " ORDER BY o.id DESC LIMIT %s", tuple(page_params) + (per_page + 1,))
+    orders_raw = cursor.fetchall()
+
+    next_before_id = None
+    if len(orders_raw) > per_page:
+        orders_raw = orders_raw[:per_page]
+        next_before_id = orders_raw[-1]['id']
+
+    # Ensure price is converted to float for display
+    orders = []
+    for order_raw in orders_raw:
+        order = order_raw.copy()
+        order['price'] = float(order['price'] or 0.0) # Handle NoneType for price here for display
+        order['disquantity'] += int(order.pop('pending_disquantity') or 0) # Scans not yet compacted into tbl_order
+        orders.append(order)
+    return orders, total_count, next_before_id
+
 @app.route("/tbl_order", methods=["GET", "POST"])
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
 def tbl_order():
@@ -977,37 +1518,21 @@ def tbl_order():
         cursor = conn.cursor(dictionary=True)
         
         # Fetch stores for dropdown (all for root_admin/administrator, only assigned for moderator/member/viewer)
-        stores = []
-        if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT store_id, store_name FROM tbl_stores ORDER BY store_name")
-            stores = cursor.fetchall()
-        elif session.get('role') in ['moderator', 'member', 'viewer']: # Viewer can also see their store
-            # Moderator/Member/Viewer can only see their own store
-            if session.get('store_id'):
-                cursor.execute("SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (session['store_id'],))
-                store_info = cursor.fetchone()
-                if store_info:
-                    stores = [store_info]
+        stores = get_store_options(cursor)
 
 
         # Fetch all products for the product dropdowns in modals (filtered by store_id)
-        product_base_query = "SELECT products_id, products_name, stock, price, barcode_id, store_id FROM tbl_products"
-        product_query_params = ()
         if session.get('role') in ['moderator', 'member', 'viewer']:
-            product_base_query += " WHERE store_id = %s"
-            product_query_params = (session.get('store_id'),)
-        product_base_query += " ORDER BY products_name"
-        cursor.execute(product_base_query, product_query_params)
-        products_data = cursor.fetchall()
+            products_data = get_product_options(cursor, session['store_id']) if session.get('store_id') else []
+        else:
+            products_data = get_product_options(cursor)
 
         users_data = []
         # Fetch all users for the email dropdown in modals (filtered by store_id for moderators/members/viewers)
         if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT email, CONCAT(firstname, ' ', lastname) as fullname, store_id FROM tbl_users ORDER BY firstname")
-            users_data = cursor.fetchall()
+            users_data = get_user_options(cursor)
         elif session.get('role') in ['moderator', 'viewer']:
-            cursor.execute("SELECT email, CONCAT(firstname, ' ', lastname) as fullname, store_id FROM tbl_users WHERE store_id = %s AND (role = 'member' OR role = 'viewer') ORDER BY firstname", (session.get('store_id'),))
-            users_data = cursor.fetchall()
+            users_data = get_user_options(cursor, session['store_id'], customers_only=True) if session.get('store_id') else []
         elif session.get('role') == 'member': # Member can only select their own email
             users_data = [{'email': session['email'], 'fullname': f"{session['firstname']} {session['lastname']}"}]
 
@@ -1030,7 +1555,7 @@ def tbl_order():
                 # Check permissions for adding orders
                 # All roles except 'root_admin' and 'administrator' are checked here
                 # Now 'viewer' is also allowed to add (to their temporary store)
-                order_id = request.form['order_id']
+                order_id = request.form.get('order_id', '').strip()
                 products_id = request.form['products_id']
                 quantity = int(request.form['quantity'])
                 disquantity = int(request.form['disquantity'])
@@ -1073,16 +1598,31 @@ def tbl_order():
                         flash(msg, 'danger')
                     else:
                         products_name = product_info['products_name']
+
+                        # Empty order_id: allocate one (and a fresh barcode) from the store's sequence.
+                        # A typed numeric order_id moves the sequence past it so cart() never reuses it.
+                        if not order_id:
+                            order_id = next_order_id(op_store_id, cursor)
+                            barcode_id = barcode_id or next_order_barcode()
+                        else:
+                            reserve_manual_order_id(op_store_id, order_id)
                         
                         # Insert new order with user-provided disquantity, barcode_id, and store_id
                         cursor.execute("""
                             INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, store_id)
                             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                         """, (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, op_store_id))
+                        order_row_id = cursor.lastrowid
+                        log_disposal_adjustment(cursor, order_row_id, disquantity)
                         
                         # Update product stock (deduct ordered quantity)
                         cursor.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (quantity, products_id))
+                        record_order_change(cursor, email, rows=1, quantity=quantity, disquantity=disquantity)
                         conn.commit()
+                        invalidate_reference_data('products', store_id=op_store_id)
+                        publish_event(op_store_id, 'order-created', {
+                            'id': order_row_id, 'order_id': order_id, 'barcode_id': barcode_id, 'products_id': products_id,
+                            'products_name': products_name, 'quantity': quantity, 'disquantity': disquantity, 'email': email})
                         msg = 'เพิ่มคำสั่งซื้อสำเร็จและอัปเดตสต็อกสินค้าแล้ว!'
                         flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -1116,8 +1656,9 @@ def tbl_order():
                     return redirect(url_for('tbl_order'))
 
                 try:
-                    # Get current order information to calculate stock change
-                    cursor.execute("SELECT products_id, quantity, store_id FROM tbl_order WHERE id = %s", (ord_id,))
+                    # Get current order information to calculate stock change (pending scans folded in first)
+                    compact_disposals(cursor, [ord_id])
+                    cursor.execute("SELECT products_id, quantity, disquantity, email, store_id FROM tbl_order WHERE id = %s", (ord_id,))
                     old_order_info = cursor.fetchone()
 
                     if not old_order_info:
@@ -1183,7 +1724,17 @@ def tbl_order():
                         UPDATE tbl_order SET order_id = %s, products_id = %s, products_name = %s, quantity = %s, disquantity = %s, email = %s, barcode_id = %s, store_id = %s
                         WHERE id = %s
                     """, (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, op_store_id, ord_id))
+                    if email == old_order_info['email']:
+                        record_order_change(cursor, email, quantity=quantity - old_quantity, disquantity=disquantity - old_order_info['disquantity'])
+                    else:
+                        record_order_change(cursor, old_order_info['email'], rows=-1, quantity=-old_quantity, disquantity=-old_order_info['disquantity'])
+                        record_order_change(cursor, email, rows=1, quantity=quantity, disquantity=disquantity)
+                    log_disposal_adjustment(cursor, ord_id, disquantity - old_order_info['disquantity'])
                     conn.commit()
+                    invalidate_reference_data('products')
+                    publish_event(op_store_id, 'order-updated', {
+                        'id': int(ord_id), 'order_id': order_id, 'barcode_id': barcode_id, 'products_id': products_id,
+                        'products_name': products_name, 'quantity': quantity, 'disquantity': disquantity, 'email': email})
                     msg = 'อัปเดตคำสั่งซื้อสำเร็จและอัปเดตสต็อกสินค้าแล้ว!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -1212,8 +1763,9 @@ def tbl_order():
                     return redirect(url_for('tbl_order'))
 
                 try:
-                    # Get order information before deleting to restore stock
-                    cursor.execute("SELECT products_id, quantity, store_id FROM tbl_order WHERE id = %s", (ord_id,))
+                    # Get order information before deleting to restore stock (pending scans folded in first)
+                    compact_disposals(cursor, [ord_id])
+                    cursor.execute("SELECT order_id, barcode_id, products_id, quantity, disquantity, email, store_id FROM tbl_order WHERE id = %s", (ord_id,))
                     order_to_delete = cursor.fetchone()
 
                     if not order_to_delete:
@@ -1235,7 +1787,12 @@ def tbl_order():
                     cursor.execute("DELETE FROM tbl_order WHERE id = %s", (ord_id,))
                     # Restore product stock in tbl_products (based on original ordered quantity)
                     cursor.execute("UPDATE tbl_products SET stock = stock + %s WHERE products_id = %s", (quantity_to_restore, product_id_to_restore))
+                    record_order_change(cursor, order_to_delete['email'], rows=-1, quantity=-quantity_to_restore, disquantity=-order_to_delete['disquantity'])
                     conn.commit()
+                    invalidate_reference_data('products')
+                    publish_event(order_to_delete['store_id'], 'order-deleted', {
+                        'id': int(ord_id), 'order_id': order_to_delete['order_id'], 'barcode_id': order_to_delete['barcode_id'],
+                        'products_id': product_id_to_restore, 'email': order_to_delete['email']})
                     msg = 'ลบคำสั่งซื้อสำเร็จและคืนสต็อกสินค้าแล้ว!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -1243,75 +1800,31 @@ def tbl_order():
                     flash(msg, 'danger')
                     conn.rollback() # Rollback in case of error
             elif 'search' in request.form:
-                search_query = request.form['search']
-                query_params = ['%' + search_query + '%'] * 3
-                
-                base_query = """
-                    SELECT 
-                        o.*, 
-                        p.category_id,
-                        p.price,
-                        s.store_name -- Added store_name from tbl_stores
-                    FROM tbl_order o
-                    LEFT JOIN tbl_products p ON o.products_id = p.products_id
-                    LEFT JOIN tbl_stores s ON o.store_id = s.store_id
-                    WHERE (o.order_id LIKE %s OR o.products_name LIKE %s OR o.email LIKE %s)
-                """
-                if session.get('role') == 'member':
-                    base_query += " AND o.email = %s AND o.store_id = %s"
-                    query_params.append(session['email'])
-                    query_params.append(session['store_id'])
-                elif session.get('role') in ['moderator', 'viewer']: # Viewer now acts like moderator
-                    base_query += " AND o.store_id = %s"
-                    query_params.append(session['store_id'])
-
-                base_query += " ORDER BY o.id DESC"
-                cursor.execute(base_query, tuple(query_params))
-                orders_raw = cursor.fetchall()
-
-                orders = []
-                for order_raw in orders_raw:
-                    order = order_raw.copy()
-                    order['price'] = float(order['price'] or 0.0) # Ensure price is float
-                    orders.append(order)
-
-                return render_template("tbl_order.html", orders=orders, products=products_data, users=users_data, search=search_query, msg=msg, stores=stores)
-
-        # SQL query for initial display of orders, explicitly selecting barcode_id, price, and store_name
-        base_query = """
-            SELECT 
-                o.*, 
-                p.category_id,
-                p.price,
-                s.store_name
-            FROM tbl_order o
-            LEFT JOIN tbl_products p ON o.products_id = p.products_id
-            LEFT JOIN tbl_stores s ON o.store_id = s.store_id
-        """
-        query_params = ()
-        if session.get('role') in ['moderator', 'member', 'viewer']: # For moderator/member/viewer, filter by their store
-            base_query += " WHERE o.store_id = %s"
-            query_params = (session.get('store_id'),)
-
-        base_query += " ORDER BY o.id DESC"
-        cursor.execute(base_query, query_params)
-        orders_raw = cursor.fetchall()
-
-        # Ensure price is converted to float for display
-        orders = []
-        for order_raw in orders_raw:
-            order = order_raw.copy()
-            order['price'] = float(order['price'] or 0.0) # Handle NoneType for price here for display
-            orders.append(order)
+                # Searches are paginated through GET so the cursor links keep the query
+                return redirect(url_for('tbl_order', search=request.form['search']))
+
+        # One page of orders (initial display or search), keyset-paginated on o.id
+        search_query = request.args.get('search', '').strip()
+        before_id = request.args.get('before_id', type=int)
+        per_page = request.args.get('per_page', type=int)
+        orders, total_orders, next_before_id = fetch_orders_page(cursor, search_query, before_id, per_page)
+        pagination = {
+            'total': total_orders,
+            'before_id': before_id,
+            'next_before_id': next_before_id,
+            'per_page': per_page
+        }
     except mysql.connector.Error as err:
         flash(f"เกิดข้อผิดพลาดในการดึงข้อมูลคำสั่งซื้อ: {err}", 'danger')
         orders = [] # Set orders to empty in case of error
+        search_query = ''
+        pagination = {'total': 0, 'before_id': None, 'next_before_id': None, 'per_page': None}
     finally:
         if cursor:
             cursor.close()
         if conn:
             conn.close()
-    return render_template("tbl_order.html", orders=orders, products=products_data, users=users_data, search='', msg=msg, stores=stores)
+    return render_template("tbl_order.html", orders=orders, products=products_data, users=users_data, search=search_query, msg=msg, stores=stores, pagination=pagination)
 
 # --- User Management ---
 @app.route("/tbl_users", methods=["GET", "POST"])
@@ -1341,16 +1854,7 @@ def tbl_users():
             print(f"Error fetching root_admin_id: {err}")
 
         # Fetch stores for dropdown (all for root_admin/administrator, only assigned for moderator/member)
-        stores = []
-        if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT store_id, store_name FROM tbl_stores ORDER BY store_name")
-            stores = cursor.fetchall()
-        elif session.get('role') in ['moderator', 'member']: # Member can also see their store
-            if session.get('store_id'):
-                cursor.execute("SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (session['store_id'],))
-                store_info = cursor.fetchone()
-                if store_info:
-                    stores = [store_info]
+        stores = get_store_options(cursor, own_store_roles=('moderator', 'member')) # Member can also see their store
 
 
         if request.method == "POST":
@@ -1407,7 +1911,9 @@ def tbl_users():
                 try:
                     # Add store_id to user insertion, new user is offline by default
                     cursor.execute('INSERT INTO tbl_users (firstname, lastname, email, password, role, store_id, is_online) VALUES (%s, %s, %s, %s, %s, %s, FALSE)', (firstname, lastname, email, password, role, op_store_id))
+                    bump_stat_counters(cursor, total_users=1)
                     conn.commit()
+                    invalidate_reference_data('users')
                     msg = 'เพิ่มผู้ใช้งานสำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -1479,6 +1985,7 @@ def tbl_users():
                     # UPDATED: If email changes, update tbl_order
                     if email != old_email:
                         cursor.execute("UPDATE tbl_order SET email = %s WHERE email = %s", (email, old_email,))
+                        move_user_stats(cursor, old_email, email)
                         conn.commit() # Commit this update immediately
 
                     if password:
@@ -1488,6 +1995,7 @@ def tbl_users():
                         cursor.execute('UPDATE tbl_users SET firstname = %s, lastname = %s, email = %s, role = %s, store_id = %s WHERE id = %s', 
                                         (firstname, lastname, email, role, op_store_id, user_id)) # Update store_id
                     conn.commit()
+                    invalidate_reference_data('users')
                     msg = 'อัปเดตผู้ใช้งานสำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -1550,11 +2058,14 @@ def tbl_users():
                 try:
                     # UPDATED: Set foreign keys to NULL in dependent tables before deleting user
                     cursor.execute("UPDATE tbl_order SET email = NULL WHERE email = %s", (target_user_email,))
+                    move_user_stats(cursor, target_user_email, None)
                     cursor.execute("UPDATE tbl_stores SET moderator_user_id = NULL WHERE moderator_user_id = %s", (user_id,))
                     conn.commit() # Commit updates before delete
 
                     cursor.execute("DELETE FROM tbl_users WHERE id = %s", (user_id,))
+                    bump_stat_counters(cursor, total_users=-cursor.rowcount)
                     conn.commit()
+                    invalidate_reference_data('users')
                     msg = 'ลบผู้ใช้งานสำเร็จ!'
                     flash(msg, 'success')
                 except mysql.connector.Error as err:
@@ -1562,8 +2073,9 @@ def tbl_users():
                     flash(msg, 'danger')
             elif 'search' in request.form:
                 search_query = request.form.get('search')
-                base_query = "SELECT u.*, s.store_name FROM tbl_users u LEFT JOIN tbl_stores s ON u.store_id = s.store_id WHERE (u.firstname LIKE %s OR u.lastname LIKE %s OR u.email LIKE %s OR u.role LIKE %s)"
-                query_params = ('%' + search_query + '%', '%' + search_query + '%', '%' + search_query + '%', '%' + search_query + '%')
+                search_sql, search_params = search_clause('users', search_query, app.config['SEARCH_BACKEND'])
+                base_query = "SELECT u.*, s.store_name FROM tbl_users u LEFT JOIN tbl_stores s ON u.store_id = s.store_id WHERE " + search_sql
+                query_params = tuple(search_params)
 
                 if session.get('role') in ['moderator', 'member']: # Filter by store for moderator/member
                     base_query += " AND u.store_id = %s"
@@ -1594,50 +2106,227 @@ def tbl_users():
     return render_template("tbl_users.html", users=users, search='', msg=msg, stores=stores)
 # --- Report Generation ---
 
+app.config['CSV_FETCH_BATCH'] = 1000
+
+def stream_csv_response(query, query_params, header, row_builder, filename):
+    """
+    Streams a CSV report straight from an unbuffered server-side cursor.
+    Rows are pulled with fetchmany() in CSV_FETCH_BATCH chunks and written out as they
+    arrive, so memory stays flat and the first bytes leave before the last row is read.
+    Raises mysql.connector.Error if the query fails (before any byte is sent).
+    """
+    conn = get_db_connection()
+    if not conn:
+        raise mysql.connector.errors.OperationalError("ไม่สามารถเชื่อมต่อฐานข้อมูลได้")
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        cursor.execute(query, query_params)
+    except mysql.connector.Error:
+        if cursor:
+            cursor.close()
+        conn.close()
+        raise
+
+    def generate():
+        si = StringIO()
+        cw = csv.writer(si)
+        try:
+            cw.writerow(header)
+            while True:
+                rows = cursor.fetchmany(app.config['CSV_FETCH_BATCH'])
+                if not rows:
+                    break
+                for row in rows:
+                    cw.writerow(row_builder(row))
+                yield si.getvalue()
+                si.seek(0)
+                si.truncate(0)
+            if si.tell():
+                yield si.getvalue()
+        finally:
+            # The client may disconnect mid-stream, leaving unread rows on the connection;
+            # the pool discards such connections instead of reusing them.
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+            conn.close()
+
+    output = Response(stream_with_context(generate()), mimetype="text/csv")
+    output.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return output
+
 @app.route("/export_products_csv")
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer']) # Allow viewer to export
 def export_products_csv():
-    """Exports product data to a CSV file."""
+    """Exports product data to a CSV file (streamed)."""
+    base_query = "SELECT products_id, products_name, stock, price, category_id, description, barcode_id, store_id FROM tbl_products"
+    query_params = ()
+    if session.get('role') in ['moderator', 'member', 'viewer']:
+        base_query += " WHERE store_id = %s"
+        query_params = (session.get('store_id'),)
+
+    def build_row(product):
+        # Ensure stock and price are handled as numbers, defaulting to 0 if None
+        display_stock = product['stock'] if product['stock'] is not None else 0
+        display_price = product['price'] if product['price'] is not None else 0.0
+        return [product['products_id'], product['products_name'], display_stock, display_price, product['category_id'], product['description'], product['barcode_id'], product['store_id']]
+
+    try:
+        return stream_csv_response(base_query, query_params,
+                                   ['Product ID', 'Product Name', 'Stock', 'Price', 'Category ID', 'Description', 'Barcode ID', 'Store ID'],
+                                   build_row, "products_report.csv")
+    except mysql.connector.Error as err:
+        flash(f"เกิดข้อผิดพลาดในการส่งออกข้อมูลสินค้า: {err}", 'danger')
+        return redirect(url_for('tbl_products'))
+
+# --- Bulk product import ---
+app.config['PRODUCT_IMPORT_CHUNK_SIZE'] = int(os.environ.get('PRODUCT_IMPORT_CHUNK_SIZE', 500)) # rows per INSERT ... ON DUPLICATE KEY UPDATE
+
+def run_product_import(conn, lines, store_id=None, allowed_store_ids=None):
+    """Runs a ProductImporter over `lines` and refreshes the cached product lists of the stores it touched."""
+    result = ProductImporter(conn, store_id=store_id, allowed_store_ids=allowed_store_ids,
+                             chunk_size=app.config['PRODUCT_IMPORT_CHUNK_SIZE']).run(lines)
+    for touched_store_id in result['store_ids']:
+        invalidate_reference_data('products', 'catalog', store_id=touched_store_id)
+    return result
+
+@app.route("/import_products_csv", methods=["POST"])
+@role_required(['root_admin', 'administrator', 'moderator'])
+def import_products_csv():
+    """
+    Imports products from an uploaded CSV file (the columns of /export_products_csv).
+    Administrators choose the default store (rows may also carry their own Store ID);
+    moderators can only import into their own store. Returns JSON with ?format=json.
+    """
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash("กรุณาเลือกไฟล์ CSV", 'danger')
+        return redirect(url_for('tbl_products'))
+
+    if session.get('role') in ['root_admin', 'administrator']:
+        store_id = request.form.get('store_id') or None
+        allowed_store_ids = None
+    else:
+        store_id = session.get('store_id')
+        if not store_id:
+            flash("คุณไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ.", 'danger')
+            return redirect(url_for('tbl_products'))
+        allowed_store_ids = [store_id]
+    if store_id is not None and not str(store_id).isdigit():
+        flash("รหัสร้านค้าไม่ถูกต้อง", 'danger')
+        return redirect(url_for('tbl_products'))
+
     conn = get_db_connection()
-    cursor = None # Initialize cursor to None
     if not conn:
         flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
         return redirect(url_for('tbl_products'))
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        base_query = "SELECT products_id, products_name, stock, price, category_id, description, barcode_id, store_id FROM tbl_products"
-        query_params = ()
-        if session.get('role') in ['moderator', 'member', 'viewer']:
-            base_query += " WHERE store_id = %s"
-            query_params = (session.get('store_id'),)
-
-        cursor.execute(base_query, query_params)
-        products = cursor.fetchall()
-        
-        si = StringIO()
-        cw = csv.writer(si)
-        
-        cw.writerow(['Product ID', 'Product Name', 'Stock', 'Price', 'Category ID', 'Description', 'Barcode ID', 'Store ID'])
-        
-        for product in products:
-            # Ensure stock and price are handled as numbers, defaulting to 0 if None
-            display_stock = product['stock'] if product['stock'] is not None else 0
-            display_price = product['price'] if product['price'] is not None else 0.0
-            cw.writerow([product['products_id'], product['products_name'], display_stock, display_price, product['category_id'], product['description'], product['barcode_id'], product['store_id']])
-        
-        output = make_response(si.getvalue())
-        output.headers["Content-Disposition"] = "attachment; filename=products_report.csv"
-        output.headers["Content-type"] = "text/csv"
-        return output
+        # Read the upload as a text stream: the file is never loaded into memory as a whole
+        lines = TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        result = run_product_import(conn, lines, store_id=store_id, allowed_store_ids=allowed_store_ids)
+    except (ProductImportError, UnicodeDecodeError, csv.Error) as err:
+        flash(f"นำเข้าสินค้าไม่สำเร็จ: {err}", 'danger')
+        return redirect(url_for('tbl_products'))
     except mysql.connector.Error as err:
-        flash(f"เกิดข้อผิดพลาดในการส่งออกข้อมูลสินค้า: {err}", 'danger')
+        flash(f"เกิดข้อผิดพลาดในการนำเข้าสินค้า: {err}", 'danger')
         return redirect(url_for('tbl_products'))
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        conn.close()
+
+    if request.args.get('format') == 'json':
+        return jsonify(dict(result, store_ids=sorted(result['store_ids']),
+                            errors=[{'line': line, 'products_id': products_id, 'message': message}
+                                    for line, products_id, message in result['errors']]))
+
+    flash(f"นำเข้าสินค้า {result['rows']} แถว: เพิ่มใหม่ {result['inserted']}, อัปเดต {result['updated']}, "
+          f"ผิดพลาด {result['error_count']} ({result['rows_per_second']:.0f} แถว/วินาที)",
+          'success' if not result['error_count'] else 'warning')
+    for line, products_id, message in result['errors'][:20]:
+        flash(f"บรรทัด {line} ({products_id or '-'}): {message}", 'danger')
+    if result['error_count'] > 20:
+        flash(f"และข้อผิดพลาดอื่นอีก {result['error_count'] - 20} รายการ (ใช้ ?format=json เพื่อดูทั้งหมด)", 'danger')
+    return redirect(url_for('tbl_products'))
+
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--store-id', type=int, default=None, help='Store for rows without a Store ID column value.')
+def import_products_command(path, store_id):
+    """Imports products from a CSV file and prints per-row errors and throughput."""
+    conn = get_db_connection()
+    if not conn:
+        print("Error: Could not connect to DB.")
+        sys.exit(1)
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as handle:
+            result = run_product_import(conn, handle, store_id=store_id)
+    except (ProductImportError, UnicodeDecodeError, csv.Error, mysql.connector.Error) as err:
+        print(f"Error importing products: {err}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    for line, products_id, message in result['errors']:
+        print(f"line {line} ({products_id or '-'}): {message}", file=sys.stderr)
+    print(f"{result['rows']} rows in {result['elapsed']:.2f}s ({result['rows_per_second']:.0f} rows/s): "
+          f"{result['inserted']} inserted, {result['updated']} updated, {result['error_count']} rejected")
+    if result['error_count']:
+        sys.exit(1)
+
+@app.route("/export_orders_csv")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def export_orders_csv():
+    """Exports order data to a CSV file (streamed)."""
+    base_query = """
+        SELECT o.id, o.order_id, o.products_id, o.products_name, o.quantity, o.disquantity,
+               o.email, o.order_date, o.barcode_id, o.store_id, p.price
+        FROM tbl_order o
+        LEFT JOIN tbl_products p ON o.products_id = p.products_id
+    """
+    query_params = []
+    if session.get('role') == 'member':
+        base_query += " WHERE o.email = %s AND o.store_id = %s"
+        query_params.extend([session['email'], session['store_id']])
+    elif session.get('role') in ['moderator', 'viewer']: # Filter for moderator/viewer
+        base_query += " WHERE o.store_id = %s"
+        query_params.append(session['store_id'])
+    base_query += " ORDER BY o.id DESC"
+
+    def build_row(order):
+        display_price = order['price'] if order['price'] is not None else 0.0
+        return [order['id'], order['order_id'], order['products_id'], order['products_name'], order['quantity'], order['disquantity'],
+                order['email'], order['order_date'], order['barcode_id'], order['store_id'], display_price]
+
+    try:
+        return stream_csv_response(base_query, tuple(query_params),
+                                   ['ID', 'Order ID', 'Product ID', 'Product Name', 'Quantity', 'Disposed Quantity', 'Email', 'Order Date', 'Barcode ID', 'Store ID', 'Price'],
+                                   build_row, "orders_report.csv")
+    except mysql.connector.Error as err:
+        flash(f"เกิดข้อผิดพลาดในการส่งออกรายงานคำสั่งซื้อ: {err}", 'danger')
+        return redirect(url_for('tbl_order'))
+
+@app.route("/export_users_csv")
+@role_required(['root_admin', 'administrator', 'moderator', 'member']) # Viewer cannot access user data
+def export_users_csv():
+    """Exports user accounts (without passwords) to a CSV file (streamed)."""
+    base_query = "SELECT u.id, u.firstname, u.lastname, u.email, u.role, u.store_id, s.store_name, u.is_online FROM tbl_users u LEFT JOIN tbl_stores s ON u.store_id = s.store_id"
+    query_params = ()
+    if session.get('role') in ['moderator', 'member']:
+        base_query += " WHERE u.store_id = %s"
+        query_params = (session.get('store_id'),)
+    base_query += " ORDER BY u.id DESC"
+
+    def build_row(user):
+        return [user['id'], user['firstname'], user['lastname'], user['email'], user['role'], user['store_id'], user['store_name'], int(user['is_online'] or 0)]
+
+    try:
+        return stream_csv_response(base_query, query_params,
+                                   ['ID', 'First Name', 'Last Name', 'Email', 'Role', 'Store ID', 'Store Name', 'Online'],
+                                   build_row, "users_report.csv")
+    except mysql.connector.Error as err:
+        flash(f"เกิดข้อผิดพลาดในการส่งออกข้อมูลผู้ใช้งาน: {err}", 'danger')
+        return redirect(url_for('tbl_users'))
 
 # --- Route จัดการคำสั่งซื้อ (cart) ---
 @app.route("/cart", methods=["GET", "POST"])
@@ -1650,7 +2339,6 @@ def cart():
     Order IDs are generated based on the latest order_id for the specific store.
     Viewers can access and persist data to their temporary store.
     """
-    conn = get_db_connection()
     cursor = None # Initialize cursor to None
     msg = ''
     pre_filled_products_id_input = ''
@@ -1664,19 +2352,15 @@ def cart():
         flash("คุณยังไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ.", 'danger')
         return redirect(url_for('index'))
 
+    conn = get_db_connection()
+    if not conn:
+        flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
+        return redirect(url_for('index'))
+
     try:
         cursor = conn.cursor(dictionary=True)
         # Fetch stores for dropdown (all for root_admin/administrator, only assigned for moderator/member/viewer)
-        stores = []
-        if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT store_id, store_name FROM tbl_stores ORDER BY store_name")
-            stores = cursor.fetchall()
-        elif session.get('role') in ['moderator', 'member', 'viewer']:
-            if session.get('store_id'):
-                cursor.execute("SELECT store_id, store_name FROM tbl_stores WHERE store_id = %s", (session['store_id'],))
-                store_info = cursor.fetchone()
-                if store_info:
-                    stores = [store_info]
+        stores = get_store_options(cursor)
 
 
         # --- Logic for creating/managing current_order_id and barcode_id for the order ---
@@ -1689,55 +2373,26 @@ def cart():
         selected_product_barcode = session.get(current_order_barcode_key)
 
         if not current_order_id:
-            # Fetch max order_id for the specific store_id
-            cursor.execute("SELECT MAX(CAST(order_id AS UNSIGNED)) AS max_order_id FROM tbl_order WHERE order_id REGEXP '^[0-9]+$' AND store_id = %s", (current_user_store_id,))
-            result = cursor.fetchone()
-            current_order_id = str(int(result['max_order_id'] or 0) + 1) if result and result['max_order_id'] is not None else '100001' # Handles first order for a new store
-            session[current_order_id_key] = current_order_id
+            # Take the next order_id from the store's sequence (atomic, safe for parallel cashiers)
+            current_order_id = next_order_id(current_user_store_id, cursor)
 
-            # Generate a new unique barcode_id for this order
+            # Allocate a new globally unique barcode_id for this order (constant time, no scan of tbl_order)
             # This barcode needs to be unique globally, even for viewer's temporary stores
-            is_unique = False
-            attempts = 0
-            max_attempts = 5000
-            cursor.execute("SELECT barcode_id FROM tbl_order WHERE barcode_id IS NOT NULL AND barcode_id != ''")
-            existing_barcode_ids_in_db = {item['barcode_id'] for item in cursor.fetchall()}
-            while not is_unique and attempts < max_attempts:
-                seed = random.randint(10**11, 10**12 - 1)
-                encoded_barcode_int = encode(seed)
-                new_barcode = str(encoded_barcode_int).zfill(13)
-                if new_barcode not in existing_barcode_ids_in_db:
-                    is_unique = True
-                    selected_product_barcode = new_barcode # Update the selected_product_barcode for this session
-                    session[current_order_barcode_key] = new_barcode # Fixed: use new_barcode, not selected_barcode
-                attempts += 1
-            if not is_unique:
-                flash("ไม่สามารถสร้างบาร์โค้ดที่ไม่ซ้ำกันสำหรับคำสั่งซื้อใหม่ได้. โปรดลองอีกครั้ง.", 'warning')
-                return redirect(url_for('cart'))
+            selected_product_barcode = next_order_barcode()
+            session[current_order_id_key] = current_order_id
+            session[current_order_barcode_key] = selected_product_barcode
 
-        # Fetch all product data and user data for the frontend (filtered by store_id)
-        # Ensure stock and price are converted to numbers or default to 0 if None
-        cursor.execute("SELECT products_id, products_name, stock, price, barcode_id FROM tbl_products WHERE store_id = %s ORDER BY products_id", (current_user_store_id,))
-        products_data_raw = cursor.fetchall()
-        products_data = []
-        for p_raw in products_data_raw:
-            p = p_raw.copy()
-            p['stock'] = int(p['stock'] or 0) # Convert stock to int, default 0
-            p['price'] = float(p['price'] or 0.0) # Convert price to float, default 0.0
-            products_data.append(p)
-
-        products_data_parts = [f"{p['products_id']}|{str(p['products_name']).replace('|', ' ').replace('///', ' ')}|{p['stock']}|{p['price']}|{str(p['barcode_id'] or '').replace('|', ' ').replace('///', ' ')}" for p in products_data]
-        products_data_string = "///".join(products_data_parts)
-        
+        # The product list is no longer embedded in the page: cart.html fetches it from
+        # product_catalog() (ETag + gzip), so it is downloaded once and revalidated afterwards.
         users_data = []
         # Filter users for the dropdown based on the current store (Viewer can select any member/viewer in their temp store)
         if session.get('role') in ['root_admin', 'administrator']:
-            cursor.execute("SELECT email, CONCAT(firstname, ' ', lastname) as fullname, store_id FROM tbl_users WHERE store_id = %s ORDER BY firstname", (current_user_store_id,))
+            users_data = get_user_options(cursor, current_user_store_id)
         elif session.get('role') in ['moderator', 'viewer']:
-            cursor.execute("SELECT email, CONCAT(firstname, ' ', lastname) as fullname, store_id FROM tbl_users WHERE store_id = %s AND (role = 'member' OR role = 'viewer') ORDER BY firstname", (current_user_store_id,))
+            users_data = get_user_options(cursor, current_user_store_id, customers_only=True)
         elif session.get('role') == 'member':
             cursor.execute("SELECT email, CONCAT(firstname, ' ', lastname) as fullname FROM tbl_users WHERE id = %s AND store_id = %s", (session['id'], current_user_store_id,))
-        users_data = cursor.fetchall()
+            users_data = cursor.fetchall()
 
         # --- Handle 'complete_order' action ---
         if request.method == "POST" and request.form.get('action') == 'complete_order':
@@ -1761,15 +2416,15 @@ def cart():
             # Ensure price is converted to float before multiplication
             total_price = sum(item['quantity'] * float(item['price'] or 0.0) for item in orders_to_complete)
             
-            # Store receipt data in session and clear current order info
-            session['receipt_data'] = {
+            # Store receipt data server-side (keyed by the order barcode); the session only keeps a short token
+            session['receipt_token'] = get_receipt_store().put(selected_product_barcode, {
                 'orders': orders_to_complete,
                 'barcode_id': selected_product_barcode, # Use selected_product_barcode here
                 'total_quantity': total_quantity,
                 'total_price': total_price,
                 'current_order_id': current_order_id,
                 'store_id': current_user_store_id
-            }
+            })
             session.pop(current_order_id_key, None)
             session.pop(current_order_barcode_key, None)
             
@@ -1839,15 +2494,26 @@ def cart():
                     else:
                         cursor.execute("UPDATE tbl_order SET quantity = %s WHERE id = %s", (new_qty, existing_order_item['id']))
                         cursor.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (quantity, products_id_to_use))
+                        record_order_change(cursor, email, quantity=quantity)
                         conn.commit()
+                        invalidate_reference_data('products', store_id=current_user_store_id)
+                        publish_event(current_user_store_id, 'order-updated', {
+                            'id': existing_order_item['id'], 'order_id': order_id_to_use, 'barcode_id': barcode_to_use_for_add,
+                            'products_id': products_id_to_use, 'products_name': products_name, 'quantity': new_qty, 'email': email})
                         flash(f'เพิ่มจำนวนสินค้า {products_name} ในรายการสั่งซื้อ {order_id_to_use} สำเร็จ และอัปเดตสต็อกแล้ว!', 'success')
                 else:
                     cursor.execute("""
                         INSERT INTO tbl_order (order_id, products_id, products_name, quantity, disquantity, email, barcode_id, store_id)
                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                     """, (order_id_to_use, products_id_to_use, products_name, quantity, disquantity, email, barcode_to_use_for_add, current_user_store_id))
+                    order_row_id = cursor.lastrowid
                     cursor.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (quantity, products_id_to_use))
+                    record_order_change(cursor, email, rows=1, quantity=quantity, disquantity=disquantity)
                     conn.commit()
+                    invalidate_reference_data('products', store_id=current_user_store_id)
+                    publish_event(current_user_store_id, 'order-created', {
+                        'id': order_row_id, 'order_id': order_id_to_use, 'barcode_id': barcode_to_use_for_add, 'products_id': products_id_to_use,
+                        'products_name': products_name, 'quantity': quantity, 'disquantity': disquantity, 'email': email})
                     flash('เพิ่มคำสั่งซื้อสำเร็จและอัปเดตสต็อกสินค้าแล้ว!', 'success')
                 return redirect(url_for('cart'))
         
@@ -1877,6 +2543,18 @@ def cart():
             o['price'] = float(o['price'] or 0.0) # Convert price to float, default 0.0
             orders_data.append(o)
 
+        # If the user submitted a form and the page is being re-rendered, update the product display
+        # using the same pooled connection instead of opening a second one.
+        if request.method == 'POST' and pre_filled_products_id_input:
+            cursor.execute("SELECT products_id, products_name, stock, price, barcode_id FROM tbl_products WHERE products_id = %s AND store_id = %s", (pre_filled_products_id_input, current_user_store_id))
+            found_product_raw = cursor.fetchone()
+            if found_product_raw:
+                found_product = found_product_raw.copy()
+                found_product['stock'] = int(found_product['stock'] or 0) # Convert stock to int, default 0
+                selected_product_details_display = f"{found_product['products_name']} | สต็อก: {found_product['stock']}"
+            else:
+                selected_product_details_display = 'ไม่พบสินค้าที่ระบุ'
+
     except mysql.connector.Error as err:
         flash(f"เกิดข้อผิดพลาดในการดึงข้อมูลคำสั่งซื้อ: {err}", 'danger')
         orders_data = []
@@ -1886,35 +2564,9 @@ def cart():
         if conn:
             conn.close()
 
-    # If the user submitted a form and the page is being re-rendered, update the product display.
-    if request.method == 'POST' and pre_filled_products_id_input:
-        conn_display_update = get_db_connection() # Re-open connection for this
-        cursor_display_update = None
-        if conn_display_update:
-            try:
-                cursor_display_update = conn_display_update.cursor(dictionary=True)
-                cursor_display_update.execute("SELECT products_id, products_name, stock, price, barcode_id FROM tbl_products WHERE products_id = %s AND store_id = %s", (pre_filled_products_id_input, current_user_store_id))
-                found_product_raw = cursor_display_update.fetchone()
-                if found_product_raw:
-                    found_product = found_product_raw.copy()
-                    found_product['stock'] = int(found_product['stock'] or 0) # Convert stock to int, default 0
-                    selected_product_details_display = f"{found_product['products_name']} | สต็อก: {found_product['stock']}"
-                else:
-                    selected_product_details_display = 'ไม่พบสินค้าที่ระบุ'
-            except mysql.connector.Error as err:
-                print(f"Error fetching product for display update: {err}")
-                selected_product_details_display = 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล'
-            finally:
-                if cursor_display_update:
-                    cursor_display_update.close()
-                if conn_display_update:
-                    conn_display_update.close()
-        else:
-            selected_product_details_display = 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล'
-
     return render_template("cart.html",
                            orders=orders_data,
-                           products_data_string=products_data_string,
+                           catalog_url=url_for('product_catalog', store_id=current_user_store_id) if current_user_store_id else '',
                            users=users_data,
                            search='',
                            msg=msg,
@@ -1926,24 +2578,243 @@ def cart():
                            stores=stores)
 
 
+# --- Product catalog for the cart page ---
+def get_catalog_payload(cursor, store_id):
+    """
+    Returns {'etag', 'body', 'gzip_body'} for the store's product catalog (id, name, price,
+    barcode). Stock is left out on purpose: it changes with every scan, while the catalog
+    only changes when products are edited, so the ETag stays valid across scans.
+    """
+    def load():
+        cursor.execute("SELECT products_id, products_name, price, barcode_id FROM tbl_products WHERE store_id = %s ORDER BY products_id", (store_id,))
+        products = [{
+            'products_id': row['products_id'],
+            'products_name': row['products_name'],
+            'price': float(row['price'] or 0.0),
+            'barcode_id': row['barcode_id'] or ''
+        } for row in cursor.fetchall()]
+        body = json.dumps({'store_id': store_id, 'products': products}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        # Content hash: identical across worker processes, unlike the cache versions
+        return [{'etag': hashlib.sha1(body).hexdigest(), 'body': body, 'gzip_body': gzip.compress(body)}]
+    return get_ref_cache().get('catalog', store_id, 'payload', load)[0]
+
+@app.route("/catalog/<int:store_id>")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def product_catalog(store_id):
+    """JSON product catalog of one store, served with an ETag (304 on If-None-Match) and gzip when accepted."""
+    if session.get('role') not in ['root_admin', 'administrator'] and session.get('store_id') != store_id:
+        return jsonify({'error': 'คุณไม่มีสิทธิ์เข้าถึงข้อมูลสินค้าของร้านค้านี้'}), 403
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล'}), 503
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        payload = get_catalog_payload(cursor, store_id)
+    except mysql.connector.Error as err:
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดึงข้อมูลสินค้า: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+    # Browsers revalidate on every page load; an unchanged catalog costs a bodyless 304
+    headers = {'ETag': f'"{payload["etag"]}"', 'Cache-Control': 'private, no-cache', 'Vary': 'Accept-Encoding'}
+    if request.if_none_match.contains(payload['etag']):
+        return Response(status=304, headers=headers)
+
+    body = payload['body']
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = payload['gzip_body']
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, mimetype='application/json', headers=headers)
+
+@app.route("/catalog/<int:store_id>/stock/<products_id>")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def product_stock(store_id, products_id):
+    """Current stock of one product (the catalog does not carry stock)."""
+    if session.get('role') not in ['root_admin', 'administrator'] and session.get('store_id') != store_id:
+        return jsonify({'error': 'คุณไม่มีสิทธิ์เข้าถึงข้อมูลสินค้าของร้านค้านี้'}), 403
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล'}), 503
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT stock FROM tbl_products WHERE products_id = %s AND store_id = %s", (products_id, store_id))
+        row = cursor.fetchone()
+    except mysql.connector.Error as err:
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดึงข้อมูลสินค้า: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+    if not row:
+        return jsonify({'error': 'ไม่พบสินค้า'}), 404
+    response = jsonify({'products_id': products_id, 'stock': int(row['stock'] or 0)})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+# --- Server-side receipt store ---
+app.config['RECEIPT_STORE_PATH'] = os.environ.get('RECEIPT_STORE_PATH', os.path.join(app.instance_path, 'receipts.sqlite3'))
+app.config['RECEIPT_TTL'] = int(os.environ.get('RECEIPT_TTL', 86400)) # seconds a completed receipt can be shown again
+
+_receipt_store = None
+
+def get_receipt_store():
+    """Returns the process-wide receipt store, creating the SQLite file on first use."""
+    global _receipt_store
+    if _receipt_store is None:
+        with _db_pool_lock:
+            if _receipt_store is None:
+                _receipt_store = ReceiptStore(app.config['RECEIPT_STORE_PATH'], ttl=app.config['RECEIPT_TTL'])
+    return _receipt_store
+
 # --- New route to display the PNG receipt ---
 @app.route("/receipt_display")
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
 def receipt_display():
     """
-    Displays the receipt data from the session and then clears it.
+    Displays the receipt referenced by the session token and then clears the token.
+    The receipt itself stays in the receipt store until it expires.
     """
-    receipt_data = session.pop('receipt_data', None)
+    receipt_data = get_receipt_store().get(session.pop('receipt_token', None))
     if not receipt_data:
         flash("ไม่พบข้อมูลใบเสร็จ. โปรดดำเนินการคำสั่งซื้อใหม่.", 'danger')
         return redirect(url_for('cart'))
     return render_template("receipt_png_template.html",
+                           receipt_png_url=url_for('receipt_png', barcode_id=receipt_data['barcode_id']),
                            orders=receipt_data['orders'],
                            barcode_id=receipt_data['barcode_id'],
                            total_quantity=receipt_data['total_quantity'],
                            total_price=receipt_data['total_price'],
                            current_order_id=receipt_data['current_order_id'])
 
+# --- Server-rendered receipts for the 58mm thermal printer ---
+app.config['RECEIPT_WIDTH'] = int(os.environ.get('RECEIPT_WIDTH', 384)) # printer dots per line (58mm @ 203 dpi)
+app.config['RECEIPT_FONT_PATH'] = os.environ.get('RECEIPT_FONT_PATH') # Thai TTF; auto-detected when unset
+
+_receipt_renderer = None
+
+def get_receipt_renderer():
+    """Returns the process-wide receipt renderer (fonts and rendered text lines are cached)."""
+    global _receipt_renderer
+    if _receipt_renderer is None:
+        with _db_pool_lock:
+            if _receipt_renderer is None:
+                _receipt_renderer = ReceiptRenderer(width=app.config['RECEIPT_WIDTH'], font_path=app.config['RECEIPT_FONT_PATH'])
+    return _receipt_renderer
+
+def get_receipt_for_user(barcode_id):
+    """Returns the stored receipt of order `barcode_id` if the current user may see it, else None."""
+    receipt = get_receipt_store().get_by_barcode(barcode_id)
+    if not receipt:
+        return None
+    if session.get('role') in ['root_admin', 'administrator'] or receipt.get('store_id') == session.get('store_id'):
+        return receipt
+    return None
+
+@app.route("/receipt/<barcode_id>.png")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def receipt_png(barcode_id):
+    """Receipt as a 1-bit PNG, ready for the 58mm printer."""
+    receipt = get_receipt_for_user(barcode_id)
+    if not receipt:
+        return "ไม่พบข้อมูลใบเสร็จ", 404
+    response = make_response(get_receipt_renderer().render_png(receipt))
+    response.headers['Content-Type'] = 'image/png'
+    response.headers['Content-Disposition'] = f'inline; filename=receipt_order_{receipt["current_order_id"]}.png'
+    return response
+
+@app.route("/receipt/<barcode_id>.escpos")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def receipt_escpos(barcode_id):
+    """Receipt as ESC/POS raster commands, to be sent to the printer as-is."""
+    receipt = get_receipt_for_user(barcode_id)
+    if not receipt:
+        return "ไม่พบข้อมูลใบเสร็จ", 404
+    response = make_response(get_receipt_renderer().render_escpos(receipt))
+    response.headers['Content-Type'] = 'application/octet-stream'
+    response.headers['Content-Disposition'] = f'attachment; filename=receipt_order_{receipt["current_order_id"]}.bin'
+    return response
+
+# --- Barcode images ---
+BARCODE_MAX_LENGTH = 48
+
+def _barcode_image_response(barcode_id, render, mimetype):
+    """
+    Renders a barcode image from the query string (module=1-4 px per module,
+    height=20-200 px, text=0/1) and marks it cacheable forever: the image of a given
+    barcode at a given size never changes. Private: only logged-in staff may fetch it.
+    """
+    if not barcode_id or len(barcode_id) > BARCODE_MAX_LENGTH or any(not 32 <= ord(char) <= 126 for char in barcode_id):
+        return "รหัสบาร์โค้ดไม่ถูกต้อง", 400
+    module_width = min(max(request.args.get('module', 2, type=int), 1), 4)
+    height = min(max(request.args.get('height', 60, type=int), 20), 200)
+    text = request.args.get('text', 1, type=int) != 0
+    body = render(barcode_id, module_width, height, text)
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+
+    etag = hashlib.md5(body).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(body)
+        response.headers['Content-Type'] = mimetype
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+@app.route("/barcode/<barcode_id>.png")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def barcode_png(barcode_id):
+    """Order barcode as a 1-bit PNG (EAN-13 when the number has a valid check digit, else Code 128)."""
+    return _barcode_image_response(barcode_id, render_barcode_png, 'image/png')
+
+@app.route("/barcode/<barcode_id>.svg")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def barcode_svg(barcode_id):
+    """Order barcode as SVG, for pages that scale it."""
+    return _barcode_image_response(barcode_id, render_barcode_svg, 'image/svg+xml')
+
+app.add_template_filter(barcode_data_uri, 'barcode_data_uri')
+
+@app.cli.command('bench-receipt')
+@click.option('--items', default=10, help='Order lines per receipt.')
+@click.option('--runs', default=200, help='Receipts to render.')
+def bench_receipt_command(items, runs):
+    """Measures receipt render time (first render with cold caches, then the average of warm renders)."""
+    receipt = {
+        'barcode_id': '0123456789012',
+        'current_order_id': '100001',
+        'orders': [{'quantity': (index % 3) + 1, 'products_name': f'สินค้าทดสอบ {index}', 'price': '15.00'} for index in range(items)],
+    }
+    receipt['total_quantity'] = sum(item['quantity'] for item in receipt['orders'])
+    receipt['total_price'] = sum(item['quantity'] * 15.0 for item in receipt['orders'])
+    renderer = ReceiptRenderer(width=app.config['RECEIPT_WIDTH'], font_path=app.config['RECEIPT_FONT_PATH'])
+
+    started = time.perf_counter()
+    renderer.render_png(receipt)
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(runs):
+        png = renderer.render_png(receipt)
+    warm = (time.perf_counter() - started) / runs
+
+    started = time.perf_counter()
+    for _ in range(runs):
+        raster = renderer.render_escpos(receipt)
+    escpos = (time.perf_counter() - started) / runs
+    print(f"font: {renderer.font_path or 'PIL default'}")
+    print(f"{items} items: first render {cold * 1000:.1f} ms, PNG {warm * 1000:.2f} ms/receipt ({len(png)} bytes), "
+          f"ESC/POS {escpos * 1000:.2f} ms/receipt ({len(raster)} bytes)")
+
 # --- Routes สำหรับแก้ไขและลบรายการในตะกร้า (ย้ายมาอยู่นอกฟังก์ชัน cart()) ---
 # แก้ไขรายการในตะกร้า
 @app.route("/cart/edit/<int:item_id>", methods=["POST"])
@@ -1992,9 +2863,11 @@ def edit_cart_item(item_id):
              return redirect(url_for('cart'))
 
         # ดึงปริมาณเดิมของรายการในคำสั่งซื้อเพื่อคำนวณการเปลี่ยนแปลงสต็อก
-        cursor_edit.execute("SELECT quantity FROM tbl_order WHERE id = %s", (item_id,))
+        compact_disposals(cursor_edit, [item_id])
+        cursor_edit.execute("SELECT quantity, disquantity, email, barcode_id FROM tbl_order WHERE id = %s", (item_id,))
         current_order_qty_result = cursor_edit.fetchone()
         current_order_qty = current_order_qty_result['quantity'] if current_order_qty_result else 0
+        current_order_disqty = current_order_qty_result['disquantity'] if current_order_qty_result else 0
 
         # คำนวณความแตกต่างของจำนวนที่เปลี่ยนไป
         qty_change = new_quantity - current_order_qty
@@ -2011,10 +2884,20 @@ def edit_cart_item(item_id):
             SET quantity = %s, disquantity = %s
             WHERE id = %s AND order_id = %s AND store_id = %s
         """, (new_quantity, new_disquantity, item_id, original_order_id, item_store_id)) # Added store_id to WHERE
+        order_row_updated = cursor_edit.rowcount
         
         # อัปเดตสต็อกใน tbl_products
         cursor_edit.execute("UPDATE tbl_products SET stock = stock - %s WHERE products_id = %s", (qty_change, original_product_id))
+        if order_row_updated:
+            record_order_change(cursor_edit, current_order_qty_result['email'], quantity=qty_change, disquantity=new_disquantity - current_order_disqty)
+            log_disposal_adjustment(cursor_edit, item_id, new_disquantity - current_order_disqty)
         conn_edit.commit()
+        invalidate_reference_data('products', store_id=item_store_id)
+        if order_row_updated:
+            publish_event(item_store_id, 'order-updated', {
+                'id': item_id, 'order_id': original_order_id, 'barcode_id': current_order_qty_result['barcode_id'],
+                'products_id': original_product_id, 'products_name': product_info['products_name'],
+                'quantity': new_quantity, 'disquantity': new_disquantity, 'email': current_order_qty_result['email']})
         flash(f'แก้ไขรายการ ID {item_id} ในคำสั่งซื้อ {original_order_id} สำเร็จแล้ว!', 'success')
     except ValueError:
         flash("จำนวนและทิ้งต้องเป็นตัวเลขที่ถูกต้อง.", 'danger')
@@ -2040,7 +2923,8 @@ def delete_cart_item(item_id):
     try:
         cursor_del = conn_del.cursor(dictionary=True)
         # ดึงข้อมูลรายการที่จะลบ เพื่อคืนสต็อกและตรวจสอบ store_id
-        cursor_del.execute("SELECT products_id, quantity, order_id, store_id, email FROM tbl_order WHERE id = %s", (item_id,))
+        compact_disposals(cursor_del, [item_id])
+        cursor_del.execute("SELECT products_id, quantity, disquantity, order_id, barcode_id, store_id, email FROM tbl_order WHERE id = %s", (item_id,))
         item_to_delete = cursor_del.fetchone()
         if not item_to_delete:
             flash("ไม่พบรายการที่จะลบ.", 'danger')
@@ -2067,8 +2951,16 @@ def delete_cart_item(item_id):
                            (item_to_delete['quantity'], item_to_delete['products_id']))
         # ลบรายการออกจาก tbl_order
         cursor_del.execute("DELETE FROM tbl_order WHERE id = %s AND store_id = %s", (item_id, item_store_id)) # Added store_id to WHERE
+        order_row_deleted = cursor_del.rowcount
+        if order_row_deleted:
+            record_order_change(cursor_del, item_to_delete['email'], rows=-1, quantity=-item_to_delete['quantity'], disquantity=-item_to_delete['disquantity'])
         
         conn_del.commit()
+        invalidate_reference_data('products', store_id=item_store_id)
+        if order_row_deleted:
+            publish_event(item_store_id, 'order-deleted', {'id': item_id, 'order_id': item_to_delete['order_id'],
+                                                           'barcode_id': item_to_delete['barcode_id'], 'products_id': item_to_delete['products_id'],
+                                                           'email': item_to_delete['email']})
         flash(f'ลบรายการ ID {item_id} ออกจากคำสั่งซื้อ {item_to_delete["order_id"]} สำเร็จแล้ว! สต็อกสินค้าได้รับการคืนแล้ว.', 'success')
     except mysql.connector.Error as err:
         flash(f"เกิดข้อผิดพลาดในการลบรายการ: {err}", 'danger')
@@ -2080,15 +2972,377 @@ def delete_cart_item(item_id):
             conn_del.close()
     return redirect(url_for('cart'))
 
-# --- Route to manage package returns (bin) ---
-@app.route("/bin", methods=["GET", "POST"])
-@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
-def bin():
-    conn = get_db_connection()
-    cursor = None # Initialize cursor to None
-    orders_data = [] # Data for order items to display
-    barcode_id_filter = request.args.get('barcode_id_filter', '') # For GET requests (search/reset)
-    request_form_data = {} # Stores POST form data to persist values in the form
+# --- Disposal helpers (shared by /bin and /bin/batch) ---
+app.config['BIN_BATCH_MAX_ITEMS'] = 100
+
+# Returned packages are appended to tbl_disposal_events (order row, barcode, product,
+# category, store, kiosk, time) instead of being added to tbl_order.disquantity in place.
+# tbl_order.disquantity holds the compacted total: compact_disposals() folds pending
+# events (compacted = 0) into it, the statistics counters and the bin fill levels, in the
+# background after scans and before any path that edits or deletes an order row. The
+# current disquantity of a row is tbl_order.disquantity plus its pending events.
+app.config['DISPOSAL_COMPACT_INTERVAL'] = int(os.environ.get('DISPOSAL_COMPACT_INTERVAL', 10)) # seconds between background compactions
+app.config['DISPOSAL_COMPACT_BATCH'] = 1000 # order rows folded per compaction pass
+
+PENDING_DISPOSALS_SQL = "(SELECT COALESCE(SUM(e.quantity), 0) FROM tbl_disposal_events e WHERE e.compacted = 0 AND e.order_row_id = o.id)"
+
+def pending_disposals(cursor, order_row_ids):
+    """Returns {tbl_order.id: packages in not yet compacted events} for the given order rows."""
+    order_row_ids = list(order_row_ids)
+    if not order_row_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(order_row_ids))
+    cursor.execute(f"""
+        SELECT order_row_id, SUM(quantity) AS pending
+        FROM tbl_disposal_events
+        WHERE compacted = 0 AND order_row_id IN ({placeholders})
+        GROUP BY order_row_id
+    """, tuple(order_row_ids))
+    return {row['order_row_id']: int(row['pending']) for row in cursor.fetchall()}
+
+def compact_disposals(cursor, order_row_ids=None, bins=None):
+    """
+    Folds pending disposal events into tbl_order.disquantity, the statistics counters and
+    the bin fill levels, inside the caller's transaction: the events of `order_row_ids`, or of up to
+    DISPOSAL_COMPACT_BATCH order rows when None. The order rows are locked first, in id
+    order like apply_disposals(), so no event of those rows can be added meanwhile.
+    Events of order rows that no longer exist are only marked compacted. `bins`, when
+    given, is a set that receives the (store_id, kiosk_id, category_id) of every bin filled.
+    Returns the number of events folded.
+    """
+    if order_row_ids is None:
+        cursor.execute("SELECT DISTINCT order_row_id FROM tbl_disposal_events WHERE compacted = 0 ORDER BY order_row_id LIMIT %s",
+                       (app.config['DISPOSAL_COMPACT_BATCH'],))
+        order_row_ids = [row['order_row_id'] for row in cursor.fetchall()]
+    order_row_ids = sorted({int(order_row_id) for order_row_id in order_row_ids})
+    if not order_row_ids:
+        return 0
+
+    placeholders = ', '.join(['%s'] * len(order_row_ids))
+    cursor.execute(f"SELECT id, email FROM tbl_order WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE", tuple(order_row_ids))
+    emails = {row['id']: row['email'] for row in cursor.fetchall()}
+    cursor.execute(f"""
+        SELECT order_row_id, SUM(quantity) AS total, COUNT(*) AS events
+        FROM tbl_disposal_events
+        WHERE compacted = 0 AND order_row_id IN ({placeholders})
+        GROUP BY order_row_id
+        FOR UPDATE
+    """, tuple(order_row_ids))
+    totals = cursor.fetchall()
+    if not totals:
+        return 0
+
+    increments = {row['order_row_id']: int(row['total']) for row in totals if row['order_row_id'] in emails and row['total']}
+    if increments:
+        case_parts = ' '.join(['WHEN %s THEN %s'] * len(increments))
+        case_params = [value for pair in increments.items() for value in pair]
+        id_placeholders = ', '.join(['%s'] * len(increments))
+        cursor.execute(f"""
+            UPDATE tbl_order
+            SET disquantity = disquantity + CASE id {case_parts} END
+            WHERE id IN ({id_placeholders})
+        """, (*case_params, *increments.keys()))
+
+        increments_by_email = {}
+        for order_row_id, amount in increments.items():
+            email = emails[order_row_id]
+            increments_by_email[email] = increments_by_email.get(email, 0) + amount
+        for email, amount in increments_by_email.items():
+            record_order_change(cursor, email, disquantity=amount)
+
+    # Packages land in the bins even when their order row was deleted meanwhile
+    cursor.execute(f"""
+        SELECT store_id, kiosk_id, category_id, SUM(quantity) AS packages
+        FROM tbl_disposal_events
+        WHERE compacted = 0 AND order_row_id IN ({placeholders}) AND store_id IS NOT NULL AND category_id IS NOT NULL
+        GROUP BY store_id, kiosk_id, category_id
+    """, tuple(order_row_ids))
+    bin_increments = {(row['store_id'], row['kiosk_id'], row['category_id']): int(row['packages']) for row in cursor.fetchall()}
+    fill_bins(cursor, bin_increments)
+    if bins is not None:
+        bins.update(bin_increments)
+
+    cursor.execute(f"UPDATE tbl_disposal_events SET compacted = 1 WHERE compacted = 0 AND order_row_id IN ({placeholders})", tuple(order_row_ids))
+    return sum(int(row['events']) for row in totals)
+
+def log_disposal_adjustment(cursor, order_row_id, delta):
+    """
+    Appends an already-applied ('adjust') event for a manual change of tbl_order.disquantity,
+    so the event log keeps adding up to it. Call after the order row was written.
+    """
+    if not delta:
+        return
+    cursor.execute("""
+        INSERT INTO tbl_disposal_events (order_row_id, barcode_id, products_id, category_id, store_id, kiosk_id, quantity, source, compacted)
+        SELECT o.id, o.barcode_id, o.products_id, p.category_id, o.store_id, 'web', %s, 'adjust', 1
+        FROM tbl_order o
+        LEFT JOIN tbl_products p ON o.products_id = p.products_id
+        WHERE o.id = %s
+    """, (delta, order_row_id))
+
+_disposal_compaction = {'last_run': float('-inf'), 'running': False, 'dirty': False}
+_disposal_compaction_lock = threading.Lock()
+
+def schedule_disposal_compaction():
+    """
+    Makes sure a background compaction pass runs soon: at once when none ran in the
+    last DISPOSAL_COMPACT_INTERVAL seconds, else when the interval expires. A call
+    during a pass marks it dirty, so one more pass follows and the last scans of a
+    burst are never left pending. Called after scans commit, so the kiosk never waits.
+    """
+    now = time.monotonic()
+    with _disposal_compaction_lock:
+        if _disposal_compaction['running']:
+            _disposal_compaction['dirty'] = True
+            return
+        _disposal_compaction['running'] = True
+        delay = max(0.0, _disposal_compaction['last_run'] + app.config['DISPOSAL_COMPACT_INTERVAL'] - now)
+    threading.Thread(target=_run_disposal_compaction, args=(delay,), name='disposal-compaction', daemon=True).start()
+
+def _run_disposal_compaction(delay):
+    # Passes run at most once per interval and continue while they find events or are marked dirty
+    try:
+        while True:
+            if delay:
+                time.sleep(delay)
+            with _disposal_compaction_lock:
+                _disposal_compaction.update(last_run=time.monotonic(), dirty=False)
+            folded = _compact_disposal_batch()
+            with _disposal_compaction_lock:
+                if not folded and not _disposal_compaction['dirty']:
+                    _disposal_compaction['running'] = False
+                    return
+            delay = app.config['DISPOSAL_COMPACT_INTERVAL']
+    except BaseException:
+        with _disposal_compaction_lock:
+            _disposal_compaction['running'] = False
+        raise
+
+def _compact_disposal_batch():
+    """Runs one compaction pass in its own transaction. Returns the number of events folded."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return 0
+        cursor = conn.cursor(dictionary=True)
+        bins = set()
+        folded = compact_disposals(cursor, bins=bins)
+        conn.commit()
+        publish_bin_levels(cursor, bins)
+        return folded
+    except mysql.connector.Error as err:
+        print(f"Error compacting disposal events: {err}")
+        if conn:
+            conn.rollback()
+        return 0
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+# --- Bin fill levels ---
+# tbl_bin_levels counts the packages in each bin (store, kiosk, category) since it was
+# last emptied. The counts are added by compact_disposals() from the events it folds,
+# one multi-row upsert per pass, so scans never write them; levels trail the scans by
+# about one DISPOSAL_COMPACT_INTERVAL plus the pass itself (see
+# schedule_disposal_compaction()), and emptying a bin compacts its pending events first.
+# needs_collection is a stored generated column (fill_count >= collect_at) with its own
+# index, so the collection list is an index lookup rather than a scan of tbl_order.
+app.config['BIN_DEFAULT_CAPACITY'] = int(os.environ.get('BIN_DEFAULT_CAPACITY', 200)) # packages per bin
+app.config['BIN_COLLECT_RATIO'] = float(os.environ.get('BIN_COLLECT_RATIO', 0.8)) # fill ratio at which a new bin is due for collection
+
+def fill_bins(cursor, increments):
+    """
+    Adds packages to bin fill levels inside the caller's transaction.
+    `increments` maps (store_id, kiosk_id, category_id) -> packages; bins seen for the
+    first time get the default capacity and threshold.
+    """
+    increments = {key: packages for key, packages in increments.items() if packages}
+    if not increments:
+        return
+    capacity = app.config['BIN_DEFAULT_CAPACITY']
+    collect_at = max(1, int(capacity * app.config['BIN_COLLECT_RATIO']))
+    values_sql = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(increments))
+    params = [value for (store_id, kiosk_id, category_id), packages in sorted(increments.items())
+              for value in (store_id, kiosk_id, category_id, packages, packages, capacity, collect_at)]
+    cursor.execute(f"""
+        INSERT INTO tbl_bin_levels (store_id, kiosk_id, category_id, fill_count, total_count, capacity, collect_at)
+        VALUES {values_sql}
+        ON DUPLICATE KEY UPDATE fill_count = fill_count + VALUES(fill_count),
+                                total_count = total_count + VALUES(total_count)
+    """, tuple(params))
+    mark_bins_used(cursor, {category_id for _, _, category_id in increments})
+
+def mark_bins_used(cursor, categories):
+    """
+    Sets the legacy global tbl_bin flag of the given categories, writing only flags that
+    are still 0. Called from compaction only: scans no longer touch tbl_bin.
+    """
+    categories = list(categories)
+    if not categories:
+        return
+    # Plain (non-locking) read first: once a flag is set, its row is never locked again
+    cat_placeholders = ', '.join(['%s'] * len(categories))
+    cursor.execute(f"SELECT category_id FROM tbl_bin WHERE value = 0 AND category_id IN ({cat_placeholders})", tuple(categories))
+    unset = [row['category_id'] for row in cursor.fetchall()]
+    if unset:
+        # Assuming tbl_bin is not store-specific for simplicity
+        cat_placeholders = ', '.join(['%s'] * len(unset))
+        cursor.execute(f"UPDATE tbl_bin SET value = 1 WHERE category_id IN ({cat_placeholders})", tuple(unset))
+
+def lock_order_lines(cursor, store_id, pairs):
+    """
+    Locks the order rows of one store matching (barcode_id, products_id) pairs, in id order,
+    and returns {(barcode_id, products_id): row} for the first matching row of each pair.
+    The rows are locked (not written) so concurrent scans of the same order cannot both
+    pass the quantity check. Only tbl_order rows are locked: the product categories are
+    read without locks, so scans of a popular product from different orders (and cart
+    adds or stock edits of it) do not queue on its tbl_products row. Order rows whose
+    product no longer exists are left out. Each row's 'disquantity' includes its pending events.
+    """
+    wanted = set(pairs)
+    if not wanted:
+        return {}
+    barcodes = sorted({barcode_id for barcode_id, _ in wanted})
+    product_ids = sorted({products_id for _, products_id in wanted})
+    barcode_placeholders = ', '.join(['%s'] * len(barcodes))
+    product_placeholders = ', '.join(['%s'] * len(product_ids))
+    cursor.execute(f"""
+        SELECT id, barcode_id, quantity, disquantity, products_name, products_id, email
+        FROM tbl_order
+        WHERE store_id = %s AND barcode_id IN ({barcode_placeholders}) AND products_id IN ({product_placeholders})
+        ORDER BY id
+        FOR UPDATE
+    """, (store_id, *barcodes, *product_ids))
+    order_rows = cursor.fetchall()
+    cursor.execute(f"SELECT products_id, category_id FROM tbl_products WHERE products_id IN ({product_placeholders})", tuple(product_ids))
+    categories = {}
+    for row in cursor.fetchall():
+        categories.setdefault(row['products_id'], row['category_id'])
+    lines = {}
+    for row in order_rows:
+        key = (row['barcode_id'], row['products_id'])
+        if key in wanted and row['products_id'] in categories:
+            row['category_id'] = categories[row['products_id']]
+            lines.setdefault(key, row) # First matching order row per product, as in the single scan
+    pending = pending_disposals(cursor, [row['id'] for row in lines.values()])
+    for row in lines.values():
+        row['disquantity'] += pending.get(row['id'], 0)
+    return lines
+
+def disposal_result(line, products_id, requested):
+    """
+    Checks `requested` packages against a locked order line (see lock_order_lines()) and
+    returns the per-item result dict used by the disposal APIs: applied never takes
+    disquantity past quantity. The caller adds result['applied'] to line['disquantity'].
+    """
+    result = {'products_id': products_id, 'requested': requested, 'applied': 0}
+    if requested <= 0:
+        result['status'] = 'invalid_count'
+    elif not line:
+        result['status'] = 'not_found'
+    elif line['category_id'] is None:
+        result['status'] = 'no_category'
+        result['products_name'] = line['products_name']
+    else:
+        applied = max(min(requested, line['quantity'] - line['disquantity']), 0)
+        result.update({
+            'products_name': line['products_name'],
+            'category_id': line['category_id'],
+            'quantity': line['quantity'],
+            'applied': applied,
+            'disquantity': line['disquantity'] + applied,
+        })
+        if applied <= 0:
+            result['status'] = 'exceeds_quantity'
+        else:
+            result['status'] = 'ok' if applied == requested else 'partial'
+    return result
+
+def insert_disposal_events(cursor, store_id, kiosk_id, events, chunk_size=1000):
+    """
+    Appends disposal events, and their coin credits (see record_payout_credits()), with
+    multi-row INSERTs of up to `chunk_size` rows. `events` holds (order_row_id, barcode_id,
+    products_id, category_id, packages, created_at) tuples; created_at None means now.
+    Returns the amount credited.
+    """
+    for start in range(0, len(events), chunk_size):
+        chunk = events[start:start + chunk_size]
+        values_sql = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP(3)))'] * len(chunk))
+        params = [value for order_row_id, barcode_id, products_id, category_id, packages, created_at in chunk
+                  for value in (order_row_id, barcode_id, products_id, category_id, store_id, kiosk_id, packages, created_at)]
+        cursor.execute(f"""
+            INSERT INTO tbl_disposal_events (order_row_id, barcode_id, products_id, category_id, store_id, kiosk_id, quantity, created_at)
+            VALUES {values_sql}
+        """, tuple(params))
+    return record_payout_credits(cursor, store_id, kiosk_id,
+                                 [(order_row_id, barcode_id, packages, created_at)
+                                  for order_row_id, barcode_id, _, _, packages, created_at in events], chunk_size)
+
+def apply_disposals(cursor, barcode_id, store_id, counts, kiosk_id='web', owners=None):
+    """
+    Records disposal counts for one order barcode as appended disposal events (one
+    multi-row INSERT). `counts` maps products_id -> number of packages returned.
+    disquantity never exceeds quantity: items are applied up to the remaining quantity
+    (counting pending events) and reported as 'partial'.
+    The caller owns the transaction (commit/rollback) and should call
+    schedule_disposal_compaction() after committing.
+    Returns a list of per-item result dicts in the order of `counts`; `owners`, when
+    given, receives the id and email of each order line applied (for publish_disposals()).
+    """
+    product_ids = list(counts)
+    if not product_ids:
+        return []
+
+    lines = lock_order_lines(cursor, store_id, [(barcode_id, products_id) for products_id in product_ids])
+    results = []
+    events = [] # (order_row_id, barcode_id, products_id, category_id, packages, created_at)
+    for products_id in product_ids:
+        line = lines.get((barcode_id, products_id))
+        result = disposal_result(line, products_id, counts[products_id])
+        if result['applied']:
+            line['disquantity'] += result['applied']
+            events.append((line['id'], barcode_id, products_id, line['category_id'], result['applied'], None))
+            if owners is not None:
+                owners[(barcode_id, products_id)] = {'id': line['id'], 'email': line['email']}
+        results.append(result)
+
+    insert_disposal_events(cursor, store_id, kiosk_id, events)
+    return results
+
+def parse_disposal_items(items):
+    """
+    Normalises a JSON list of {"products_id": ..., "count": ...} objects or [products_id, count]
+    pairs into a {products_id: count} dict, summing duplicates. Raises ValueError on bad input.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("items ต้องเป็นรายการที่ไม่ว่าง")
+    counts = {}
+    for entry in items:
+        if isinstance(entry, dict):
+            products_id, count = entry.get('products_id'), entry.get('count', 1)
+        elif isinstance(entry, (list, tuple)) and len(entry) == 2:
+            products_id, count = entry
+        else:
+            raise ValueError(f"รูปแบบรายการไม่ถูกต้อง: {entry!r}")
+        if not products_id or isinstance(count, bool) or not isinstance(count, int):
+            raise ValueError(f"รูปแบบรายการไม่ถูกต้อง: {entry!r}")
+        products_id = str(products_id)
+        counts[products_id] = counts.get(products_id, 0) + count
+    return counts
+
+# --- Route to manage package returns (bin) ---
+@app.route("/bin", methods=["GET", "POST"])
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def bin():
+    conn = get_db_connection()
+    cursor = None # Initialize cursor to None
+    orders_data = [] # Data for order items to display
+    barcode_id_filter = request.args.get('barcode_id_filter', '') # For GET requests (search/reset)
+    request_form_data = {} # Stores POST form data to persist values in the form
 
     current_user_store_id = session.get('store_id')
     if not current_user_store_id and session.get('role') in ['moderator', 'member', 'viewer']:
@@ -2117,44 +3371,19 @@ def bin():
 
         try:
             cursor = conn.cursor(dictionary=True) # Open cursor here for this action
-            # Search for the item in tbl_order matching barcode_id and products_id AND store_id
-            cursor.execute("""
-                SELECT o.id, o.quantity, o.disquantity, o.products_name, o.products_id, p.stock, p.category_id, o.store_id
-                FROM tbl_order o
-                JOIN tbl_products p ON o.products_id = p.products_id
-                WHERE o.barcode_id = %s AND o.products_id = %s AND o.store_id = %s
-            """, (barcode_id_to_search, products_id_to_disquantity, current_user_store_id)) # Filter by store_id
-            order_item_to_update_raw = cursor.fetchone()
-
-            if order_item_to_update_raw:
-                order_item_to_update = order_item_to_update_raw.copy()
-                # Ensure stock is converted to int
-                order_item_to_update['stock'] = int(order_item_to_update['stock'] or 0)
-
-                current_quantity = order_item_to_update['quantity']
-                current_disquantity = order_item_to_update['disquantity']
-                product_id = order_item_to_update['products_id']
-                category_id_for_bin = order_item_to_update.get('category_id')
-
-                if category_id_for_bin is None:
-                    flash(f"ไม่พบ category_id สำหรับสินค้า '{order_item_to_update['products_name']}'. ไม่สามารถอัปเดต bin ได้.", 'danger')
-                    return redirect(url_for('bin', barcode_id_filter=barcode_id_filter))
-
-                proposed_disquantity = current_disquantity + 1
-                
-                # Check if the proposed disquantity does not exceed the total quantity
-                if proposed_disquantity <= current_quantity:
-                    # Update disquantity in tbl_order
-                    cursor.execute("UPDATE tbl_order SET disquantity = %s WHERE id = %s",
-                                   (proposed_disquantity, order_item_to_update['id']))
-                    
-                    # UPDATED: Set value in tbl_bin to 1 where category_id matches the product's category_id AND store_id
-                    cursor.execute("UPDATE tbl_bin SET value = 1 WHERE category_id = %s", # Assuming tbl_bin is not store-specific for simplicity
-                                   (category_id_for_bin,))
-                    conn.commit()
-                    flash(f"เพิ่มจำนวนทิ้งสินค้า '{order_item_to_update['products_name']}' (รหัสสินค้า: {products_id_to_disquantity}) สำเร็จ. สถานะ bin (category_id: {category_id_for_bin}) ได้รับการอัปเดตแล้ว.", 'success')
-                else:
-                    flash(f"ไม่สามารถเพิ่มจำนวนทิ้งได้เกินจำนวนสินค้าที่มีอยู่ ({current_quantity} ชิ้น) สำหรับสินค้า '{order_item_to_update['products_name']}'", 'danger')
+            # Increment disquantity by 1 for the item matching barcode_id and products_id AND store_id
+            owners = {}
+            result = apply_disposals(cursor, barcode_id_to_search, current_user_store_id, {products_id_to_disquantity: 1}, owners=owners)[0]
+
+            if result['status'] == 'ok':
+                conn.commit()
+                schedule_disposal_compaction()
+                publish_disposals(current_user_store_id, 'web', [result], barcode_id_to_search, owners)
+                flash(f"เพิ่มจำนวนทิ้งสินค้า '{result['products_name']}' (รหัสสินค้า: {products_id_to_disquantity}) สำเร็จ. สถานะ bin (category_id: {result['category_id']}) ได้รับการอัปเดตแล้ว.", 'success')
+            elif result['status'] == 'no_category':
+                flash(f"ไม่พบ category_id สำหรับสินค้า '{result['products_name']}'. ไม่สามารถอัปเดต bin ได้.", 'danger')
+            elif result['status'] == 'exceeds_quantity':
+                flash(f"ไม่สามารถเพิ่มจำนวนทิ้งได้เกินจำนวนสินค้าที่มีอยู่ ({result['quantity']} ชิ้น) สำหรับสินค้า '{result['products_name']}'", 'danger')
             else:
                 flash("ไม่พบรายการสินค้าที่ตรงกันสำหรับรหัสบาร์โค้ดและรหัสสินค้าที่ระบุในร้านค้าของคุณ.", 'danger')
         except mysql.connector.Error as err:
@@ -2175,7 +3404,8 @@ def bin():
         if barcode_id_filter:
             # ดึงเฉพาะรายการที่มี barcode_id ตรงกับ filter และ store_id ของผู้ใช้
             base_query = """
-                SELECT o.*, p.price, p.products_name, p.category_id, s.store_name
+                SELECT o.*, p.price, p.products_name, p.category_id, s.store_name,
+                       """ + PENDING_DISPOSALS_SQL + """ AS pending_disquantity
                 FROM tbl_order o
                 JOIN tbl_products p ON o.products_id = p.products_id
                 LEFT JOIN tbl_stores s ON o.store_id = s.store_id
@@ -2196,6 +3426,7 @@ def bin():
             for o_raw in orders_data_raw:
                 o = o_raw.copy()
                 o['price'] = float(o['price'] or 0.0) # Convert price to float, default 0.0
+                o['disquantity'] += int(o.pop('pending_disquantity') or 0) # Scans not yet compacted into tbl_order
                 orders_data.append(o)
 
         else:
@@ -2218,6 +3449,423 @@ def bin():
                            current_auto_order_id=current_auto_order_id # อาจจะเอาออกไปเลยก็ได้
                            )
 
+# --- Batch disposal API for the return kiosk ---
+@app.route("/bin/batch", methods=["POST"])
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def bin_batch():
+    """
+    Applies a whole bag of scanned packages for one order barcode in a single transaction.
+    Expects JSON: {"barcode_id": "...", "items": [{"products_id": "P001", "count": 3}, ...]}
+    Returns per-item results; nothing is written if no item can be applied.
+    """
+    payload = request.get_json(silent=True) or {}
+    barcode_id = str(payload.get('barcode_id') or '').strip()
+    if not barcode_id:
+        return jsonify({'error': 'กรุณาระบุ barcode_id'}), 400
+    try:
+        counts = parse_disposal_items(payload.get('items'))
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+    if len(counts) > app.config['BIN_BATCH_MAX_ITEMS']:
+        return jsonify({'error': f"จำนวนรายการเกินกำหนด ({app.config['BIN_BATCH_MAX_ITEMS']})"}), 400
+
+    current_user_store_id = session.get('store_id')
+    if not current_user_store_id:
+        return jsonify({'error': 'คุณยังไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ.'}), 400
+
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        owners = {}
+        results = apply_disposals(cursor, barcode_id, current_user_store_id, counts, owners=owners)
+        applied_total = sum(result['applied'] for result in results)
+        if applied_total:
+            conn.commit()
+            schedule_disposal_compaction()
+            publish_disposals(current_user_store_id, 'web', results, barcode_id, owners)
+        else:
+            conn.rollback()
+        return jsonify({'barcode_id': barcode_id, 'applied_total': applied_total,
+                        'payout_amount': float(applied_total * app.config['PAYOUT_RATE_PER_PACKAGE']), 'results': results})
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดำเนินการ: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+# --- Asynchronous scan ingestion for the return kiosk ---
+# The kiosk posts scans with its own idempotency key and gets an answer as soon as the
+# scan is in the local journal (SQLite); worker threads apply the scans with
+# apply_disposals(), one at a time per store and barcode in arrival order. tbl_kiosk_scans
+# records every key applied to the database in the same transaction as its disposal
+# events, so a key is applied once even if it is retried or replayed after a restart.
+app.config['KIOSK_SCAN_JOURNAL_PATH'] = os.environ.get('KIOSK_SCAN_JOURNAL_PATH', os.path.join(app.instance_path, 'kiosk_scans.sqlite3'))
+app.config['KIOSK_SCAN_WORKERS'] = int(os.environ.get('KIOSK_SCAN_WORKERS', 2))
+app.config['KIOSK_SCAN_RETENTION'] = int(os.environ.get('KIOSK_SCAN_RETENTION', 604800)) # seconds finished scans stay in the journal
+app.config['KIOSK_SCAN_MAX_BATCH'] = 200 # scans per request
+app.config['KIOSK_SCAN_MAX_WAIT'] = 10 # seconds GET /kiosk/scans/<key>?wait= may block
+
+KIOSK_SCAN_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_.:-]{8,64}$')
+KIOSK_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.:-]{1,64}$')
+
+_scan_queue = None
+
+def get_scan_queue():
+    """
+    Returns the process-wide kiosk scan queue, starting its workers (and replaying
+    unfinished scans) on first use. start_background_services() calls it when the
+    process starts, so the replay does not wait for the first kiosk request.
+    """
+    global _scan_queue
+    if _scan_queue is None:
+        with _db_pool_lock:
+            if _scan_queue is None:
+                journal = ScanJournal(app.config['KIOSK_SCAN_JOURNAL_PATH'], retention=app.config['KIOSK_SCAN_RETENTION'])
+                queue = ScanQueue(journal, apply_kiosk_scan, workers=app.config['KIOSK_SCAN_WORKERS'])
+                queue.start()
+                _scan_queue = queue
+    return _scan_queue
+
+def apply_kiosk_scan(record):
+    """
+    Writes one journaled scan to the database (called by the scan queue workers).
+    Returns (status, result); a key already in tbl_kiosk_scans returns the stored outcome
+    without applying anything. Raises on database errors so the queue retries.
+    """
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Could not connect to DB.")
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            # Claims the key first: a concurrent attempt with the same key waits here and then fails
+            cursor.execute("INSERT INTO tbl_kiosk_scans (store_id, scan_key, kiosk_id, barcode_id) VALUES (%s, %s, %s, %s)",
+                           (record['store_id'], record['key'], record['kiosk_id'], record['barcode_id']))
+        except mysql.connector.IntegrityError:
+            conn.rollback()
+            cursor.execute("SELECT status, result FROM tbl_kiosk_scans WHERE store_id = %s AND scan_key = %s",
+                           (record['store_id'], record['key']))
+            stored = cursor.fetchone()
+            return stored['status'], json.loads(stored['result'] or '{}')
+
+        owners = {}
+        results = apply_disposals(cursor, record['barcode_id'], record['store_id'], record['items'], kiosk_id=record['kiosk_id'], owners=owners)
+        applied_total = sum(result['applied'] for result in results)
+        status = SCAN_APPLIED if applied_total else SCAN_REJECTED
+        result = {'applied_total': applied_total, 'payout_amount': float(applied_total * app.config['PAYOUT_RATE_PER_PACKAGE']), 'results': results}
+        cursor.execute("UPDATE tbl_kiosk_scans SET status = %s, applied_total = %s, result = %s WHERE store_id = %s AND scan_key = %s",
+                       (status, applied_total, json.dumps(result, ensure_ascii=False), record['store_id'], record['key']))
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+    if applied_total:
+        schedule_disposal_compaction()
+        publish_disposals(record['store_id'], record['kiosk_id'], results, record['barcode_id'], owners)
+    return status, result
+
+def kiosk_scan_state(record):
+    """The JSON form of a journal record returned to the kiosk."""
+    state = {'key': record['key'], 'barcode_id': record['barcode_id'], 'status': record['status']}
+    if record['status'] != SCAN_QUEUED and record['result'] is not None:
+        state['result'] = record['result']
+    return state
+
+@app.route("/kiosk/scans", methods=["POST"])
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def kiosk_scans():
+    """
+    Accepts scans from a return kiosk and answers before they are written to the database.
+    Expects JSON: {"kiosk_id": "pi-01", "scans": [{"key": "...", "barcode_id": "...", "items": [...]}, ...]}
+    or a single scan object (its key may also come from the Idempotency-Key header).
+    `items` has the /bin/batch format. Every scan is answered with its state: 'queued' for a
+    new key, and the stored state (with its result once finished) for a key seen before, so
+    a retried request never applies a scan twice. Returns 202 when anything was queued.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'ต้องส่งข้อมูลแบบ JSON'}), 400
+    kiosk_id = str(payload.get('kiosk_id') or 'kiosk')
+    if not KIOSK_ID_PATTERN.match(kiosk_id):
+        return jsonify({'error': 'kiosk_id ไม่ถูกต้อง'}), 400
+    if 'scans' in payload:
+        scans = payload['scans']
+        if not isinstance(scans, list) or not scans:
+            return jsonify({'error': 'scans ต้องเป็นรายการที่ไม่ว่าง'}), 400
+    else:
+        scans = [dict(payload, key=payload.get('key') or request.headers.get('Idempotency-Key'))]
+    if len(scans) > app.config['KIOSK_SCAN_MAX_BATCH']:
+        return jsonify({'error': f"จำนวนรายการเกินกำหนด ({app.config['KIOSK_SCAN_MAX_BATCH']})"}), 400
+
+    current_user_store_id = session.get('store_id')
+    if not current_user_store_id:
+        return jsonify({'error': 'คุณยังไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ.'}), 400
+
+    queue = get_scan_queue()
+    states = []
+    any_queued = False
+    for scan in scans:
+        scan = scan if isinstance(scan, dict) else {}
+        key = str(scan.get('key') or '')
+        barcode_id = str(scan.get('barcode_id') or '').strip()
+        if not KIOSK_SCAN_KEY_PATTERN.match(key):
+            states.append({'key': key, 'status': 'invalid', 'error': 'key ต้องเป็นตัวอักษร ตัวเลข หรือ _.:- ยาว 8-64 ตัว'})
+            continue
+        if not barcode_id:
+            states.append({'key': key, 'status': 'invalid', 'error': 'กรุณาระบุ barcode_id'})
+            continue
+        try:
+            counts = parse_disposal_items(scan.get('items'))
+        except ValueError as err:
+            states.append({'key': key, 'status': 'invalid', 'error': str(err)})
+            continue
+        if len(counts) > app.config['BIN_BATCH_MAX_ITEMS']:
+            states.append({'key': key, 'status': 'invalid', 'error': f"จำนวนรายการเกินกำหนด ({app.config['BIN_BATCH_MAX_ITEMS']})"})
+            continue
+        queued, record = queue.submit(int(current_user_store_id), key, kiosk_id, barcode_id, counts)
+        any_queued = any_queued or queued
+        states.append(kiosk_scan_state(record))
+    return jsonify({'kiosk_id': kiosk_id, 'scans': states}), 202 if any_queued else 200
+
+@app.route("/kiosk/scans/<scan_key>")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def kiosk_scan_status(scan_key):
+    """
+    Returns the state of one scan of the user's store. With ?wait=N (seconds, at most
+    KIOSK_SCAN_MAX_WAIT) the answer is held until the scan is no longer queued.
+    Scans no longer in the local journal are looked up in tbl_kiosk_scans.
+    """
+    current_user_store_id = session.get('store_id')
+    if not current_user_store_id or not KIOSK_SCAN_KEY_PATTERN.match(scan_key):
+        return jsonify({'error': 'ไม่พบรายการสแกน'}), 404
+    wait = min(max(request.args.get('wait', 0, type=float), 0), app.config['KIOSK_SCAN_MAX_WAIT'])
+    queue = get_scan_queue()
+    if wait:
+        record = queue.wait(int(current_user_store_id), scan_key, wait)
+    else:
+        record = queue.journal.get(int(current_user_store_id), scan_key)
+    if record:
+        return jsonify(kiosk_scan_state(record))
+
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT barcode_id, status, result FROM tbl_kiosk_scans WHERE store_id = %s AND scan_key = %s",
+                       (current_user_store_id, scan_key))
+        stored = cursor.fetchone()
+        if not stored:
+            return jsonify({'error': 'ไม่พบรายการสแกน'}), 404
+        return jsonify({'key': scan_key, 'barcode_id': stored['barcode_id'], 'status': stored['status'],
+                        'result': json.loads(stored['result'] or '{}')})
+    except mysql.connector.Error as err:
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดึงข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+# --- Offline kiosk support: order lines for the local buffer and bulk sync ---
+app.config['KIOSK_SYNC_MAX_EVENTS'] = int(os.environ.get('KIOSK_SYNC_MAX_EVENTS', 5000)) # events per /kiosk/sync request
+app.config['KIOSK_SYNC_CHUNK_SIZE'] = 1000 # rows per multi-row INSERT / key lookup
+
+DISPOSAL_CONFLICT_STATUSES = ('partial', 'exceeds_quantity', 'not_found', 'no_category', 'invalid_count')
+
+@app.route("/kiosk/orders/<barcode_id>")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def kiosk_order_lines(barcode_id):
+    """
+    Returns the lines of one order of the user's store (first row per product, as the
+    scan paths use) with their current disquantity, for the kiosk's offline buffer.
+    """
+    current_user_store_id = session.get('store_id')
+    if not current_user_store_id:
+        return jsonify({'error': 'คุณยังไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ.'}), 400
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT o.products_id, o.products_name, o.quantity,
+                   o.disquantity + """ + PENDING_DISPOSALS_SQL + """ AS disquantity
+            FROM tbl_order o
+            WHERE o.barcode_id = %s AND o.store_id = %s
+            ORDER BY o.id
+        """, (barcode_id, current_user_store_id))
+        lines = {}
+        for row in cursor.fetchall():
+            lines.setdefault(row['products_id'], dict(row, disquantity=int(row['disquantity'])))
+        if not lines:
+            return jsonify({'error': 'ไม่พบคำสั่งซื้อ'}), 404
+        return jsonify({'barcode_id': barcode_id, 'lines': list(lines.values())})
+    except mysql.connector.Error as err:
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดึงข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+def _parse_sync_event(event):
+    """Validates one /kiosk/sync event; returns (key, barcode_id, products_id, count, scanned_at) or raises ValueError."""
+    if not isinstance(event, dict):
+        raise ValueError("รูปแบบรายการไม่ถูกต้อง")
+    key = str(event.get('key') or '')
+    if not KIOSK_SCAN_KEY_PATTERN.match(key):
+        raise ValueError("key ต้องเป็นตัวอักษร ตัวเลข หรือ _.:- ยาว 8-64 ตัว")
+    barcode_id = str(event.get('barcode_id') or '').strip()
+    products_id = str(event.get('products_id') or '').strip()
+    count = event.get('count', 1)
+    if not barcode_id or not products_id or isinstance(count, bool) or not isinstance(count, int):
+        raise ValueError("ต้องระบุ barcode_id, products_id และ count (จำนวนเต็ม)")
+    scanned_at = event.get('scanned_at')
+    if scanned_at is not None:
+        if isinstance(scanned_at, bool) or not isinstance(scanned_at, (int, float)):
+            raise ValueError("scanned_at ต้องเป็นเวลาแบบ Unix timestamp")
+        try:
+            scanned_at = datetime.fromtimestamp(scanned_at)
+        except (ValueError, OverflowError, OSError): # NaN, or outside the platform's time range (e.g. 1e20)
+            raise ValueError("scanned_at อยู่นอกช่วงเวลาที่รองรับ")
+        if scanned_at > datetime.now(): # Kiosk clock ahead: record the sync time instead
+            scanned_at = None
+    return key, barcode_id, products_id, count, scanned_at
+
+@app.route("/kiosk/sync", methods=["POST"])
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def kiosk_sync():
+    """
+    Replays scans buffered by an offline kiosk (see kiosk_buffer.py) in one transaction.
+    Expects JSON, oldest event first:
+    {"kiosk_id": "pi-01", "events": [{"key": "...", "barcode_id": "...", "products_id": "...", "count": 1, "scanned_at": 1760000000.0}, ...]}
+
+    Events are checked in order with the rules of /bin (disquantity never exceeds quantity)
+    against order rows locked once for the whole batch, then written with multi-row INSERTs.
+    Keys applied before (by an earlier sync or /kiosk/scans) are answered as 'duplicate'
+    with their stored result. Every event gets an entry in `results`; `conflicts` lists the
+    ones that could not be applied in full.
+    """
+    started = time.perf_counter()
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'ต้องส่งข้อมูลแบบ JSON'}), 400
+    kiosk_id = str(payload.get('kiosk_id') or 'kiosk')
+    if not KIOSK_ID_PATTERN.match(kiosk_id):
+        return jsonify({'error': 'kiosk_id ไม่ถูกต้อง'}), 400
+    events = payload.get('events')
+    if not isinstance(events, list) or not events:
+        return jsonify({'error': 'events ต้องเป็นรายการที่ไม่ว่าง'}), 400
+    if len(events) > app.config['KIOSK_SYNC_MAX_EVENTS']:
+        return jsonify({'error': f"จำนวนรายการเกินกำหนด ({app.config['KIOSK_SYNC_MAX_EVENTS']})"}), 400
+
+    current_user_store_id = session.get('store_id')
+    if not current_user_store_id:
+        return jsonify({'error': 'คุณยังไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ.'}), 400
+
+    results = [None] * len(events)
+    valid = [] # (index, key, barcode_id, products_id, count, scanned_at)
+    seen_keys = set()
+    for index, event in enumerate(events):
+        try:
+            parsed = _parse_sync_event(event)
+        except ValueError as err:
+            results[index] = {'key': str(event.get('key') or '') if isinstance(event, dict) else '', 'status': 'invalid', 'error': str(err)}
+            continue
+        if parsed[0] in seen_keys:
+            results[index] = {'key': parsed[0], 'status': 'invalid', 'error': 'key ซ้ำกับรายการก่อนหน้าในคำขอ'}
+            continue
+        seen_keys.add(parsed[0])
+        valid.append((index, *parsed))
+
+    chunk_size = app.config['KIOSK_SYNC_CHUNK_SIZE']
+    applied_total = 0
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        stored = {}
+        keys = [entry[1] for entry in valid]
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"SELECT scan_key, status, result FROM tbl_kiosk_scans WHERE store_id = %s AND scan_key IN ({placeholders})",
+                           (current_user_store_id, *chunk))
+            stored.update({row['scan_key']: row for row in cursor.fetchall()})
+
+        fresh = [entry for entry in valid if entry[1] not in stored]
+        lines = lock_order_lines(cursor, current_user_store_id, [(barcode_id, products_id) for _, _, barcode_id, products_id, _, _ in fresh])
+        disposal_rows = [] # (order_row_id, barcode_id, products_id, category_id, packages, created_at)
+        scan_rows = []
+        owners = {}
+        for index, key, barcode_id, products_id, count, scanned_at in valid:
+            if key in stored:
+                results[index] = {'key': key, 'barcode_id': barcode_id, 'products_id': products_id, 'status': 'duplicate',
+                                  'scan_status': stored[key]['status'], 'result': json.loads(stored[key]['result'] or '{}')}
+                continue
+            line = lines.get((barcode_id, products_id))
+            result = disposal_result(line, products_id, count)
+            if result['applied']:
+                line['disquantity'] += result['applied']
+                disposal_rows.append((line['id'], barcode_id, products_id, line['category_id'], result['applied'], scanned_at))
+                owners[(barcode_id, products_id)] = {'id': line['id'], 'email': line['email']}
+                applied_total += result['applied']
+            scan_rows.append((current_user_store_id, key, kiosk_id, barcode_id, SCAN_APPLIED if result['applied'] else SCAN_REJECTED,
+                              result['applied'], json.dumps({'applied_total': result['applied'], 'results': [result]}, ensure_ascii=False)))
+            results[index] = dict(result, key=key, barcode_id=barcode_id)
+
+        insert_disposal_events(cursor, current_user_store_id, kiosk_id, disposal_rows, chunk_size)
+        for start in range(0, len(scan_rows), chunk_size):
+            chunk = scan_rows[start:start + chunk_size]
+            values_sql = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(chunk))
+            cursor.execute(f"""
+                INSERT INTO tbl_kiosk_scans (store_id, scan_key, kiosk_id, barcode_id, status, applied_total, result)
+                VALUES {values_sql}
+            """, tuple(value for row in chunk for value in row))
+        conn.commit()
+    except mysql.connector.IntegrityError:
+        # Another request recorded one of these keys meanwhile; a retry answers it as 'duplicate'
+        conn.rollback()
+        return jsonify({'error': 'มีการซิงก์รายการเดียวกันพร้อมกัน กรุณาลองใหม่อีกครั้ง'}), 409
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดำเนินการ: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+    if applied_total:
+        schedule_disposal_compaction()
+        publish_disposals(current_user_store_id, kiosk_id, results, owners=owners)
+    conflicts = [{'key': result['key'], 'status': result['status'], 'requested': result['requested'], 'applied': result['applied']}
+                 for result in results if result['status'] in DISPOSAL_CONFLICT_STATUSES]
+    return jsonify({
+        'kiosk_id': kiosk_id,
+        'received': len(events),
+        'applied_total': applied_total,
+        'payout_amount': float(applied_total * app.config['PAYOUT_RATE_PER_PACKAGE']),
+        'duplicates': sum(1 for result in results if result['status'] == 'duplicate'),
+        'invalid': sum(1 for result in results if result['status'] == 'invalid'),
+        'conflicts': conflicts,
+        'results': results,
+        'elapsed_ms': round(1000 * (time.perf_counter() - started), 1),
+    })
+
 # --- Routes สำหรับแก้ไขและลบรายการในระบบคืนบรรจุภัณฑ์ ---
 # แก้ไขรายการในระบบคืนบรรจุภัณฑ์
 @app.route("/bin/edit/<int:item_id>", methods=["POST"])
@@ -2242,7 +3890,8 @@ def edit_bin_item(item_id):
             flash("คุณยังไม่มีร้านค้าที่ผูกไว้. โปรดติดต่อผู้ดูแลระบบ.", 'danger')
             return redirect(url_for('bin', barcode_id_filter=item_barcode_id))
 
-        # ดึงข้อมูลเก่าของรายการใน tbl_order และข้อมูลสินค้า (รวม store_id)
+        # ดึงข้อมูลเก่าของรายการใน tbl_order และข้อมูลสินค้า (รวม store_id) หลังรวมรายการสแกนที่ค้างอยู่
+        compact_disposals(cursor_edit, [item_id])
         cursor_edit.execute("SELECT quantity, disquantity, store_id, email FROM tbl_order WHERE id = %s", (item_id,))
         old_order_item = cursor_edit.fetchone()
         if not old_order_item:
@@ -2311,11 +3960,21 @@ def edit_bin_item(item_id):
             SET quantity = %s, disquantity = %s
             WHERE id = %s AND order_id = %s AND store_id = %s
         """, (new_quantity, new_disquantity, item_id, original_order_id, current_user_store_id)) # Added store_id to WHERE
+        order_row_updated = cursor_edit.rowcount
         
         # อัปเดตสต็อกใน tbl_products
         cursor_edit.execute("UPDATE tbl_products SET stock = stock + %s WHERE products_id = %s",
                             (total_stock_adjustment, original_product_id))
+        if order_row_updated:
+            record_order_change(cursor_edit, old_order_item['email'], quantity=new_quantity - old_quantity, disquantity=new_disquantity - old_disquantity)
+            log_disposal_adjustment(cursor_edit, item_id, new_disquantity - old_disquantity)
         conn_edit.commit()
+        invalidate_reference_data('products', store_id=current_user_store_id)
+        if order_row_updated:
+            publish_event(current_user_store_id, 'disquantity-changed', {
+                'id': item_id, 'order_id': original_order_id, 'barcode_id': item_barcode_id, 'products_id': original_product_id,
+                'products_name': product_info['products_name'], 'quantity': new_quantity, 'disquantity': new_disquantity,
+                'applied': new_disquantity - old_disquantity, 'kiosk_id': 'web', 'email': old_order_item['email']})
         flash(f'แก้ไขรายการ ID {item_id} (สินค้า: {product_info["products_name"]}) ในคำสั่งซื้อ {original_order_id} สำเร็จแล้ว!', 'success')
     except ValueError:
         flash("จำนวนและทิ้งต้องเป็นตัวเลขที่ถูกต้อง.", 'danger')
@@ -2343,7 +4002,8 @@ def delete_bin_item(item_id):
     try:
         cursor_del = conn_del.cursor(dictionary=True)
         # ดึงข้อมูลรายการที่จะลบ เพื่อคืนสต็อกและเก็บ barcode_id (รวม store_id)
-        cursor_del.execute("SELECT products_id, quantity, order_id, barcode_id, store_id, email FROM tbl_order WHERE id = %s", (item_id,))
+        compact_disposals(cursor_del, [item_id])
+        cursor_del.execute("SELECT products_id, quantity, disquantity, order_id, barcode_id, store_id, email FROM tbl_order WHERE id = %s", (item_id,))
         item_to_delete = cursor_del.fetchone()
         if not item_to_delete:
             flash("ไม่พบรายการที่จะลบ.", 'danger')
@@ -2371,8 +4031,16 @@ def delete_bin_item(item_id):
                             (item_to_delete['quantity'], item_to_delete['products_id']))
         # ลบรายการออกจาก tbl_order
         cursor_del.execute("DELETE FROM tbl_order WHERE id = %s AND store_id = %s", (item_id, item_store_id)) # Added store_id to WHERE
+        order_row_deleted = cursor_del.rowcount
+        if order_row_deleted:
+            record_order_change(cursor_del, item_to_delete['email'], rows=-1, quantity=-item_to_delete['quantity'], disquantity=-item_to_delete['disquantity'])
         
         conn_del.commit()
+        invalidate_reference_data('products', store_id=item_store_id)
+        if order_row_deleted:
+            publish_event(item_store_id, 'order-deleted', {'id': item_id, 'order_id': item_to_delete['order_id'],
+                                                           'barcode_id': item_to_delete['barcode_id'], 'products_id': item_to_delete['products_id'],
+                                                           'email': item_to_delete['email']})
         flash(f'ลบรายการ ID {item_id} ออกจากคำสั่งซื้อ {item_to_delete["order_id"]} สำเร็จแล้ว! สต็อกสินค้าได้รับการคืนแล้ว.', 'success')
     except mysql.connector.Error as err:
         flash(f"เกิดข้อผิดพลาดในการลบรายการ: {err}", 'danger')
@@ -2384,10 +4052,672 @@ def delete_bin_item(item_id):
     
     return redirect(url_for('bin', barcode_id_filter=item_barcode_id))
 
+# --- Disposal event log: maintenance and analytics ---
+@app.cli.command('compact-disposals')
+def compact_disposals_command():
+    """Folds every pending disposal event into tbl_order.disquantity (in passes of DISPOSAL_COMPACT_BATCH order rows)."""
+    conn = get_db_connection()
+    if not conn:
+        print("Error: Could not connect to DB.")
+        sys.exit(1)
+    cursor = conn.cursor(dictionary=True)
+    total = 0
+    try:
+        while True:
+            folded = compact_disposals(cursor)
+            conn.commit()
+            if not folded:
+                break
+            total += folded
+        print(f"{total} disposal events compacted.")
+    except mysql.connector.Error as err:
+        conn.rollback()
+        print(f"Error compacting disposal events: {err}")
+        sys.exit(1)
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.cli.command('check-disposals')
+@click.option('--fix', is_flag=True, help='Append adjustment events so the log adds up to tbl_order.disquantity.')
+def check_disposals_command(fix):
+    """Compares tbl_order.disquantity with the sum of its compacted disposal events."""
+    conn = get_db_connection()
+    if not conn:
+        print("Error: Could not connect to DB.")
+        sys.exit(1)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT o.id, o.disquantity, COALESCE(e.logged, 0) AS logged
+            FROM tbl_order o
+            LEFT JOIN (
+                SELECT order_row_id, SUM(quantity) AS logged
+                FROM tbl_disposal_events
+                WHERE compacted = 1
+                GROUP BY order_row_id
+            ) e ON e.order_row_id = o.id
+            WHERE o.disquantity <> COALESCE(e.logged, 0)
+        """)
+        mismatched = cursor.fetchall()
+        if not mismatched:
+            print("tbl_disposal_events is consistent with tbl_order.")
+            return
+        print(f"{len(mismatched)} order row(s) out of sync: " +
+              ', '.join(f"{row['id']} ({row['logged']} logged, {row['disquantity']} in tbl_order)" for row in mismatched[:50]))
+        if not fix:
+            sys.exit(1)
+        for row in mismatched:
+            log_disposal_adjustment(cursor, row['id'], row['disquantity'] - int(row['logged']))
+        conn.commit()
+        print("Adjustment events appended.")
+    except mysql.connector.Error as err:
+        conn.rollback()
+        print(f"Error checking disposal events: {err}")
+        sys.exit(1)
+    finally:
+        cursor.close()
+        conn.close()
+
+def requested_store_id(store_id=None):
+    """
+    The store a report or action is for: `store_id` (default: the store_id query parameter)
+    for administrators, the user's own store for everyone else.
+    """
+    if session.get('role') in ['root_admin', 'administrator']:
+        return store_id if store_id is not None else request.args.get('store_id', type=int)
+    return session.get('store_id')
+
+@app.route("/disposal_stats")
+@role_required(['root_admin', 'administrator', 'moderator'])
+def disposal_stats():
+    """
+    Returns packages returned per hour and category over the last `hours` hours (max 744)
+    as JSON, from the disposal event log. Administrators may pass store_id.
+    """
+    hours = min(max(request.args.get('hours', 24, type=int), 1), 744)
+    store_id = requested_store_id()
+    if not store_id:
+        return jsonify({'error': 'กรุณาระบุร้านค้า'}), 400
+
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT DATE_FORMAT(created_at, '%%Y-%%m-%%d %%H:00') AS hour, category_id,
+                   SUM(quantity) AS packages, COUNT(*) AS scans
+            FROM tbl_disposal_events
+            WHERE store_id = %s AND source = 'scan' AND created_at >= NOW() - INTERVAL %s HOUR
+            GROUP BY hour, category_id
+            ORDER BY hour, category_id
+        """, (store_id, hours))
+        buckets = [dict(row, packages=int(row['packages'])) for row in cursor.fetchall()]
+        return jsonify({'store_id': store_id, 'hours': hours, 'buckets': buckets})
+    except mysql.connector.Error as err:
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดึงข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+# --- Coin payout ledger ---
+# Every package applied by a scan is credited at PAYOUT_RATE_PER_PACKAGE baht in
+# tbl_payout_ledger, in the scan's own transaction (one appended row per order line and
+# scan). tbl_payout_balances keeps the credited and settled totals per store and kiosk,
+# split over PAYOUT_BALANCE_SLOTS rows like tbl_stat_counters, so a running balance is
+# read from a few rows instead of summing the ledger. settle_payouts() closes a kiosk's
+# unsettled credits into a tbl_payout_batches row when its coins are counted or refilled.
+app.config['PAYOUT_RATE_PER_PACKAGE'] = Decimal(os.environ.get('PAYOUT_RATE_PER_PACKAGE', '1.00')) # baht per package
+app.config['PAYOUT_BALANCE_SLOTS'] = 8
+
+def bump_payout_balance(cursor, store_id, kiosk_id, packages=0, credited=0, settled=0):
+    """Adds to the maintained totals of one kiosk (a random slot) inside the caller's transaction."""
+    cursor.execute("""
+        INSERT INTO tbl_payout_balances (store_id, kiosk_id, slot, packages, credited, settled) VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE packages = packages + VALUES(packages),
+                                credited = credited + VALUES(credited),
+                                settled = settled + VALUES(settled)
+    """, (store_id, kiosk_id, random.randrange(app.config['PAYOUT_BALANCE_SLOTS']), packages, credited, settled))
+
+def record_payout_credits(cursor, store_id, kiosk_id, credits, chunk_size=1000):
+    """
+    Appends one ledger credit per (order_row_id, barcode_id, packages, created_at) and adds
+    them to the kiosk's balance, inside the caller's transaction. Returns the amount credited.
+    """
+    credits = [credit for credit in credits if credit[2]]
+    if not credits:
+        return Decimal('0.00')
+    rate = app.config['PAYOUT_RATE_PER_PACKAGE']
+    for start in range(0, len(credits), chunk_size):
+        chunk = credits[start:start + chunk_size]
+        values_sql = ', '.join(["(%s, %s, 'credit', %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP(3)))"] * len(chunk))
+        params = [value for order_row_id, barcode_id, packages, created_at in chunk
+                  for value in (store_id, kiosk_id, barcode_id, order_row_id, packages, packages * rate, created_at)]
+        cursor.execute(f"""
+            INSERT INTO tbl_payout_ledger (store_id, kiosk_id, entry_type, barcode_id, order_row_id, packages, amount, created_at)
+            VALUES {values_sql}
+        """, tuple(params))
+    packages = sum(credit[2] for credit in credits)
+    bump_payout_balance(cursor, store_id, kiosk_id, packages=packages, credited=packages * rate)
+    return packages * rate
+
+def get_payout_balances(cursor, store_id, kiosk_id=None):
+    """Returns the maintained totals of a store's kiosks (or of one kiosk): packages, credited, settled, balance."""
+    query = """
+        SELECT kiosk_id, SUM(packages) AS packages, SUM(credited) AS credited, SUM(settled) AS settled,
+               SUM(credited) - SUM(settled) AS balance
+        FROM tbl_payout_balances
+        WHERE store_id = %s
+    """
+    params = (store_id,)
+    if kiosk_id is not None:
+        query += " AND kiosk_id = %s"
+        params += (kiosk_id,)
+    cursor.execute(query + " GROUP BY kiosk_id ORDER BY kiosk_id", params)
+    return [{'kiosk_id': row['kiosk_id'], 'packages': int(row['packages']), 'credited': float(row['credited']),
+             'settled': float(row['settled']), 'balance': float(row['balance'])} for row in cursor.fetchall()]
+
+def settle_payouts(cursor, store_id, kiosk_id, settled_by, counted_amount=None):
+    """
+    Closes every unsettled credit of one kiosk into a new settlement batch, inside the
+    caller's transaction: the credits get the batch id, a negative 'settlement' entry is
+    appended and the amount moves to the kiosk's settled total. `counted_amount` is the
+    cash actually counted, kept on the batch for the reconciliation report.
+    Returns the batch as a dict, or None when there was nothing to settle.
+    """
+    cursor.execute("INSERT INTO tbl_payout_batches (store_id, kiosk_id, counted_amount, settled_by) VALUES (%s, %s, %s, %s)",
+                   (store_id, kiosk_id, counted_amount, settled_by))
+    batch_id = cursor.lastrowid
+    cursor.execute("""
+        UPDATE tbl_payout_ledger SET batch_id = %s
+        WHERE store_id = %s AND kiosk_id = %s AND entry_type = 'credit' AND batch_id IS NULL
+    """, (batch_id, store_id, kiosk_id))
+    if not cursor.rowcount:
+        cursor.execute("DELETE FROM tbl_payout_batches WHERE id = %s", (batch_id,))
+        return None
+    cursor.execute("""
+        SELECT COUNT(*) AS entry_count, SUM(packages) AS packages, SUM(amount) AS amount
+        FROM tbl_payout_ledger WHERE batch_id = %s
+    """, (batch_id,))
+    totals = cursor.fetchone()
+    cursor.execute("UPDATE tbl_payout_batches SET entry_count = %s, packages = %s, amount = %s WHERE id = %s",
+                   (totals['entry_count'], totals['packages'], totals['amount'], batch_id))
+    cursor.execute("""
+        INSERT INTO tbl_payout_ledger (store_id, kiosk_id, entry_type, packages, amount, batch_id)
+        VALUES (%s, %s, 'settlement', %s, %s, %s)
+    """, (store_id, kiosk_id, -int(totals['packages']), -totals['amount'], batch_id))
+    bump_payout_balance(cursor, store_id, kiosk_id, settled=totals['amount'])
+    return {
+        'batch_id': batch_id,
+        'store_id': store_id,
+        'kiosk_id': kiosk_id,
+        'entry_count': int(totals['entry_count']),
+        'packages': int(totals['packages']),
+        'amount': float(totals['amount']),
+        'counted_amount': float(counted_amount) if counted_amount is not None else None,
+        'variance': float(counted_amount - totals['amount']) if counted_amount is not None else None,
+    }
+
+def payout_reconciliation(cursor, store_id=None):
+    """
+    Compares the packages credited in the payout ledger (scan credits plus opening
+    balances) with tbl_order.disquantity (plus pending disposal events), per store.
+    Manual disquantity edits are logged as 'adjust' disposal events without a credit,
+    so they are reported next to the difference. With `store_id`, also lists the
+    barcodes whose totals differ and the recent settlement batches with a cash variance.
+    """
+    where, params = ('WHERE s.store_id = %s', (store_id,)) if store_id else ('', ())
+    cursor.execute(f"""
+        SELECT s.store_id, s.store_name,
+               COALESCE(o.disposed, 0) + COALESCE(e.pending, 0) AS disposed_packages,
+               COALESCE(l.packages, 0) AS credited_packages,
+               COALESCE(l.amount, 0) AS credited_amount,
+               COALESCE(a.adjusted, 0) AS adjusted_packages
+        FROM tbl_stores s
+        LEFT JOIN (SELECT store_id, SUM(disquantity) AS disposed FROM tbl_order GROUP BY store_id) o ON o.store_id = s.store_id
+        LEFT JOIN (SELECT store_id, SUM(quantity) AS pending FROM tbl_disposal_events WHERE compacted = 0 GROUP BY store_id) e ON e.store_id = s.store_id
+        LEFT JOIN (SELECT store_id, SUM(quantity) AS adjusted FROM tbl_disposal_events WHERE source = 'adjust' GROUP BY store_id) a ON a.store_id = s.store_id
+        LEFT JOIN (
+            SELECT store_id, SUM(packages) AS packages, SUM(amount) AS amount
+            FROM tbl_payout_ledger WHERE entry_type IN ('credit', 'opening') GROUP BY store_id
+        ) l ON l.store_id = s.store_id
+        {where}
+        ORDER BY s.store_id
+    """, params)
+    stores = []
+    for row in cursor.fetchall():
+        difference = int(row['disposed_packages']) - int(row['credited_packages'])
+        stores.append({
+            'store_id': row['store_id'],
+            'store_name': row['store_name'],
+            'disposed_packages': int(row['disposed_packages']),
+            'credited_packages': int(row['credited_packages']),
+            'credited_amount': float(row['credited_amount']),
+            'difference': difference,
+            'adjusted_packages': int(row['adjusted_packages']),
+            'unexplained': difference - int(row['adjusted_packages']),
+        })
+    report = {'rate_per_package': float(app.config['PAYOUT_RATE_PER_PACKAGE']), 'stores': stores}
+    if not store_id:
+        return report
+
+    cursor.execute("""
+        SELECT d.barcode_id, d.disposed, COALESCE(l.packages, 0) AS credited
+        FROM (
+            SELECT o.barcode_id, SUM(o.disquantity) + COALESCE(SUM(e.pending), 0) AS disposed
+            FROM tbl_order o
+            LEFT JOIN (SELECT order_row_id, SUM(quantity) AS pending FROM tbl_disposal_events
+                       WHERE compacted = 0 AND store_id = %s GROUP BY order_row_id) e ON e.order_row_id = o.id
+            WHERE o.store_id = %s
+            GROUP BY o.barcode_id
+        ) d
+        LEFT JOIN (
+            SELECT barcode_id, SUM(packages) AS packages FROM tbl_payout_ledger
+            WHERE store_id = %s AND entry_type IN ('credit', 'opening') GROUP BY barcode_id
+        ) l ON l.barcode_id = d.barcode_id
+        WHERE d.disposed <> COALESCE(l.packages, 0)
+        ORDER BY d.barcode_id
+        LIMIT 200
+    """, (store_id, store_id, store_id))
+    report['barcodes'] = [{'barcode_id': row['barcode_id'], 'disposed_packages': int(row['disposed']),
+                           'credited_packages': int(row['credited'])} for row in cursor.fetchall()]
+    cursor.execute("""
+        SELECT id, kiosk_id, entry_count, packages, amount, counted_amount, counted_amount - amount AS variance, settled_by, created_at
+        FROM tbl_payout_batches
+        WHERE store_id = %s AND counted_amount IS NOT NULL AND counted_amount <> amount
+        ORDER BY id DESC
+        LIMIT 50
+    """, (store_id,))
+    report['batch_variances'] = [dict(row, amount=float(row['amount']), counted_amount=float(row['counted_amount']),
+                                      variance=float(row['variance'])) for row in cursor.fetchall()]
+    return report
+
+@app.route("/payouts/balances")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def payout_balances():
+    """Returns the running coin balances (credited - settled) of the store's kiosks, or of ?kiosk_id=, as JSON."""
+    store_id = requested_store_id()
+    if not store_id:
+        return jsonify({'error': 'กรุณาระบุร้านค้า'}), 400
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        return jsonify({'store_id': store_id, 'kiosks': get_payout_balances(cursor, store_id, request.args.get('kiosk_id'))})
+    except mysql.connector.Error as err:
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดึงข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+@app.route("/payouts/settle", methods=["POST"])
+@role_required(['root_admin', 'administrator', 'moderator'])
+def settle_kiosk_payouts():
+    """
+    Settles one kiosk's unsettled credits into a batch.
+    Expects JSON or form data: kiosk_id, optional counted_amount (cash counted) and, for administrators, store_id.
+    """
+    values = request.get_json(silent=True) or request.form.to_dict()
+    store_value = str(values.get('store_id') or '')
+    store_id = requested_store_id(int(store_value) if store_value.isdigit() else None)
+    kiosk_id = str(values.get('kiosk_id') or '')
+    if not store_id:
+        return jsonify({'error': 'กรุณาระบุร้านค้า'}), 400
+    if not KIOSK_ID_PATTERN.match(kiosk_id):
+        return jsonify({'error': 'kiosk_id ไม่ถูกต้อง'}), 400
+    counted_amount = values.get('counted_amount')
+    if counted_amount not in (None, ''):
+        try:
+            counted_amount = Decimal(str(counted_amount)).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            return jsonify({'error': 'จำนวนเงินที่นับได้ไม่ถูกต้อง'}), 400
+    else:
+        counted_amount = None
+
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        batch = settle_payouts(cursor, store_id, kiosk_id, session.get('email'), counted_amount)
+        if not batch:
+            conn.rollback()
+            return jsonify({'error': 'ไม่มียอดค้างชำระสำหรับตู้นี้'}), 404
+        conn.commit()
+        return jsonify(batch)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดำเนินการ: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+@app.route("/payouts/reconciliation")
+@role_required(['root_admin', 'administrator', 'moderator'])
+def payout_reconciliation_report():
+    """Returns payout_reconciliation() as JSON: all stores for administrators without store_id, else one store in detail."""
+    store_id = requested_store_id()
+    if not store_id and session.get('role') not in ['root_admin', 'administrator']:
+        return jsonify({'error': 'กรุณาระบุร้านค้า'}), 400
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        return jsonify(payout_reconciliation(cursor, store_id))
+    except mysql.connector.Error as err:
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดึงข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+@app.cli.command('check-payouts')
+@click.option('--fix', is_flag=True, help='Rebuild tbl_payout_balances from the ledger.')
+def check_payouts_command(fix):
+    """Compares the maintained kiosk balances with sums over tbl_payout_ledger and prints the reconciliation summary."""
+    conn = get_db_connection()
+    if not conn:
+        print("Error: Could not connect to DB.")
+        sys.exit(1)
+    cursor = conn.cursor(dictionary=True)
+    ledger_query = """
+        SELECT store_id, kiosk_id,
+               SUM(CASE WHEN entry_type = 'credit' THEN packages ELSE 0 END) AS packages,
+               SUM(CASE WHEN entry_type = 'credit' THEN amount ELSE 0 END) AS credited,
+               -SUM(CASE WHEN entry_type = 'settlement' THEN amount ELSE 0 END) AS settled
+        FROM tbl_payout_ledger
+        WHERE entry_type IN ('credit', 'settlement')
+        GROUP BY store_id, kiosk_id
+    """
+    try:
+        cursor.execute(ledger_query)
+        ledger = {(row['store_id'], row['kiosk_id']): (int(row['packages']), row['credited'], row['settled']) for row in cursor.fetchall()}
+        cursor.execute("""
+            SELECT store_id, kiosk_id, SUM(packages) AS packages, SUM(credited) AS credited, SUM(settled) AS settled
+            FROM tbl_payout_balances GROUP BY store_id, kiosk_id
+        """)
+        maintained = {(row['store_id'], row['kiosk_id']): (int(row['packages']), row['credited'], row['settled']) for row in cursor.fetchall()}
+        zero = (0, Decimal('0.00'), Decimal('0.00'))
+        drifted = sorted(key for key in set(ledger) | set(maintained) if ledger.get(key, zero) != maintained.get(key, zero))
+        if drifted:
+            print(f"{len(drifted)} kiosk balance(s) differ from the ledger: " + ', '.join(f"store {store} / {kiosk}" for store, kiosk in drifted[:50]))
+        else:
+            print("tbl_payout_balances is consistent with tbl_payout_ledger.")
+
+        for store in payout_reconciliation(cursor)['stores']:
+            print(f"Store {store['store_id']}: {store['disposed_packages']} packages disposed, {store['credited_packages']} credited "
+                  f"({store['difference']:+d}, {store['adjusted_packages']:+d} from manual edits)")
+
+        if drifted and fix:
+            cursor.execute("DELETE FROM tbl_payout_balances")
+            cursor.execute(f"""
+                INSERT INTO tbl_payout_balances (store_id, kiosk_id, slot, packages, credited, settled)
+                SELECT store_id, kiosk_id, 0, packages, credited, settled FROM ({ledger_query}) ledger
+            """)
+            conn.commit()
+            print("Balances rebuilt from the ledger.")
+        elif drifted:
+            sys.exit(1)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        print(f"Error checking payouts: {err}")
+        sys.exit(1)
+    finally:
+        cursor.close()
+        conn.close()
+
+# --- Bin fill level routes ---
+def get_bin_levels(cursor, store_id=None, needs_collection=False):
+    """Returns bin fill levels, fullest first, for one store (or all) and optionally only bins due for collection."""
+    query = """
+        SELECT b.store_id, s.store_name, b.kiosk_id, b.category_id, c.category_name, b.fill_count, b.capacity,
+               b.collect_at, b.needs_collection, b.total_count, b.last_emptied_at, b.updated_at
+        FROM tbl_bin_levels b
+        LEFT JOIN tbl_stores s ON s.store_id = b.store_id
+        LEFT JOIN tbl_category c ON c.category_id = b.category_id
+    """
+    conditions, params = [], []
+    if needs_collection:
+        conditions.append("b.needs_collection = 1")
+    if store_id:
+        conditions.append("b.store_id = %s")
+        params.append(store_id)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    cursor.execute(query + " ORDER BY b.fill_count / b.capacity DESC, b.store_id, b.kiosk_id, b.category_id", tuple(params))
+    levels = []
+    for row in cursor.fetchall():
+        row['needs_collection'] = bool(row['needs_collection'])
+        row['fill_ratio'] = round(row['fill_count'] / row['capacity'], 3) if row['capacity'] else None
+        levels.append(row)
+    return levels
+
+def _bin_levels_response(needs_collection):
+    store_id = requested_store_id()
+    if not store_id and (not needs_collection or session.get('role') not in ['root_admin', 'administrator']):
+        return jsonify({'error': 'กรุณาระบุร้านค้า'}), 400
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        return jsonify({'store_id': store_id, 'bins': get_bin_levels(cursor, store_id, needs_collection)})
+    except mysql.connector.Error as err:
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดึงข้อมูล: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+@app.route("/bins/levels")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def bin_levels():
+    """Returns the fill level of every bin (kiosk and category) of the store as JSON."""
+    return _bin_levels_response(needs_collection=False)
+
+@app.route("/bins/collection")
+@role_required(['root_admin', 'administrator', 'moderator'])
+def bins_needing_collection():
+    """Returns the bins at or above their collection threshold, fullest first; all stores for administrators without store_id."""
+    return _bin_levels_response(needs_collection=True)
+
+@app.route("/bins/update", methods=["POST"])
+@role_required(['root_admin', 'administrator', 'moderator'])
+def update_bin():
+    """
+    Updates one bin of the store. Expects JSON or form data: kiosk_id, category_id and
+    action 'empty' (the bin was collected: fill count back to 0) or 'capacity' (with
+    capacity and optional collect_at, by default BIN_COLLECT_RATIO of the capacity).
+    Administrators may pass store_id. Emptying first compacts the bin's pending events,
+    so packages scanned before the collection are not added to the emptied bin later.
+    """
+    values = request.get_json(silent=True) or request.form.to_dict()
+    store_value = str(values.get('store_id') or '')
+    store_id = requested_store_id(int(store_value) if store_value.isdigit() else None)
+    kiosk_id = str(values.get('kiosk_id') or '')
+    action = values.get('action')
+    try:
+        category_id = int(values.get('category_id'))
+        capacity = int(values['capacity']) if action == 'capacity' else None
+        collect_at = int(values['collect_at']) if action == 'capacity' and values.get('collect_at') not in (None, '') else None
+    except (TypeError, ValueError, KeyError):
+        return jsonify({'error': 'category_id, capacity และ collect_at ต้องเป็นตัวเลข'}), 400
+    if not store_id:
+        return jsonify({'error': 'กรุณาระบุร้านค้า'}), 400
+    if not KIOSK_ID_PATTERN.match(kiosk_id) or action not in ('empty', 'capacity'):
+        return jsonify({'error': 'ต้องระบุ kiosk_id และ action (empty หรือ capacity)'}), 400
+    if action == 'capacity':
+        if capacity <= 0:
+            return jsonify({'error': 'ความจุต้องมากกว่า 0'}), 400
+        collect_at = collect_at if collect_at is not None else max(1, int(capacity * app.config['BIN_COLLECT_RATIO']))
+        if not 0 < collect_at <= capacity:
+            return jsonify({'error': 'collect_at ต้องอยู่ระหว่าง 1 ถึงความจุ'}), 400
+
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        other_bins = set()
+        if action == 'empty':
+            cursor.execute("""
+                SELECT DISTINCT order_row_id FROM tbl_disposal_events
+                WHERE compacted = 0 AND store_id = %s AND kiosk_id = %s AND category_id = %s
+            """, (store_id, kiosk_id, category_id))
+            compact_disposals(cursor, [row['order_row_id'] for row in cursor.fetchall()], bins=other_bins)
+            other_bins.discard((store_id, kiosk_id, category_id))
+            cursor.execute("""
+                UPDATE tbl_bin_levels SET fill_count = 0, last_emptied_at = NOW()
+                WHERE store_id = %s AND kiosk_id = %s AND category_id = %s
+            """, (store_id, kiosk_id, category_id))
+        else:
+            # A bin can be configured before its first package arrives
+            cursor.execute("""
+                INSERT INTO tbl_bin_levels (store_id, kiosk_id, category_id, capacity, collect_at) VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE capacity = VALUES(capacity), collect_at = VALUES(collect_at)
+            """, (store_id, kiosk_id, category_id, capacity, collect_at))
+        if action == 'empty' and not cursor.rowcount:
+            conn.rollback()
+            return jsonify({'error': 'ไม่พบถังขยะที่ระบุ'}), 404
+        conn.commit()
+        cursor.execute("SELECT * FROM tbl_bin_levels WHERE store_id = %s AND kiosk_id = %s AND category_id = %s",
+                       (store_id, kiosk_id, category_id))
+        level = cursor.fetchone()
+        level['needs_collection'] = bool(level['needs_collection'])
+        publish_event(store_id, 'bin-level', level)
+        publish_bin_levels(cursor, other_bins) # Bins filled by the other events of the compacted order rows
+        return jsonify(level)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f"เกิดข้อผิดพลาดในการดำเนินการ: {err}"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+# --- Live event stream ---
+@app.route("/events/stream")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def live_event_stream():
+    """
+    Streams the store's live events (see publish_event()) as Server-Sent Events:
+    order-created, order-updated, order-deleted, disquantity-changed and bin-level, each
+    with its row as JSON data, and 'reset' when events were missed and the page should
+    reload. Administrators may pass store_id, or watch every store without it. Members
+    only get the order events of their own email (as on /tbl_order) and the bin levels.
+    A client reconnecting with Last-Event-ID (or ?last_event_id=) is sent the events it missed.
+    """
+    store_id = requested_store_id()
+    if not store_id and session.get('role') not in ['root_admin', 'administrator']:
+        return jsonify({'error': 'กรุณาระบุร้านค้า'}), 400
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    try:
+        subscription = get_event_broker().subscribe(store_id, last_event_id)
+    except TooManySubscribers:
+        return jsonify({'error': 'มีผู้เชื่อมต่อการแจ้งเตือนสดมากเกินไป กรุณาลองใหม่ภายหลัง'}), 503
+    own_email = session['email'] if session.get('role') == 'member' else None # Read now: no session inside the generator
+    heartbeat = app.config['LIVE_EVENTS_HEARTBEAT']
+    closes_at = time.monotonic() + app.config['LIVE_EVENTS_STREAM_SECONDS']
+
+    def generate():
+        # Holds no database connection: the events carry the changed rows themselves
+        try:
+            yield f"retry: {app.config['LIVE_EVENTS_RETRY_MS']}\n\n"
+            while True:
+                remaining = closes_at - time.monotonic()
+                if remaining <= 0:
+                    return
+                events = subscription.read(min(heartbeat, remaining))
+                if not events:
+                    yield ": keep-alive\n\n" # Also how a closed connection is noticed
+                for event_id, event_store_id, event_type, data in events:
+                    if own_email is not None and event_type not in ('bin-level', EVENT_RESET) and data.get('email') != own_email:
+                        continue
+                    yield format_sse(event_id, event_type, dict(data, store_id=event_store_id))
+        finally:
+            subscription.close()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.call_on_close(subscription.close) # Also when the generator never started
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Stop nginx from buffering the stream
+    return response
+
+# --- Background PDF export ---
+app.config['EXPORT_MAX_WORKERS'] = int(os.environ.get('EXPORT_MAX_WORKERS', 2)) # PDF renders running at once
+app.config['EXPORT_MAX_PENDING'] = int(os.environ.get('EXPORT_MAX_PENDING', 10)) # Queued + running jobs per web process
+app.config['EXPORT_CHUNK_SIZE'] = 500 # Orders rendered per PDF part before merging
+app.config['EXPORT_DIR'] = os.path.join(app.instance_path, 'exports')
+
+_export_runner = None
+
+def get_export_runner():
+    """Returns the process-wide export job runner."""
+    global _export_runner
+    if _export_runner is None:
+        with _db_pool_lock:
+            if _export_runner is None:
+                _export_runner = ExportJobRunner(get_db_connection, DB_CONFIG,
+                                                 max_workers=app.config['EXPORT_MAX_WORKERS'],
+                                                 max_pending=app.config['EXPORT_MAX_PENDING'])
+    return _export_runner
+
+def get_export_job(cursor, job_id):
+    """Fetches an export job if the current user may see it (owner or admin), else None."""
+    cursor.execute("SELECT * FROM tbl_export_jobs WHERE id = %s", (job_id,))
+    job = cursor.fetchone()
+    if job and session.get('role') not in ['root_admin', 'administrator'] and job['requested_by'] != session.get('id'):
+        return None
+    return job
+
 @app.route("/export_orders_pdf")
 @role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
 def export_orders_pdf():
-    """Exports order data to a PDF file."""
+    """
+    Queues an order report PDF export. Rendering happens in a background process;
+    progress and the download link are available from /export_jobs/<job_id>.
+    """
+    base_query = """
+        SELECT 
+            o.id, 
+            o.order_id, 
+            o.products_id, 
+            o.products_name, 
+            o.quantity, 
+            o.disquantity, 
+            o.email, 
+            o.order_date,
+            o.barcode_id, 
+            p.category_id,
+            p.price,
+            s.store_name -- Include store_name
+        FROM tbl_order o
+        LEFT JOIN tbl_products p ON o.products_id = p.products_id
+        LEFT JOIN tbl_stores s ON o.store_id = s.store_id
+    """
+    query_params = []
+    if session.get('role') == 'member':
+        base_query += " WHERE o.email = %s AND o.store_id = %s"
+        query_params.extend([session['email'], session['store_id']])
+    elif session.get('role') in ['moderator', 'viewer']: # Filter for moderator/viewer
+        base_query += " WHERE o.store_id = %s"
+        query_params.append(session['store_id'])
+    
+    base_query += " ORDER BY o.order_date DESC"
+
     conn = get_db_connection()
     cursor = None # Initialize cursor to None
     if not conn:
@@ -2395,60 +4725,25 @@ def export_orders_pdf():
         return redirect(url_for('tbl_order'))
     try:
         cursor = conn.cursor(dictionary=True)
-        base_query = """
-            SELECT 
-                o.id, 
-                o.order_id, 
-                o.products_id, 
-                o.products_name, 
-                o.quantity, 
-                o.disquantity, 
-                o.email, 
-                o.order_date,
-                o.barcode_id, 
-                p.category_id,
-                p.price,
-                s.store_name -- Include store_name
-            FROM tbl_order o
-            LEFT JOIN tbl_products p ON o.products_id = p.products_id
-            LEFT JOIN tbl_stores s ON o.store_id = s.store_id
-        """
-        query_params = []
-        if session.get('role') == 'member':
-            base_query += " WHERE o.email = %s AND o.store_id = %s"
-            query_params.extend([session['email'], session['store_id']])
-        elif session.get('role') in ['moderator', 'viewer']: # Filter for moderator/viewer
-            base_query += " WHERE o.store_id = %s"
-            query_params.append(session['store_id'])
-        
-        base_query += " ORDER BY o.order_date DESC"
-        
-        cursor.execute(base_query, tuple(query_params))
-        orders_raw = cursor.fetchall()
-
-        orders = []
-        for order_raw in orders_raw:
-            order = order_raw.copy()
-            order['price'] = float(order['price'] or 0.0) # Ensure price is float
-            orders.append(order)
+        runner = get_export_runner()
+        cursor.execute("INSERT INTO tbl_export_jobs (job_type, status, requested_by, store_id, runner_id) VALUES ('orders_pdf', 'queued', %s, %s, %s)",
+                       (session.get('id'), session.get('store_id'), runner.runner_id))
+        job_id = cursor.lastrowid
+        conn.commit()
 
-        # Render HTML template for PDF
-        html = render_template("pdf_template_orders.html", orders=orders)
-        
-        # Create a PDF from HTML
-        pdf_buffer = BytesIO()
-        pisa_status = pisa.CreatePDF(
-            html,                # the HTML to convert
-            dest=pdf_buffer)     # file handle to receive result
-        if pisa_status.err:
-            flash(f"เกิดข้อผิดพลาดในการสร้าง PDF: {pisa_status.err}", 'danger')
+        os.makedirs(app.config['EXPORT_DIR'], exist_ok=True)
+        output_path = os.path.join(app.config['EXPORT_DIR'], f"orders_report_{job_id}.pdf")
+        try:
+            runner.submit(job_id, base_query, query_params, os.path.join(app.root_path, app.template_folder),
+                                       "pdf_template.html", output_path, app.config['EXPORT_CHUNK_SIZE'])
+        except ExportQueueFull:
+            cursor.execute("UPDATE tbl_export_jobs SET status = 'failed', error = 'queue full', finished_at = NOW() WHERE id = %s", (job_id,))
+            conn.commit()
+            flash("มีงานส่งออกรายงานรออยู่จำนวนมาก โปรดลองใหม่อีกครั้งภายหลัง.", 'warning')
             return redirect(url_for('tbl_order'))
-        pdf_buffer.seek(0)
-        
-        response = make_response(pdf_buffer.getvalue())
-        response.headers["Content-Disposition"] = "attachment; filename=orders_report.pdf"
-        response.headers["Content-type"] = "application/pdf"
-        return response
+
+        flash(f"กำลังสร้างรายงาน PDF (งานหมายเลข {job_id}) ตรวจสอบสถานะได้ที่ {url_for('export_job_status', job_id=job_id)}", 'info')
+        return redirect(url_for('tbl_order'))
     except mysql.connector.Error as err:
         flash(f"เกิดข้อผิดพลาดในการส่งออกรายงานคำสั่งซื้อ: {err}", 'danger')
         return redirect(url_for('tbl_order'))
@@ -2457,5 +4752,106 @@ def export_orders_pdf():
             cursor.close()
         if conn:
             conn.close()
+
+@app.route("/export_jobs/<int:job_id>")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def export_job_status(job_id):
+    """Returns the status of an export job as JSON, with a download URL once it is done."""
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        return jsonify({'error': 'เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.'}), 503
+    try:
+        cursor = conn.cursor(dictionary=True)
+        job = get_export_job(cursor, job_id)
+        if not job:
+            return jsonify({'error': 'ไม่พบงานส่งออก'}), 404
+        return jsonify({
+            'id': job['id'],
+            'job_type': job['job_type'],
+            'status': job['status'],
+            'row_count': job['row_count'],
+            'error': job['error'].splitlines()[0] if job['error'] else None,
+            'created_at': job['created_at'].isoformat() if job['created_at'] else None,
+            'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None,
+            'download_url': url_for('export_job_download', job_id=job_id) if job['status'] == 'done' else None
+        })
+    except mysql.connector.Error as err:
+        return jsonify({'error': str(err)}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@app.route("/export_jobs/<int:job_id>/download")
+@role_required(['root_admin', 'administrator', 'moderator', 'member', 'viewer'])
+def export_job_download(job_id):
+    """Downloads the PDF produced by a finished export job."""
+    conn = get_db_connection()
+    cursor = None
+    if not conn:
+        flash("เกิดข้อผิดพลาดในการเชื่อมต่อฐานข้อมูล.", 'danger')
+        return redirect(url_for('tbl_order'))
+    try:
+        cursor = conn.cursor(dictionary=True)
+        job = get_export_job(cursor, job_id)
+    except mysql.connector.Error as err:
+        flash(f"เกิดข้อผิดพลาดในการดึงข้อมูลงานส่งออก: {err}", 'danger')
+        return redirect(url_for('tbl_order'))
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+    if not job or job['status'] != 'done' or not job['file_path'] or not os.path.exists(job['file_path']):
+        flash("รายงานยังไม่พร้อมหรือไม่พบไฟล์.", 'warning')
+        return redirect(url_for('tbl_order'))
+    return send_file(job['file_path'], mimetype="application/pdf", as_attachment=True, download_name="orders_report.pdf")
+
+# --- Background services ---
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background_services():
+    """
+    Starts the per-process background work once: replays the kiosk scans journaled but
+    not yet applied, fails the export jobs a dead process left queued or running and
+    compacts the disposal events left pending. Called before `app.run()` and before the
+    first request of a serving process, never on import: the spawned export workers
+    import this module too. Child processes never start them, so only the serving
+    process replays the shared scan journal (two queues would break the per-barcode order).
+    """
+    global _background_started
+    if _background_started or multiprocessing.parent_process() is not None:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+        get_scan_queue()
+        get_export_runner().start()
+        schedule_disposal_compaction()
+
+@app.before_request
+def ensure_background_services():
+    start_background_services()
+
+# --- System Metrics ---
+@app.route("/system_stats")
+@role_required(['root_admin', 'administrator'])
+def system_stats():
+    """Returns runtime metrics (connection pool usage, cache hit rates, session cookie sizes, kiosk scan queue, live event streams) as JSON."""
+    return jsonify({
+        'db_pool': get_db_pool().stats(),
+        'ref_cache': get_ref_cache().stats(),
+        'barcodes': barcode_cache_stats(),
+        'sessions': _session_interface.stats() if _session_interface else {'backend': 'cookie'},
+        'kiosk_scans': _scan_queue.stats() if _scan_queue else None,
+        'live_events': _event_broker.stats() if _event_broker else None
+    })
+
 if __name__ == '__main__':
+    start_background_services()
     app.run(port=5000)
\ No newline at end of file
@@ -0,0 +1,140 @@
+# Order Barcode Codec
+# Project Bin - แปลงเลขลำดับ <-> บาร์โค้ดคำสั่งซื้อ 13 หลัก ทั้งแบบทีละค่าและแบบชุดใหญ่ (สำหรับงานกระทบยอด)
+
+try:
+    import numpy as np
+except ImportError: # NumPy is optional: the batch functions fall back to plain Python ints
+    np = None
+
+from barcodes import ean13_check_digit
+
+BARCODE_A = 982451653
+BARCODE_B = 1234567891234
+BARCODE_M = 10000000000039 # ใกล้เคียง 10^13 (= 7 * 691 * 2067397147 ไม่ใช่จำนวนเฉพาะ แต่ gcd(a, m) = 1 จึงยังเป็น bijection)
+# inverse ของ a mod m, computed once. pow(a, m - 2, m) (Fermat) only works for a prime m
+BARCODE_A_INV = pow(BARCODE_A, -1, BARCODE_M)
+BARCODE_DIGITS = 13
+
+LEGACY_SEQUENCE_START = 10**11 # Older barcodes were encode() of a random number in [10^11, 10^12)
+
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def encode(x: int) -> int:
+    return (BARCODE_A * x + BARCODE_B) % BARCODE_M
+
+
+def decode(y: int) -> int:
+    return (BARCODE_A_INV * (y - BARCODE_B)) % BARCODE_M
+
+
+def _mulmod(constant, values):
+    """
+    (constant * values) % BARCODE_M for an int64 array with 0 <= values < m < 2^44.
+    The product needs ~88 bits, so the constant is fed in one byte at a time
+    (Horner's rule): every intermediate stays below 2^53 and never overflows int64.
+    """
+    result = np.zeros_like(values)
+    for shift in range((constant.bit_length() + 7) // 8 * 8 - 8, -8, -8):
+        result = (result * 256 + ((constant >> shift) & 0xFF) * values) % BARCODE_M
+    return result
+
+
+def _chunks(values, chunk_size):
+    # Lists, tuples and arrays are sliced; other iterables (generators, cursors) are buffered
+    if hasattr(values, '__getitem__') and hasattr(values, '__len__'):
+        for start in range(0, len(values), chunk_size):
+            yield values[start:start + chunk_size]
+        return
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _use_numpy(use_numpy):
+    if use_numpy and np is None:
+        raise RuntimeError("NumPy is not installed")
+    return np is not None if use_numpy is None else use_numpy
+
+
+def encode_many(values, chunk_size=DEFAULT_CHUNK_SIZE, use_numpy=None):
+    """
+    encode() for a sequence of ints (or digit strings, or a NumPy array); returns a
+    list of ints. Values are processed `chunk_size` at a time, with NumPy int64
+    arithmetic when it is installed (use_numpy=None) and plain Python ints otherwise.
+    Inputs must be non-negative and below 2^63 on the NumPy path.
+    """
+    results = []
+    vectorized = _use_numpy(use_numpy)
+    a, b, m = BARCODE_A, BARCODE_B, BARCODE_M # Locals: faster than globals in the loop
+    for chunk in _chunks(values, chunk_size):
+        if vectorized:
+            array = np.asarray(chunk, dtype=np.int64) % m
+            results.extend(((_mulmod(a, array) + b) % m).tolist())
+        else:
+            results.extend([(a * x + b) % m for x in map(int, chunk)])
+    return results
+
+
+def decode_many(values, chunk_size=DEFAULT_CHUNK_SIZE, use_numpy=None):
+    """decode() for a sequence of barcodes (ints or digit strings); returns a list of ints. See encode_many()."""
+    results = []
+    vectorized = _use_numpy(use_numpy)
+    a_inv, b, m = BARCODE_A_INV, BARCODE_B, BARCODE_M
+    for chunk in _chunks(values, chunk_size):
+        if vectorized:
+            array = (np.asarray(chunk, dtype=np.int64) - b) % m
+            results.extend(_mulmod(a_inv, array).tolist())
+        else:
+            results.extend([(a_inv * (y - b)) % m for y in map(int, chunk)])
+    return results
+
+
+def normalize_scanned_barcode(value):
+    """
+    Returns a scanned order barcode as its 13-digit string, or None if it cannot be one.
+
+    Order barcodes that happen to carry a valid EAN-13 check digit are printed as
+    EAN-13 (see barcodes.barcode_symbology), and scanners set to drop the check digit
+    send only the first 12 digits; the check digit is restored for those.
+    """
+    value = str(value or '').strip()
+    if not value.isdigit():
+        return None
+    if len(value) == BARCODE_DIGITS - 1:
+        return value + str(ean13_check_digit(value))
+    if len(value) == BARCODE_DIGITS:
+        return value
+    return None
+
+
+def validate_order_barcodes(values, max_sequence=None, chunk_size=DEFAULT_CHUNK_SIZE, use_numpy=None):
+    """
+    Checks scanned barcodes in bulk. Returns, for each value, the sequence number it
+    was issued for, or None when it is malformed or decodes to a number that was never
+    issued (below LEGACY_SEQUENCE_START, or above `max_sequence`; without max_sequence
+    only the lower bound is checked).
+
+    Barcodes carry no check digit of their own, but the issued numbers are a tiny part
+    of the modulus range, so a mistyped or misread barcode almost always decodes
+    outside it.
+    """
+    normalized = [normalize_scanned_barcode(value) for value in values]
+    decoded = iter(decode_many([value for value in normalized if value is not None], chunk_size, use_numpy))
+    results = []
+    for value in normalized:
+        sequence = next(decoded) if value is not None else None
+        if sequence is not None and (sequence < LEGACY_SEQUENCE_START or (max_sequence is not None and sequence > max_sequence)):
+            sequence = None
+        results.append(sequence)
+    return results
+
+
+def validate_order_barcode(value, max_sequence=None):
+    """Scalar form of validate_order_barcodes()."""
+    return validate_order_barcodes([value], max_sequence, use_numpy=False)[0]
@@ -0,0 +1,230 @@
+# Barcode Rendering
+# Project Bin - สร้างภาพบาร์โค้ด (EAN-13 / Code 128) ฝั่งเซิร์ฟเวอร์ สำหรับใบเสร็จ ตารางคำสั่งซื้อ และรายงาน PDF
+
+import base64
+from functools import lru_cache
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Code 128 symbols 0-106 as bar/space widths in modules (bar first). 103-105 are the
+# Start A/B/C symbols and 106 is the stop symbol (with its final 2-module bar).
+CODE128_PATTERNS = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+)
+CODE128_START_B = 104
+CODE128_START_C = 105
+CODE128_CODE_C = 99 # Switch from set B to set C
+CODE128_STOP = 106
+QUIET_ZONE_MODULES = 10
+
+# EAN-13 digit patterns in modules. Left-half digits use set L or G (chosen by the
+# parity pattern of the first digit, which is not drawn as bars); the right half uses R.
+EAN13_L = ('0001101', '0011001', '0010011', '0111101', '0100011', '0110001', '0101111', '0111011', '0110111', '0001011')
+EAN13_R = ('1110010', '1100110', '1101100', '1000010', '1011100', '1001110', '1010000', '1000100', '1001000', '1110100')
+EAN13_G = tuple(pattern[::-1] for pattern in EAN13_R)
+EAN13_PARITY = ('LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG', 'LGGLLG', 'LGGGLL', 'LGLGLG', 'LGLGGL', 'LGGLGL')
+
+BARCODE_CACHE_SIZE = 1024 # rendered images kept per format (a few hundred bytes to a few KB each)
+
+
+def code128_values(data):
+    """
+    Returns the Code 128 symbol values for `data` (start, data, checksum, stop).
+    Digit strings use set C (two digits per symbol); an odd leading digit is sent in
+    set B first. Anything else is encoded in set B (printable ASCII only).
+    """
+    data = str(data)
+    if data.isdigit() and len(data) >= 2:
+        if len(data) % 2:
+            values = [CODE128_START_B, ord(data[0]) - 32, CODE128_CODE_C]
+            data = data[1:]
+        else:
+            values = [CODE128_START_C]
+        values.extend(int(data[i:i + 2]) for i in range(0, len(data), 2))
+    else:
+        if any(not 32 <= ord(char) <= 127 for char in data):
+            raise ValueError(f"Code 128 set B cannot encode {data!r}")
+        values = [CODE128_START_B] + [ord(char) - 32 for char in data]
+
+    checksum = values[0] + sum(position * value for position, value in enumerate(values[1:], start=1))
+    values.append(checksum % 103)
+    values.append(CODE128_STOP)
+    return values
+
+
+def code128_modules(data):
+    """Returns the symbol as a string of modules ('1' = bar, '0' = space), without quiet zones."""
+    modules = []
+    for value in code128_values(data):
+        for index, width in enumerate(CODE128_PATTERNS[value]):
+            modules.append(('1' if index % 2 == 0 else '0') * int(width))
+    return ''.join(modules)
+
+
+def ean13_check_digit(digits):
+    """Returns the EAN-13 check digit for the first 12 digits of `digits`."""
+    digits = str(digits)[:12]
+    total = sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(digits))
+    return (10 - total % 10) % 10
+
+
+def is_valid_ean13(data):
+    """True if `data` is 13 digits whose last digit is the correct EAN-13 check digit."""
+    data = str(data)
+    return len(data) == 13 and data.isdigit() and ean13_check_digit(data) == int(data[12])
+
+
+def ean13_modules(data):
+    """Returns the 95 modules of an EAN-13 symbol ('1' = bar), without quiet zones."""
+    data = str(data)
+    if not is_valid_ean13(data):
+        raise ValueError(f"{data!r} is not a valid EAN-13 number")
+    parity = EAN13_PARITY[int(data[0])]
+    left = ''.join((EAN13_L if set_name == 'L' else EAN13_G)[int(digit)] for set_name, digit in zip(parity, data[1:7]))
+    right = ''.join(EAN13_R[int(digit)] for digit in data[7:13])
+    return '101' + left + '01010' + right + '101'
+
+
+def barcode_symbology(data, symbology='auto'):
+    """
+    Resolves 'auto' to the symbology used for `data`: EAN-13 for 13-digit numbers with
+    a valid check digit, Code 128 for everything else (order barcodes produced by
+    encode() carry no check digit, so most of them are drawn as Code 128).
+    """
+    if symbology == 'auto':
+        return 'ean13' if is_valid_ean13(data) else 'code128'
+    if symbology not in ('ean13', 'code128'):
+        raise ValueError(f"Unknown symbology {symbology!r}")
+    return symbology
+
+
+def barcode_modules(data, symbology='auto'):
+    """Returns (symbology, modules) for `data`, see barcode_symbology()."""
+    symbology = barcode_symbology(data, symbology)
+    return symbology, (ean13_modules(data) if symbology == 'ean13' else code128_modules(data))
+
+
+def _bar_runs(modules):
+    # (first module, module count) of every bar: one rectangle per bar instead of one per module
+    run_start = None
+    for index, module in enumerate(modules + '0'):
+        if module == '1' and run_start is None:
+            run_start = index
+        elif module == '0' and run_start is not None:
+            yield run_start, index - run_start
+            run_start = None
+
+
+def _draw_modules(draw, modules, x, y, height, module_width, fill):
+    position = x + QUIET_ZONE_MODULES * module_width
+    for start, length in _bar_runs(modules):
+        draw.rectangle([position + start * module_width, y,
+                        position + (start + length) * module_width - 1, y + height - 1], fill=fill)
+    return (len(modules) + 2 * QUIET_ZONE_MODULES) * module_width
+
+
+def draw_code128(draw, data, x, y, height, module_width=2, fill=0):
+    """
+    Draws `data` as a Code 128 symbol with its left edge (quiet zone included) at x
+    onto a PIL ImageDraw. Returns the total width drawn in pixels.
+    """
+    return _draw_modules(draw, code128_modules(data), x, y, height, module_width, fill)
+
+
+def draw_barcode(draw, data, x, y, height, module_width=2, fill=0, symbology='auto'):
+    """Like draw_code128(), but draws EAN-13 where barcode_symbology() picks it."""
+    return _draw_modules(draw, barcode_modules(data, symbology)[1], x, y, height, module_width, fill)
+
+
+def code128_width(data, module_width=2):
+    """Width in pixels of the symbol drawn by draw_code128(), quiet zones included."""
+    return (len(code128_modules(data)) + 2 * QUIET_ZONE_MODULES) * module_width
+
+
+@lru_cache(maxsize=4)
+def _label_font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError: # Pillow < 10.1: fixed-size bitmap font only
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=BARCODE_CACHE_SIZE)
+def render_barcode_png(data, module_width=2, height=60, text=True, symbology='auto'):
+    """
+    Returns `data` as a 1-bit PNG (bytes), optionally with the digits printed below
+    the bars. Results are kept in an LRU cache keyed by every argument, so the same
+    barcode at the same size is drawn once per process.
+    """
+    _, modules = barcode_modules(data, symbology)
+    width = (len(modules) + 2 * QUIET_ZONE_MODULES) * module_width
+    font = _label_font(max(10, 6 * module_width)) if text else None
+    label_height = sum(font.getmetrics()) + 2 if text else 0
+
+    image = Image.new('1', (width, height + label_height), 1)
+    draw = ImageDraw.Draw(image)
+    _draw_modules(draw, modules, 0, 0, height, module_width, 0)
+    if text:
+        label = str(data)
+        draw.text(((width - int(font.getlength(label))) // 2, height + 1), label, font=font, fill=0)
+
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=BARCODE_CACHE_SIZE)
+def render_barcode_svg(data, module_width=2, height=60, text=True, symbology='auto'):
+    """Returns `data` as an SVG document (str); cached like render_barcode_png()."""
+    _, modules = barcode_modules(data, symbology)
+    width = (len(modules) + 2 * QUIET_ZONE_MODULES) * module_width
+    font_size = max(10, 6 * module_width)
+    total_height = height + (font_size + 4 if text else 0)
+    offset = QUIET_ZONE_MODULES * module_width
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{total_height}" '
+             f'viewBox="0 0 {width} {total_height}" shape-rendering="crispEdges">',
+             f'<rect width="{width}" height="{total_height}" fill="#fff"/>',
+             '<path fill="#000" d="']
+    parts.extend(f'M{offset + start * module_width} 0h{length * module_width}v{height}h-{length * module_width}z'
+                 for start, length in _bar_runs(modules))
+    parts.append('"/>')
+    if text:
+        parts.append(f'<text x="{width / 2:g}" y="{height + font_size}" font-family="monospace" '
+                     f'font-size="{font_size}" text-anchor="middle">{escape(str(data))}</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def barcode_data_uri(data, module_width=1, height=30, text=False):
+    """
+    Returns the cached PNG of `data` as a data: URI, for documents rendered without a
+    web server to fetch images from (xhtml2pdf reports). Empty values give ''.
+    """
+    if not data:
+        return ''
+    png = render_barcode_png(str(data), module_width, height, text)
+    return 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')
+
+
+def barcode_cache_stats():
+    """Returns hit/miss counters and sizes of the PNG and SVG barcode caches."""
+    stats = {}
+    for name, function in (('png', render_barcode_png), ('svg', render_barcode_svg)):
+        info = function.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {'hits': info.hits, 'misses': info.misses, 'entries': info.currsize,
+                       'max_entries': info.maxsize, 'hit_rate': info.hits / lookups if lookups else 0.0}
+    return stats
@@ -0,0 +1,210 @@
+# Database Connection Pool
+# Project Bin - พูลการเชื่อมต่อฐานข้อมูล MySQL
+
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+
+class PooledConnection:
+    """
+    Thin proxy around a mysql.connector connection checked out from a ConnectionPool.
+    Every attribute is delegated to the real connection, except close(), which hands
+    the connection back to the pool instead of tearing down the TCP session.
+    """
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        entry = self.__dict__.get('_entry')
+        if entry is None:
+            raise mysql.connector.errors.OperationalError("Connection has already been returned to the pool")
+        return getattr(entry.conn, name)
+
+    def is_connected(self):
+        return self._entry is not None and self._entry.conn.is_connected()
+
+    def close(self):
+        """Returns the connection to the pool. Safe to call more than once."""
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._release(entry)
+
+    def __del__(self):
+        # Safety net for code paths that return early without closing the connection
+        if self.__dict__.get('_entry') is not None:
+            self._pool._note_leak()
+            self.close()
+
+
+class _PoolEntry:
+    __slots__ = ('conn', 'created_at')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    Thread-safe MySQL connection pool.
+
+    pool_size     - connections kept open while idle
+    max_overflow  - extra connections allowed under load; closed again when returned
+    recycle       - seconds after which a connection is replaced on checkout (-1 disables)
+    timeout       - seconds to wait for a free connection before raising PoolError
+    pre_ping      - verify the connection with a server ping on every checkout
+    """
+
+    def __init__(self, connect_kwargs, pool_size=5, max_overflow=10, recycle=3600, timeout=30, pre_ping=True):
+        self.connect_kwargs = dict(connect_kwargs)
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.recycle = recycle
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+
+        self._idle = deque()
+        self._total = 0 # Connections currently open (idle + checked out)
+        self._cond = threading.Condition()
+
+        self._metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'connections_created': 0,
+            'connections_recycled': 0,
+            'health_check_failures': 0,
+            'leaked_returns': 0,
+        }
+
+    def _open(self):
+        conn = mysql.connector.connect(**self.connect_kwargs)
+        with self._cond:
+            self._metrics['connections_created'] += 1
+        return _PoolEntry(conn)
+
+    def _discard(self, entry):
+        try:
+            entry.conn.close()
+        except mysql.connector.Error:
+            pass
+
+    def connect(self):
+        """Checks out a connection, waiting up to `timeout` seconds if the pool is exhausted."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        entry = None
+        create = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._total < self.pool_size + self.max_overflow:
+                    self._total += 1
+                    create = True
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolError(f"Connection pool exhausted (size={self.pool_size}, overflow={self.max_overflow})")
+                waited = True
+                self._cond.wait(remaining)
+
+            wait_time = time.monotonic() - started
+            self._metrics['checkouts'] += 1
+            if waited:
+                self._metrics['waits'] += 1
+            self._metrics['wait_time_total'] += wait_time
+            self._metrics['wait_time_max'] = max(self._metrics['wait_time_max'], wait_time)
+
+        try:
+            if create:
+                entry = self._open()
+            else:
+                entry = self._checkout_health(entry)
+        except mysql.connector.Error:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, entry)
+
+    def _checkout_health(self, entry):
+        """Replaces connections that are too old or no longer answer a ping."""
+        if self.recycle >= 0 and time.monotonic() - entry.created_at > self.recycle:
+            self._discard(entry)
+            with self._cond:
+                self._metrics['connections_recycled'] += 1
+            return self._open()
+        if self.pre_ping and not entry.conn.is_connected():
+            self._discard(entry)
+            with self._cond:
+                self._metrics['health_check_failures'] += 1
+            return self._open()
+        return entry
+
+    def _release(self, entry):
+        # End any transaction left open by the route so the next borrower starts clean
+        try:
+            if entry.conn.is_connected():
+                entry.conn.rollback()
+            else:
+                raise mysql.connector.errors.OperationalError("Connection lost")
+        except mysql.connector.Error:
+            self._discard(entry)
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            if len(self._idle) >= self.pool_size:
+                # Overflow connection: close instead of keeping it idle
+                self._total -= 1
+                close_entry = True
+            else:
+                self._idle.append(entry)
+                close_entry = False
+            self._cond.notify()
+        if close_entry:
+            self._discard(entry)
+
+    def _note_leak(self):
+        with self._cond:
+            self._metrics['leaked_returns'] += 1
+
+    def dispose(self):
+        """Closes every idle connection. Checked-out connections are closed when returned."""
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._total -= len(idle)
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self):
+        """Returns a snapshot of pool usage and checkout metrics."""
+        with self._cond:
+            idle = len(self._idle)
+            snapshot = dict(self._metrics)
+            snapshot.update({
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'open_connections': self._total,
+                'idle': idle,
+                'checked_out': self._total - idle,
+                'overflow_in_use': max(0, self._total - self.pool_size),
+            })
+        checkouts = snapshot['checkouts']
+        snapshot['wait_time_avg'] = snapshot['wait_time_total'] / checkouts if checkouts else 0.0
+        return snapshot
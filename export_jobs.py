@@ -0,0 +1,213 @@
+# Background Export Jobs
+# Project Bin - คิวงานส่งออกรายงาน PDF ที่ทำงานนอก request
+
+import os
+import socket
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import multiprocessing
+
+import mysql.connector
+
+
+class ExportQueueFull(Exception):
+    """Raised when the number of queued/running exports reached the configured limit."""
+
+
+def render_orders_pdf(job_id, db_config, query, query_params, template_dir, template_name, output_path, chunk_size):
+    """
+    Worker entry point (runs in a separate process).
+    Streams the order rows in chunks of `chunk_size`, renders each chunk to its own PDF
+    with xhtml2pdf, merges the parts into `output_path` and records the outcome in
+    tbl_export_jobs. The report header is rendered with the first chunk and the summary
+    with the last one; their totals come from one aggregate over the whole query, read
+    in the same snapshot as the rows. Imports are local so the spawned worker stays light.
+    """
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+    from pypdf import PdfReader, PdfWriter
+    from xhtml2pdf import pisa
+    from datetime import datetime
+    from barcodes import barcode_data_uri
+
+    conn = mysql.connector.connect(**db_config)
+    status_cursor = conn.cursor()
+    status_cursor.execute("UPDATE tbl_export_jobs SET status = 'running', started_at = NOW() WHERE id = %s", (job_id,))
+    conn.commit()
+
+    # A second connection streams the rows while the first one records progress
+    data_conn = mysql.connector.connect(**db_config)
+    data_cursor = data_conn.cursor(dictionary=True, buffered=False)
+    try:
+        env = Environment(loader=FileSystemLoader(template_dir), autoescape=select_autoescape(['html']))
+        env.filters['barcode_data_uri'] = barcode_data_uri # Images are embedded: xhtml2pdf cannot fetch /barcode URLs
+        template = env.get_template(template_name)
+        writer = PdfWriter()
+        row_count = 0
+        current_date = datetime.now().strftime('%d/%m/%Y %H:%M')
+
+        # One snapshot for the totals and the rows, so the summary matches the table
+        data_conn.start_transaction(consistent_snapshot=True, readonly=True)
+        data_cursor.execute(f"SELECT COUNT(*) AS orders, COALESCE(SUM(quantity), 0) AS quantity FROM ({query}) AS report_rows", query_params)
+        totals = data_cursor.fetchone()
+        totals = {'orders': int(totals['orders']), 'quantity': int(totals['quantity'])}
+
+        data_cursor.execute(query, query_params)
+        while True:
+            rows = data_cursor.fetchmany(chunk_size)
+            if not rows and row_count:
+                break
+            orders = []
+            for row in rows:
+                row['price'] = float(row['price'] or 0.0) # Ensure price is float
+                orders.append(row)
+            part = BytesIO()
+            html = template.render(orders=orders, totals=totals, current_date=current_date,
+                                   first_part=row_count == 0, last_part=row_count + len(rows) >= totals['orders'])
+            pisa_status = pisa.CreatePDF(html, dest=part)
+            if pisa_status.err:
+                raise RuntimeError(f"xhtml2pdf error while rendering rows {row_count + 1}-{row_count + len(rows)}")
+            part.seek(0)
+            for page in PdfReader(part).pages:
+                writer.add_page(page)
+            row_count += len(rows)
+            status_cursor.execute("UPDATE tbl_export_jobs SET row_count = %s WHERE id = %s", (row_count, job_id))
+            conn.commit()
+            if not rows: # Empty report: a single page is still produced
+                break
+
+        tmp_path = output_path + '.part'
+        with open(tmp_path, 'wb') as handle:
+            writer.write(handle)
+        os.replace(tmp_path, output_path)
+
+        status_cursor.execute("UPDATE tbl_export_jobs SET status = 'done', file_path = %s, row_count = %s, finished_at = NOW() WHERE id = %s",
+                              (output_path, row_count, job_id))
+        conn.commit()
+        return row_count
+    except Exception as err:
+        conn.rollback()
+        status_cursor.execute("UPDATE tbl_export_jobs SET status = 'failed', error = %s, finished_at = NOW() WHERE id = %s",
+                              (f"{err}\n{traceback.format_exc()}"[:4000], job_id))
+        conn.commit()
+        raise
+    finally:
+        for resource in (data_cursor, data_conn, status_cursor, conn):
+            try:
+                resource.close()
+            except mysql.connector.Error:
+                pass
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # Exists, owned by another user
+        return True
+    return True
+
+
+class ExportJobRunner:
+    """
+    Runs export jobs in a small process pool so PDF rendering never ties up web workers.
+    At most `max_workers` jobs render at once and at most `max_pending` are accepted
+    (queued + running) per web process; submit() raises ExportQueueFull beyond that.
+
+    Jobs are tagged with the runner_id (host:pid) of the web process that queued them.
+    start() fails the jobs a dead process of this host left queued or running, so they
+    do not stay pending forever; jobs of other hosts are left to their own runners.
+    """
+
+    def __init__(self, connection_factory, db_config, max_workers=2, max_pending=10):
+        self.connection_factory = connection_factory
+        self.db_config = dict(db_config)
+        self.max_workers = max_workers
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}"[-64:]
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Marks the unfinished jobs of dead runners on this host (and untagged ones) failed. Returns how many."""
+        host = self.runner_id.rsplit(':', 1)[0]
+        conn = self.connection_factory()
+        if not conn:
+            print("Error failing orphaned export jobs: no database connection")
+            return 0
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, runner_id FROM tbl_export_jobs WHERE status IN ('queued', 'running')")
+            orphaned = []
+            for job_id, runner_id in cursor.fetchall():
+                if not runner_id:
+                    orphaned.append(job_id)
+                    continue
+                runner_host, _, pid = runner_id.rpartition(':')
+                if runner_host == host and (runner_id == self.runner_id or not pid.isdigit() or not _process_alive(int(pid))):
+                    orphaned.append(job_id) # Our own id here means an earlier process that had the same pid
+            if orphaned:
+                placeholders = ', '.join(['%s'] * len(orphaned))
+                cursor.execute(f"""
+                    UPDATE tbl_export_jobs SET status = 'failed', error = 'interrupted by a restart', finished_at = NOW()
+                    WHERE id IN ({placeholders}) AND status IN ('queued', 'running')
+                """, tuple(orphaned))
+                conn.commit()
+            return len(orphaned)
+        except mysql.connector.Error as err:
+            conn.rollback()
+            print(f"Error failing orphaned export jobs: {err}")
+            return 0
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 'spawn' keeps the workers free of the web process's sockets and threads
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def submit(self, job_id, query, query_params, template_dir, template_name, output_path, chunk_size):
+        """Queues a persisted job (row already in tbl_export_jobs) for rendering."""
+        if not self._slots.acquire(blocking=False):
+            raise ExportQueueFull()
+        try:
+            future = self._get_executor().submit(render_orders_pdf, job_id, self.db_config, query, tuple(query_params),
+                                                 template_dir, template_name, output_path, chunk_size)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda done: self._finished(job_id, done))
+        return future
+
+    def _finished(self, job_id, future):
+        self._slots.release()
+        error = future.exception()
+        if error is None:
+            return
+        # The worker records its own failures; this covers crashes before it could (e.g. a killed process)
+        conn = None
+        cursor = None
+        try:
+            conn = self.connection_factory()
+            if not conn:
+                print(f"Error recording failed export job {job_id}: no database connection")
+                return
+            cursor = conn.cursor()
+            cursor.execute("UPDATE tbl_export_jobs SET status = 'failed', error = %s, finished_at = NOW() WHERE id = %s AND status IN ('queued', 'running')",
+                           (str(error)[:4000], job_id))
+            conn.commit()
+        except mysql.connector.Error as err:
+            print(f"Error recording failed export job {job_id}: {err}")
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
@@ -0,0 +1,183 @@
+# Kiosk Offline Buffer
+# Project Bin - บันทึกการสแกนคืนขยะไว้ในเครื่อง kiosk (SQLite) ระหว่างขาดการเชื่อมต่อ แล้วซิงก์ไปยังเซิร์ฟเวอร์เป็นชุด
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+EVENT_PENDING = 'pending'
+EVENT_UNVERIFIED = 'unverified' # Recorded for an order the kiosk had not loaded; only the server can check it
+
+
+class KioskBuffer:
+    """
+    Kiosk-side journal of disposal scans, in a local SQLite file, so scans are not lost
+    while the link to the server is down.
+
+    Order lines are loaded from GET /kiosk/orders/<barcode_id> while online
+    (load_order()). record_scan() applies the rules of /bin locally: a scan counts only
+    up to the line's quantity minus its server-confirmed disquantity and the scans not
+    yet synced. sync() sends the pending scans, oldest first, to POST /kiosk/sync in
+    batches of `batch_size` and stores the server's answer for each of them; the
+    confirmed disquantity of every line is taken from the answer. Every scan carries a
+    random idempotency key, so a batch whose answer was lost is simply sent again.
+    """
+
+    def __init__(self, path, kiosk_id, retention=604800):
+        self.path = path
+        self.kiosk_id = kiosk_id
+        self.retention = retention
+        self._lock = threading.Lock() # Serialises record_scan() checks with sync() updates
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS order_lines (
+                    barcode_id TEXT NOT NULL,
+                    products_id TEXT NOT NULL,
+                    products_name TEXT,
+                    quantity INTEGER NOT NULL,
+                    disquantity INTEGER NOT NULL,
+                    loaded_at REAL NOT NULL,
+                    PRIMARY KEY (barcode_id, products_id)
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS scan_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_key TEXT NOT NULL UNIQUE,
+                    barcode_id TEXT NOT NULL,
+                    products_id TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    scanned_at REAL NOT NULL,
+                    status TEXT NOT NULL,
+                    synced INTEGER NOT NULL DEFAULT 0,
+                    applied INTEGER,
+                    synced_at REAL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_scan_events_pending ON scan_events (synced, id)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_scan_events_line ON scan_events (barcode_id, products_id, synced)")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call: sqlite3 connections cannot be shared across threads
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            with db: # Commits on success, rolls back on error
+                yield db
+        finally:
+            db.close()
+
+    def load_order(self, barcode_id, lines):
+        """Stores the order lines returned by GET /kiosk/orders/<barcode_id> (its 'lines' list)."""
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.executemany("""
+                INSERT OR REPLACE INTO order_lines (barcode_id, products_id, products_name, quantity, disquantity, loaded_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(str(barcode_id), str(line['products_id']), line.get('products_name'), int(line['quantity']), int(line['disquantity']), now)
+                  for line in lines])
+
+    def record_scan(self, barcode_id, products_id, count=1, allow_unknown=False):
+        """
+        Records `count` returned packages of one order line and returns a result dict
+        like the server's ('ok', 'partial', 'exceeds_quantity', 'not_found',
+        'invalid_count', or 'unverified' for an order that was never loaded when
+        `allow_unknown` is set). Only the applied part is buffered for sync.
+        """
+        barcode_id, products_id = str(barcode_id), str(products_id)
+        result = {'products_id': products_id, 'requested': count, 'applied': 0}
+        if count <= 0:
+            result['status'] = 'invalid_count'
+            return result
+        with self._lock, self._connect() as db:
+            line = db.execute("SELECT * FROM order_lines WHERE barcode_id = ? AND products_id = ?", (barcode_id, products_id)).fetchone()
+            if line is None:
+                if not allow_unknown:
+                    result['status'] = 'not_found'
+                    return result
+                applied, status = count, EVENT_UNVERIFIED
+            else:
+                unsynced = db.execute("SELECT COALESCE(SUM(count), 0) FROM scan_events WHERE barcode_id = ? AND products_id = ? AND synced = 0",
+                                      (barcode_id, products_id)).fetchone()[0]
+                disquantity = line['disquantity'] + unsynced
+                applied = max(min(count, line['quantity'] - disquantity), 0)
+                result.update({'products_name': line['products_name'], 'quantity': line['quantity'], 'disquantity': disquantity + applied})
+                if applied <= 0:
+                    result['status'] = 'exceeds_quantity'
+                    return result
+                status = 'ok' if applied == count else 'partial'
+            key = f"{self.kiosk_id}:{secrets.token_hex(12)}"[-64:]
+            db.execute("""
+                INSERT INTO scan_events (event_key, barcode_id, products_id, count, scanned_at, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (key, barcode_id, products_id, applied, time.time(), EVENT_UNVERIFIED if status == EVENT_UNVERIFIED else EVENT_PENDING))
+        result.update({'status': status, 'applied': applied, 'key': key})
+        return result
+
+    def pending(self, limit=1000):
+        """Returns up to `limit` scans not yet confirmed by the server, oldest first, as /kiosk/sync events."""
+        with self._connect() as db:
+            rows = db.execute("SELECT * FROM scan_events WHERE synced = 0 ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [{'key': row['event_key'], 'barcode_id': row['barcode_id'], 'products_id': row['products_id'],
+                 'count': row['count'], 'scanned_at': row['scanned_at']} for row in rows]
+
+    def apply_sync_response(self, response):
+        """
+        Stores the server's answer to one /kiosk/sync request: marks every answered scan
+        synced with its outcome and takes the confirmed disquantity of the order lines
+        from it. Scans the server answered 'invalid' are kept with that status and not resent.
+        """
+        now = time.time()
+        with self._lock, self._connect() as db:
+            for result in response.get('results', []):
+                status = result.get('status')
+                if status == 'duplicate': # Applied by an earlier sync whose answer was lost
+                    stored = [item for item in (result.get('result') or {}).get('results', [])
+                              if item.get('products_id') == result.get('products_id')] or [{}]
+                    result = dict(stored[0], key=result['key'], barcode_id=result.get('barcode_id'), status=status)
+                db.execute("UPDATE scan_events SET synced = 1, status = ?, applied = ?, synced_at = ? WHERE event_key = ?",
+                           (status, result.get('applied'), now, result['key']))
+                if result.get('disquantity') is not None and result.get('barcode_id'):
+                    # Results come in scan order, so the last one of a line holds its newest value
+                    db.execute("UPDATE order_lines SET disquantity = ?, loaded_at = ? WHERE barcode_id = ? AND products_id = ?",
+                               (int(result['disquantity']), now, result['barcode_id'], result['products_id']))
+            db.execute("DELETE FROM scan_events WHERE synced = 1 AND synced_at <= ?", (now - self.retention,))
+
+    def sync(self, send, batch_size=1000):
+        """
+        Sends all pending scans with `send(payload) -> response dict`, e.g. for a logged-in
+        requests.Session: lambda payload: http.post(url + '/kiosk/sync', json=payload, timeout=30).json()
+        Stops at the first batch that fails (the exception propagates; the batch stays
+        pending). Returns totals: sent, applied packages, duplicates and conflicts.
+        """
+        totals = {'sent': 0, 'applied_total': 0, 'duplicates': 0, 'conflicts': []}
+        while True:
+            events = self.pending(batch_size)
+            if not events:
+                return totals
+            response = send({'kiosk_id': self.kiosk_id, 'events': events})
+            if 'results' not in response:
+                raise RuntimeError(response.get('error') or 'unexpected response from /kiosk/sync')
+            self.apply_sync_response(response)
+            totals['sent'] += len(events)
+            totals['applied_total'] += response.get('applied_total', 0)
+            totals['duplicates'] += response.get('duplicates', 0)
+            totals['conflicts'].extend(response.get('conflicts', []))
+
+    def stats(self):
+        """Returns the number of buffered scans by sync state and the age of the oldest pending one."""
+        with self._connect() as db:
+            row = db.execute("""
+                SELECT SUM(synced = 0) AS pending, SUM(synced = 1) AS synced, MIN(CASE WHEN synced = 0 THEN scanned_at END) AS oldest
+                FROM scan_events
+            """).fetchone()
+        return {'pending': row['pending'] or 0, 'synced': row['synced'] or 0,
+                'oldest_pending_seconds': time.time() - row['oldest'] if row['oldest'] else 0.0}
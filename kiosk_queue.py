@@ -0,0 +1,265 @@
+# Kiosk Scan Queue
+# Project Bin - รับรายการสแกนจากตู้คืนขยะแบบ asynchronous: ตอบรับทันที แล้วบันทึกลงฐานข้อมูลตามลำดับของแต่ละบาร์โค้ด
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+SCAN_QUEUED = 'queued'
+SCAN_APPLIED = 'applied' # At least one package was applied
+SCAN_REJECTED = 'rejected' # Written, but nothing could be applied (unknown order, quantity exceeded, ...)
+SCAN_FAILED = 'failed' # Could not be written after all retries; resubmitting the key queues it again
+
+
+class ScanJournal:
+    """
+    Local SQLite record of every accepted kiosk scan, keyed by (store_id, idempotency key).
+
+    A scan is written here before it is acknowledged, so acknowledged scans survive a
+    restart (pending() hands them back to the queue) and a retried key finds the
+    original scan instead of adding a second one. Finished scans are purged
+    `retention` seconds after they finished, at most once per `purge_interval`.
+    """
+
+    def __init__(self, path, retention=604800, purge_interval=300):
+        self.path = path
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS scans (
+                    store_id INTEGER NOT NULL,
+                    scan_key TEXT NOT NULL,
+                    kiosk_id TEXT NOT NULL,
+                    barcode_id TEXT NOT NULL,
+                    items TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (store_id, scan_key)
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_scans_status ON scans (status, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call: sqlite3 connections cannot be shared across threads
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            with db: # Commits on success, rolls back on error
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _record(row):
+        if row is None:
+            return None
+        record = dict(row)
+        record['key'] = record.pop('scan_key')
+        record['items'] = json.loads(record['items'])
+        record['result'] = json.loads(record['result']) if record['result'] else None
+        return record
+
+    def add(self, store_id, key, kiosk_id, barcode_id, counts):
+        """
+        Records a new scan as 'queued'. Returns (True, record), or (False, existing record)
+        when the key is already known for this store; a known 'failed' scan is queued again
+        and returned as created.
+        """
+        now = time.time()
+        with self._connect() as db:
+            inserted = db.execute("""
+                INSERT OR IGNORE INTO scans (store_id, scan_key, kiosk_id, barcode_id, items, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (store_id, key, kiosk_id, barcode_id, json.dumps(counts, separators=(',', ':')), SCAN_QUEUED, now, now)).rowcount
+            if not inserted:
+                inserted = db.execute("UPDATE scans SET status = ?, attempts = 0, updated_at = ? WHERE store_id = ? AND scan_key = ? AND status = ?",
+                                      (SCAN_QUEUED, now, store_id, key, SCAN_FAILED)).rowcount
+            row = db.execute("SELECT * FROM scans WHERE store_id = ? AND scan_key = ?", (store_id, key)).fetchone()
+            self._maybe_purge(db, now)
+        return bool(inserted), self._record(row)
+
+    def get(self, store_id, key):
+        """Returns the scan stored under `key` for the store, or None."""
+        with self._connect() as db:
+            return self._record(db.execute("SELECT * FROM scans WHERE store_id = ? AND scan_key = ?", (store_id, key)).fetchone())
+
+    def finish(self, store_id, key, status, result, attempts):
+        with self._connect() as db:
+            db.execute("UPDATE scans SET status = ?, result = ?, attempts = ?, updated_at = ? WHERE store_id = ? AND scan_key = ?",
+                       (status, json.dumps(result, default=str, ensure_ascii=False, separators=(',', ':')), attempts, time.time(), store_id, key))
+
+    def pending(self):
+        """Returns every scan still 'queued', oldest first."""
+        with self._connect() as db:
+            return [self._record(row) for row in db.execute("SELECT * FROM scans WHERE status = ? ORDER BY created_at", (SCAN_QUEUED,))]
+
+    def _maybe_purge(self, db, now):
+        with self._lock:
+            if now - self._last_purge < self.purge_interval:
+                return
+            self._last_purge = now
+        db.execute("DELETE FROM scans WHERE status <> ? AND updated_at <= ?", (SCAN_QUEUED, now - self.retention))
+
+
+class ScanQueue:
+    """
+    Applies journaled scans in the background with `workers` threads.
+
+    Scans of the same barcode in the same store are applied one at a time, in the order
+    they were accepted; other barcodes (and the same barcode in another store) proceed
+    in parallel. `apply(record)` writes one scan
+    to the database and returns (status, result). It must be idempotent per key (the
+    database keeps its own record of applied keys): after a crash between the database
+    commit and the journal update, the scan is handed to it again. Exceptions are
+    retried up to `max_attempts` times with a growing delay, then the scan is 'failed'.
+    """
+
+    def __init__(self, journal, apply, workers=2, max_attempts=5, retry_delay=0.5):
+        self.journal = journal
+        self.apply = apply
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queues = {} # (store_id, barcode_id) -> deque of records; present while the barcode has work
+        self._ready = deque() # (store_id, barcode_id) with work and no worker on them
+        self._cond = threading.Condition()
+        self._done = threading.Condition() # Separate, so notify() on _cond always wakes a worker
+        self._generation = 0 # Bumped (under _done) every time a scan finishes, for wait()
+        self._threads = []
+        self._metrics = {
+            'accepted': 0,
+            'duplicates': 0,
+            'applied': 0,
+            'rejected': 0,
+            'failed': 0,
+            'retries': 0,
+            'apply_seconds': 0.0,
+            'queue_wait_seconds': 0.0,
+            'max_queue_wait_seconds': 0.0,
+        }
+
+    def start(self):
+        """Starts the worker threads and queues the scans a previous process left unfinished."""
+        with self._cond:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'kiosk-scan-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        for record in self.journal.pending():
+            self._enqueue(record)
+
+    def submit(self, store_id, key, kiosk_id, barcode_id, counts):
+        """
+        Journals and queues a scan. Returns (queued, record): queued is False for a key
+        seen before, whose record (and result, once finished) is returned unchanged.
+        """
+        created, record = self.journal.add(store_id, key, kiosk_id, barcode_id, counts)
+        with self._cond:
+            self._metrics['accepted' if created else 'duplicates'] += 1
+        if created:
+            self._enqueue(record)
+        return created, record
+
+    def _enqueue(self, record):
+        record['queued_at'] = time.monotonic()
+        lane = (record['store_id'], record['barcode_id'])
+        with self._cond:
+            queue = self._queues.get(lane)
+            if queue is None:
+                queue = self._queues[lane] = deque()
+                self._ready.append(lane)
+                self._cond.notify()
+            queue.append(record)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                lane = self._ready.popleft()
+                record = self._queues[lane][0]
+            try:
+                self._process(record)
+            finally:
+                with self._cond:
+                    queue = self._queues[lane]
+                    queue.popleft()
+                    if queue:
+                        self._ready.append(lane)
+                        self._cond.notify()
+                    else:
+                        del self._queues[lane]
+                with self._done:
+                    self._generation += 1
+                    self._done.notify_all()
+
+    def _process(self, record):
+        waited = time.monotonic() - record['queued_at']
+        started = time.monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                status, result = self.apply(record)
+                break
+            except Exception as err:
+                if attempts >= self.max_attempts:
+                    status, result = SCAN_FAILED, {'error': str(err)}
+                    break
+                with self._cond:
+                    self._metrics['retries'] += 1
+                time.sleep(self.retry_delay * 2 ** (attempts - 1))
+        try:
+            self.journal.finish(record['store_id'], record['key'], status, result, attempts)
+        except sqlite3.Error as err:
+            # The scan stays 'queued' in the journal and is handed to apply() again after a restart
+            print(f"Error recording kiosk scan {record['key']}: {err}")
+        with self._cond:
+            self._metrics[status if status in (SCAN_APPLIED, SCAN_REJECTED) else SCAN_FAILED] += 1
+            self._metrics['apply_seconds'] += time.monotonic() - started
+            self._metrics['queue_wait_seconds'] += waited
+            self._metrics['max_queue_wait_seconds'] = max(self._metrics['max_queue_wait_seconds'], waited)
+
+    def wait(self, store_id, key, timeout):
+        """Returns the journal record of a scan once it is no longer queued, or after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._done:
+                generation = self._generation
+            record = self.journal.get(store_id, key)
+            remaining = deadline - time.monotonic()
+            if record is None or record['status'] != SCAN_QUEUED or remaining <= 0:
+                return record
+            with self._done:
+                if self._generation == generation:
+                    self._done.wait(remaining)
+
+    def stats(self):
+        """Returns queue depth and throughput counters."""
+        with self._cond:
+            snapshot = dict(self._metrics)
+            snapshot['queued'] = sum(len(queue) for queue in self._queues.values())
+            snapshot['barcodes_queued'] = len(self._queues)
+            snapshot['workers'] = len(self._threads)
+        finished = snapshot['applied'] + snapshot['rejected'] + snapshot['failed']
+        snapshot['avg_apply_ms'] = 1000 * snapshot.pop('apply_seconds') / finished if finished else 0.0
+        snapshot['avg_queue_wait_ms'] = 1000 * snapshot.pop('queue_wait_seconds') / finished if finished else 0.0
+        snapshot['max_queue_wait_ms'] = 1000 * snapshot.pop('max_queue_wait_seconds')
+        return snapshot
@@ -0,0 +1,136 @@
+# Live Events
+# Project Bin - ส่งการเปลี่ยนแปลงของคำสั่งซื้อและถังขยะไปยังหน้าจอพนักงานแบบสด (Server-Sent Events) ภายในโปรเซสเดียว
+
+import json
+import threading
+import time
+from collections import deque
+
+ALL_STORES = None # subscribe() store for administrators watching every store
+EVENT_RESET = 'reset' # Sent instead of events that are no longer buffered: reload the page data
+
+
+class TooManySubscribers(Exception):
+    """Raised by subscribe() when max_subscribers streams are already open in this process."""
+
+
+class EventBroker:
+    """
+    In-process publish/subscribe of store events (order-created, disquantity-changed,
+    bin-level, ...). Writers call publish() after their commit; nothing is written to
+    the database and each web process only sees the events of its own requests.
+
+    Events get increasing ids and the last `buffer_size` of them are kept in memory, so
+    a client reconnecting with the id of the last event it saw (the Last-Event-ID header
+    of EventSource) is sent only what it missed. When that id is no longer buffered (or
+    comes from an earlier run of the process) the client gets a single 'reset' event
+    instead. Subscribers of one store are only woken by that store's events.
+    """
+
+    def __init__(self, buffer_size=1000, max_subscribers=100):
+        self.max_subscribers = max_subscribers
+        self._events = deque(maxlen=buffer_size) # (id, store_id, event_type, data), oldest first
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._conditions = {} # store_id (or ALL_STORES) -> Condition on _lock, while it has subscribers
+        self._subscribers = {} # store_id (or ALL_STORES) -> open subscriptions
+        self._metrics = {'published': 0, 'delivered': 0, 'resets': 0, 'rejected': 0}
+
+    def publish(self, store_id, event_type, data):
+        """Records an event for `store_id` and wakes that store's subscribers. Returns its id."""
+        with self._lock:
+            self._last_id += 1
+            self._events.append((self._last_id, store_id, event_type, data))
+            self._metrics['published'] += 1
+            for key in (store_id, ALL_STORES):
+                condition = self._conditions.get(key)
+                if condition is not None:
+                    condition.notify_all()
+            return self._last_id
+
+    def subscribe(self, store_id, last_event_id=None):
+        """
+        Opens a subscription to one store's events (ALL_STORES for every store), starting
+        after `last_event_id`, or with the next published event when None. Raises
+        TooManySubscribers when the limit is reached. Close the subscription when done.
+        """
+        with self._lock:
+            if sum(self._subscribers.values()) >= self.max_subscribers:
+                self._metrics['rejected'] += 1
+                raise TooManySubscribers()
+            self._subscribers[store_id] = self._subscribers.get(store_id, 0) + 1
+            if store_id not in self._conditions:
+                self._conditions[store_id] = threading.Condition(self._lock)
+            position = self._last_id if last_event_id is None else last_event_id
+        return Subscription(self, store_id, position)
+
+    def _unsubscribe(self, store_id):
+        with self._lock:
+            self._subscribers[store_id] -= 1
+            if not self._subscribers[store_id]:
+                del self._subscribers[store_id]
+                del self._conditions[store_id]
+
+    def _read(self, store_id, position, timeout):
+        """
+        Returns (events, new position): the store's events after `position`, waiting up to
+        `timeout` seconds for one. The position moves past other stores' events too.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                oldest = self._events[0][0] if self._events else self._last_id + 1
+                if position > self._last_id or position < oldest - 1:
+                    self._metrics['resets'] += 1
+                    return [(self._last_id, store_id, EVENT_RESET, {'last_event_id': self._last_id})], self._last_id
+                events = []
+                for event in reversed(self._events): # Newest first, so only the new events are looked at
+                    if event[0] <= position:
+                        break
+                    if store_id is ALL_STORES or event[1] == store_id:
+                        events.append(event)
+                position = self._last_id
+                if events:
+                    events.reverse()
+                    self._metrics['delivered'] += len(events)
+                    return events, position
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], position
+                self._conditions[store_id].wait(remaining)
+
+    def stats(self):
+        """Returns subscriber counts and event counters."""
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot['subscribers'] = sum(self._subscribers.values())
+            snapshot['stores_watched'] = len(self._subscribers)
+            snapshot['buffered'] = len(self._events)
+            snapshot['last_event_id'] = self._last_id
+        return snapshot
+
+
+class Subscription:
+    """One open event stream, see EventBroker.subscribe()."""
+
+    def __init__(self, broker, store_id, position):
+        self.broker = broker
+        self.store_id = store_id
+        self.position = position
+        self._closed = False
+
+    def read(self, timeout):
+        """Returns the next (id, store_id, event_type, data) events, or [] after `timeout` seconds without any."""
+        events, self.position = self.broker._read(self.store_id, self.position, timeout)
+        return events
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.broker._unsubscribe(self.store_id)
+
+
+def format_sse(event_id, event_type, data):
+    """Formats one event as a text/event-stream message (data is sent as one line of JSON)."""
+    payload = json.dumps(data, default=str, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n"
@@ -0,0 +1,17 @@
+-- Migration 001: indexes for the hot tbl_order lookups
+-- Apply to an existing project_bin database:
+--   mysql -u root project_bin < migrations/001_order_lookup_indexes.sql
+--
+-- idx_order_barcode      /bin scan: WHERE o.barcode_id = ? AND o.products_id = ? AND o.store_id = ?
+--                        (prefix also serves the barcode-only filter on the bin page)
+-- idx_order_email        profile() statistics and member order filters: WHERE email = ?
+-- idx_order_store_order  cart() / tbl_order per-store listing: WHERE store_id = ? AND order_id = ?
+--
+-- Verify with e.g.
+--   EXPLAIN SELECT o.id FROM tbl_order o WHERE o.barcode_id = '0000000000000' AND o.products_id = 'P001' AND o.store_id = 2;
+-- which should report key = idx_order_barcode instead of a full scan (type = ALL).
+
+ALTER TABLE `tbl_order`
+  ADD KEY `idx_order_barcode` (`barcode_id`,`products_id`,`store_id`),
+  ADD KEY `idx_order_email` (`email`),
+  ADD KEY `idx_order_store_order` (`store_id`,`order_id`);
@@ -0,0 +1,20 @@
+-- Migration 002: persistent counters for order barcodes and order ids
+--   mysql -u root project_bin < migrations/002_sequences.sql
+--
+-- Each row is a named counter advanced atomically with
+--   UPDATE tbl_sequences SET next_value = LAST_INSERT_ID(next_value + <block>) WHERE seq_name = ?
+-- The primary key guarantees one counter per name, so two workers can never
+-- reserve overlapping blocks.
+--
+-- order_barcode starts at 10^12: barcodes issued before this migration were
+-- encode(seed) with a random seed in [10^11, 10^12), and encode() is a bijection,
+-- so sequence values from 10^12 upwards cannot collide with existing barcodes.
+
+CREATE TABLE IF NOT EXISTS `tbl_sequences` (
+  `seq_name` varchar(64) NOT NULL,
+  `next_value` bigint(20) UNSIGNED NOT NULL,
+  PRIMARY KEY (`seq_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+INSERT IGNORE INTO `tbl_sequences` (`seq_name`, `next_value`) VALUES
+('order_barcode', 1000000000000);
@@ -0,0 +1,25 @@
+-- Migration 003: FULLTEXT indexes for the management-page search boxes
+--   mysql -u root project_bin < migrations/003_fulltext_search.sql
+--
+-- Requires MySQL 5.7.6+ (ngram parser, needed to tokenise Thai text, which has
+-- no spaces between words). After applying it, start the app with
+--   SEARCH_BACKEND=fulltext
+-- Without this migration leave SEARCH_BACKEND unset: search keeps using LIKE '%term%'.
+-- Column groups must match SEARCH_FIELDS in search.py.
+
+ALTER TABLE `tbl_order`
+  ADD FULLTEXT KEY `ft_order_search` (`order_id`,`products_name`,`email`) WITH PARSER ngram;
+
+ALTER TABLE `tbl_products`
+  ADD FULLTEXT KEY `ft_products_search` (`products_name`,`products_id`) WITH PARSER ngram;
+
+ALTER TABLE `tbl_category`
+  ADD FULLTEXT KEY `ft_category_search` (`category_name`) WITH PARSER ngram;
+
+ALTER TABLE `tbl_users`
+  ADD FULLTEXT KEY `ft_users_search` (`firstname`,`lastname`,`email`) WITH PARSER ngram,
+  ADD FULLTEXT KEY `ft_users_email` (`email`) WITH PARSER ngram,
+  ADD KEY `idx_users_role` (`role`);
+
+ALTER TABLE `tbl_stores`
+  ADD FULLTEXT KEY `ft_stores_search` (`store_name`,`address`,`phone`) WITH PARSER ngram;
@@ -0,0 +1,21 @@
+-- Migration 004: persisted background export jobs
+--   mysql -u root project_bin < migrations/004_export_jobs.sql
+--
+-- status: queued -> running -> done | failed
+-- file_path points to the rendered file under the Flask instance folder (instance/exports).
+
+CREATE TABLE IF NOT EXISTS `tbl_export_jobs` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `job_type` varchar(50) NOT NULL,
+  `status` enum('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+  `requested_by` int(11) DEFAULT NULL,
+  `store_id` int(11) DEFAULT NULL,
+  `row_count` int(11) NOT NULL DEFAULT 0,
+  `file_path` varchar(512) DEFAULT NULL,
+  `error` text DEFAULT NULL,
+  `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  `started_at` timestamp NULL DEFAULT NULL,
+  `finished_at` timestamp NULL DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_export_jobs_user` (`requested_by`,`status`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
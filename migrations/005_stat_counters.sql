@@ -0,0 +1,26 @@
+-- Migration 005: materialized counters for the homepage statistics
+--   mysql -u root project_bin < migrations/005_stat_counters.sql
+--
+-- index() used to run COUNT(*) over tbl_users and SUM(quantity), SUM(disquantity)
+-- over tbl_order on every visit. The write paths now keep these totals up to date
+-- in the same transaction as the change; each total is split over several slots
+-- (rows) to spread row-lock contention, and readers sum the slots.
+--
+-- The counters are seeded from the current data here; `flask rebuild-stats`
+-- recomputes them at any time.
+
+CREATE TABLE IF NOT EXISTS `tbl_stat_counters` (
+  `stat_name` varchar(64) NOT NULL,
+  `slot` tinyint(3) UNSIGNED NOT NULL DEFAULT 0,
+  `value` bigint(20) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`stat_name`,`slot`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+DELETE FROM `tbl_stat_counters`;
+
+INSERT INTO `tbl_stat_counters` (`stat_name`, `slot`, `value`)
+SELECT 'total_users', 0, COUNT(*) FROM `tbl_users`
+UNION ALL
+SELECT 'total_quantity', 0, COALESCE(SUM(`quantity`), 0) FROM `tbl_order`
+UNION ALL
+SELECT 'total_disquantity', 0, COALESCE(SUM(`disquantity`), 0) FROM `tbl_order`;
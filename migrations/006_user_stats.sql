@@ -0,0 +1,26 @@
+-- Migration 006: per-user statistics for the profile page
+--   mysql -u root project_bin < migrations/006_user_stats.sql
+--
+-- profile() used to aggregate tbl_order by email on every view. tbl_user_stats keeps
+-- one row per email, updated in the same transaction as every tbl_order write.
+-- recycling_rate is derived from the stored totals (same formula as before).
+--
+-- The table is backfilled here. `flask check-user-stats` reports rows that drifted
+-- from tbl_order and `flask check-user-stats --fix` rebuilds them.
+
+CREATE TABLE IF NOT EXISTS `tbl_user_stats` (
+  `email` varchar(255) NOT NULL,
+  `order_count` int(11) NOT NULL DEFAULT 0,
+  `total_quantity` bigint(20) NOT NULL DEFAULT 0,
+  `total_disquantity` bigint(20) NOT NULL DEFAULT 0,
+  `recycling_rate` int(11) GENERATED ALWAYS AS (CASE WHEN `total_quantity` > 0 THEN FLOOR(100 * `total_disquantity` / `total_quantity`) ELSE 0 END) VIRTUAL,
+  PRIMARY KEY (`email`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+DELETE FROM `tbl_user_stats`;
+
+INSERT INTO `tbl_user_stats` (`email`, `order_count`, `total_quantity`, `total_disquantity`)
+SELECT `email`, COUNT(*), COALESCE(SUM(`quantity`), 0), COALESCE(SUM(`disquantity`), 0)
+FROM `tbl_order`
+WHERE `email` IS NOT NULL
+GROUP BY `email`;
@@ -0,0 +1,36 @@
+-- Migration 007: append-only log of returned packages
+--   mysql -u root project_bin < migrations/007_disposal_events.sql
+--
+-- bin() / bin_batch used to update tbl_order.disquantity, tbl_bin, tbl_user_stats and
+-- tbl_stat_counters inside every scan. A scan now only locks its own order rows and
+-- appends one event per order row here; a background pass folds pending events
+-- (compacted = 0) into tbl_order.disquantity and the statistics tables.
+-- Manual edits of disquantity are logged as already-compacted 'adjust' events, so
+-- for every order row SUM(quantity) WHERE compacted = 1 equals tbl_order.disquantity.
+--
+-- Existing disquantity values are backfilled as compacted 'backfill' events.
+-- `flask check-disposals` reports order rows that drifted from the log and
+-- `flask check-disposals --fix` appends adjustment events for them.
+
+CREATE TABLE IF NOT EXISTS `tbl_disposal_events` (
+  `id` bigint(20) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `order_row_id` int(11) NOT NULL,
+  `barcode_id` varchar(255) DEFAULT NULL,
+  `products_id` varchar(255) DEFAULT NULL,
+  `category_id` int(11) DEFAULT NULL,
+  `store_id` int(11) DEFAULT NULL,
+  `kiosk_id` varchar(64) NOT NULL DEFAULT 'web',
+  `quantity` int(11) NOT NULL,
+  `source` varchar(16) NOT NULL DEFAULT 'scan',
+  `compacted` tinyint(1) NOT NULL DEFAULT 0,
+  `created_at` datetime(3) NOT NULL DEFAULT current_timestamp(3),
+  PRIMARY KEY (`id`),
+  KEY `idx_disposal_pending` (`compacted`,`order_row_id`),
+  KEY `idx_disposal_store_time` (`store_id`,`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+INSERT INTO `tbl_disposal_events` (`order_row_id`, `barcode_id`, `products_id`, `category_id`, `store_id`, `quantity`, `source`, `compacted`, `created_at`)
+SELECT o.`id`, o.`barcode_id`, o.`products_id`, p.`category_id`, o.`store_id`, o.`disquantity`, 'backfill', 1, o.`order_date`
+FROM `tbl_order` o
+LEFT JOIN `tbl_products` p ON o.`products_id` = p.`products_id`
+WHERE o.`disquantity` > 0;
@@ -0,0 +1,21 @@
+-- Migration 008: idempotency keys of kiosk scans
+--   mysql -u root project_bin < migrations/008_kiosk_scans.sql
+--
+-- POST /kiosk/scans acknowledges scans from the local journal and applies them in
+-- the background. Each applied scan gets one row here, inserted in the same
+-- transaction as its tbl_disposal_events rows, so a retried or replayed key is
+-- recognised and never applied (or paid out) twice. `result` keeps the per-item
+-- outcome returned to the kiosk.
+
+CREATE TABLE IF NOT EXISTS `tbl_kiosk_scans` (
+  `store_id` int(11) NOT NULL,
+  `scan_key` varchar(64) NOT NULL,
+  `kiosk_id` varchar(64) NOT NULL,
+  `barcode_id` varchar(255) NOT NULL,
+  `status` varchar(16) NOT NULL DEFAULT 'applied',
+  `applied_total` int(11) NOT NULL DEFAULT 0,
+  `result` text DEFAULT NULL,
+  `created_at` datetime NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`store_id`,`scan_key`),
+  KEY `idx_kiosk_scans_barcode` (`barcode_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,64 @@
+-- Migration 009: coin payout ledger, kiosk balances and settlement batches
+--   mysql -u root project_bin < migrations/009_payout_ledger.sql
+--
+-- Every package applied by a scan is credited (PAYOUT_RATE_PER_PACKAGE baht, default 1)
+-- in tbl_payout_ledger in the same transaction as its disposal event.
+-- tbl_payout_balances keeps credited / settled totals per store and kiosk, split over
+-- slots like tbl_stat_counters; a balance is SUM(credited) - SUM(settled) over its slots.
+-- POST /payouts/settle moves a kiosk's unsettled credits into a tbl_payout_batches row.
+--
+-- Packages returned before this migration are recorded once as 'opening' entries per
+-- store and barcode (at 1 baht each), so /payouts/reconciliation starts balanced. They do
+-- not count towards kiosk balances. `flask check-payouts --fix` rebuilds the balances.
+
+CREATE TABLE IF NOT EXISTS `tbl_payout_ledger` (
+  `id` bigint(20) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `store_id` int(11) NOT NULL,
+  `kiosk_id` varchar(64) NOT NULL DEFAULT 'web',
+  `entry_type` varchar(16) NOT NULL,
+  `barcode_id` varchar(255) DEFAULT NULL,
+  `order_row_id` int(11) DEFAULT NULL,
+  `packages` int(11) NOT NULL DEFAULT 0,
+  `amount` decimal(12,2) NOT NULL,
+  `batch_id` int(11) DEFAULT NULL,
+  `created_at` datetime(3) NOT NULL DEFAULT current_timestamp(3),
+  PRIMARY KEY (`id`),
+  KEY `idx_payout_unsettled` (`store_id`,`kiosk_id`,`entry_type`,`batch_id`),
+  KEY `idx_payout_batch` (`batch_id`),
+  KEY `idx_payout_barcode` (`store_id`,`barcode_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `tbl_payout_balances` (
+  `store_id` int(11) NOT NULL,
+  `kiosk_id` varchar(64) NOT NULL,
+  `slot` tinyint(3) UNSIGNED NOT NULL DEFAULT 0,
+  `packages` bigint(20) NOT NULL DEFAULT 0,
+  `credited` decimal(14,2) NOT NULL DEFAULT 0.00,
+  `settled` decimal(14,2) NOT NULL DEFAULT 0.00,
+  PRIMARY KEY (`store_id`,`kiosk_id`,`slot`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `tbl_payout_batches` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `store_id` int(11) NOT NULL,
+  `kiosk_id` varchar(64) NOT NULL,
+  `entry_count` int(11) NOT NULL DEFAULT 0,
+  `packages` int(11) NOT NULL DEFAULT 0,
+  `amount` decimal(12,2) NOT NULL DEFAULT 0.00,
+  `counted_amount` decimal(12,2) DEFAULT NULL,
+  `settled_by` varchar(255) DEFAULT NULL,
+  `created_at` datetime NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`id`),
+  KEY `idx_payout_batches_kiosk` (`store_id`,`kiosk_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+INSERT INTO `tbl_payout_ledger` (`store_id`, `kiosk_id`, `entry_type`, `barcode_id`, `packages`, `amount`)
+SELECT o.`store_id`, 'web', 'opening', o.`barcode_id`,
+       SUM(o.`disquantity` + COALESCE(e.`pending`, 0)), SUM(o.`disquantity` + COALESCE(e.`pending`, 0)) * 1.00
+FROM `tbl_order` o
+LEFT JOIN (
+  SELECT `order_row_id`, SUM(`quantity`) AS `pending` FROM `tbl_disposal_events` WHERE `compacted` = 0 GROUP BY `order_row_id`
+) e ON e.`order_row_id` = o.`id`
+WHERE o.`store_id` IS NOT NULL
+GROUP BY o.`store_id`, o.`barcode_id`
+HAVING SUM(o.`disquantity` + COALESCE(e.`pending`, 0)) > 0;
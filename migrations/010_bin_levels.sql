@@ -0,0 +1,26 @@
+-- Migration 010: bin fill levels per store, kiosk and category
+--   mysql -u root project_bin < migrations/010_bin_levels.sql
+--
+-- tbl_bin holds one global flag per category that every scan used to set. Bins are now
+-- tracked per store, kiosk and category: fill_count is the number of packages since
+-- the bin was last emptied, added by the disposal compaction pass (one multi-row
+-- upsert per pass, never by the scans themselves). needs_collection is stored and
+-- indexed, so /bins/collection reads only the bins that are due.
+--
+-- Levels start at 0: empty the bins when this is deployed, or set the counts by hand.
+-- tbl_bin is still flagged (from compaction) for anything that reads it.
+
+CREATE TABLE IF NOT EXISTS `tbl_bin_levels` (
+  `store_id` int(11) NOT NULL,
+  `kiosk_id` varchar(64) NOT NULL,
+  `category_id` int(11) NOT NULL,
+  `fill_count` int(11) NOT NULL DEFAULT 0,
+  `total_count` bigint(20) NOT NULL DEFAULT 0,
+  `capacity` int(11) NOT NULL DEFAULT 200,
+  `collect_at` int(11) NOT NULL DEFAULT 160,
+  `needs_collection` tinyint(1) GENERATED ALWAYS AS (`fill_count` >= `collect_at`) STORED,
+  `last_emptied_at` datetime DEFAULT NULL,
+  `updated_at` datetime NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+  PRIMARY KEY (`store_id`,`kiosk_id`,`category_id`),
+  KEY `idx_bin_collection` (`needs_collection`,`store_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
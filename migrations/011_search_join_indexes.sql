@@ -0,0 +1,27 @@
+-- Migration 011: join indexes for the FULLTEXT search subqueries
+--   mysql -u root project_bin < migrations/011_search_join_indexes.sql
+--
+-- With SEARCH_BACKEND=fulltext, search.search_clause() matches the page's primary key
+-- against a UNION of single-table subqueries, so every MATCH ... AGAINST can use its
+-- own FULLTEXT index (an OR across tables or with '=' predicates cannot). The category
+-- and moderator subqueries join back to tbl_products / tbl_stores through these keys.
+--
+-- Verify with e.g. (SEARCH_BACKEND=fulltext, after migrations 003 and 011)
+--   EXPLAIN SELECT p.*, c.category_name FROM tbl_products p
+--   LEFT JOIN tbl_category c ON p.category_id = c.category_id
+--   WHERE (p.id IN (SELECT hit_id FROM (
+--       SELECT id AS hit_id FROM tbl_products WHERE MATCH(products_name, products_id) AGAINST ('"ขวด"' IN BOOLEAN MODE)
+--       UNION SELECT fp.id AS hit_id FROM tbl_category fc JOIN tbl_products fp ON fp.category_id = fc.category_id
+--       WHERE MATCH(fc.category_name) AGAINST ('"ขวด"' IN BOOLEAN MODE)) AS search_hits));
+-- Expected plan: the outer p row is type = eq_ref, key = PRIMARY (driven by the
+-- materialized hits, not type = ALL); the DERIVED tbl_products row is type = fulltext,
+-- key = ft_products_search; fc is type = fulltext, key = ft_category_search; fp is
+-- type = ref, key = idx_products_category. The users, stores and categories pages
+-- follow the same shape (ft_users_search / idx_users_role, ft_stores_search /
+-- ft_users_email + idx_stores_moderator, ft_category_search / category_id).
+
+ALTER TABLE `tbl_products`
+  ADD KEY `idx_products_category` (`category_id`);
+
+ALTER TABLE `tbl_stores`
+  ADD KEY `idx_stores_moderator` (`moderator_user_id`);
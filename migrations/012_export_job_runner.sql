@@ -0,0 +1,9 @@
+-- Migration 012: owner of each background export job
+--   mysql -u root project_bin < migrations/012_export_job_runner.sql
+--
+-- runner_id is host:pid of the web process that queued the job. When a process starts,
+-- ExportJobRunner.start() marks the queued/running jobs of dead processes on its host
+-- (and jobs queued before this migration) as failed.
+
+ALTER TABLE `tbl_export_jobs`
+  ADD COLUMN `runner_id` varchar(64) DEFAULT NULL AFTER `store_id`;
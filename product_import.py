@@ -0,0 +1,264 @@
+# Bulk Product Import
+# Project Bin - นำเข้าสินค้าจำนวนมากจากไฟล์ CSV (ตรวจสอบทีละแถว และบันทึกแบบ upsert เป็นชุด)
+
+import csv
+import time
+from decimal import Decimal, InvalidOperation
+
+import mysql.connector
+
+# CSV header (lower-cased, spaces as underscores) -> tbl_products column. The headers
+# written by /export_products_csv ("Product ID", "Category ID", ...) are accepted as-is.
+_COLUMN_ALIASES = {
+    'products_id': 'products_id',
+    'product_id': 'products_id',
+    'products_name': 'products_name',
+    'product_name': 'products_name',
+    'price': 'price',
+    'stock': 'stock',
+    'category_id': 'category_id',
+    'description': 'description',
+    'barcode_id': 'barcode_id',
+    'store_id': 'store_id',
+}
+REQUIRED_COLUMNS = ('products_id', 'products_name', 'price')
+UPSERT_COLUMNS = ('products_id', 'products_name', 'price', 'stock', 'category_id', 'barcode_id', 'store_id', 'description')
+# Never changed on existing products: the key, and store_id (a product never moves to another store)
+_FIXED_COLUMNS = ('products_id', 'store_id')
+
+MAX_PRICE = Decimal('99999999.99') # decimal(10,2)
+MAX_STOCK = 2147483647 # int(11)
+
+
+class ProductImportError(Exception):
+    """Raised when the file as a whole cannot be imported (e.g. required columns are missing)."""
+
+
+def _normalize_header(name):
+    key = (name or '').strip().lower().replace(' ', '_')
+    return _COLUMN_ALIASES.get(key)
+
+
+class ProductImporter:
+    """
+    Validates product rows from a CSV file and upserts them into tbl_products in
+    chunks of `chunk_size` rows: one multi-row INSERT ... ON DUPLICATE KEY UPDATE and
+    one commit per chunk, so a 5,000-row file needs about ten round-trips instead of
+    5,000.
+
+    Every row is checked before it is written: required fields, number formats, the
+    store (must exist, and be one of `allowed_store_ids` when given) and the category
+    (must belong to the row's store). A products_id that already belongs to another
+    store, or a barcode already used by another product of the same store, is
+    rejected instead of overwriting that product. Existing products are only updated in
+    the columns the file has: a file without a stock column keeps every product's
+    stock. Rejected rows are reported with their
+    line number; the other rows are still imported. If a chunk fails in the database,
+    that chunk is rolled back and its rows are reported as errors.
+    """
+
+    def __init__(self, conn, store_id=None, allowed_store_ids=None, chunk_size=500, max_reported_errors=1000):
+        self.conn = conn
+        self.default_store_id = int(store_id) if store_id not in (None, '') else None
+        self.allowed_store_ids = {int(value) for value in allowed_store_ids} if allowed_store_ids is not None else None
+        self.chunk_size = chunk_size
+        self.max_reported_errors = max_reported_errors
+        self._stores = None
+        self._categories = {} # store_id -> set of category_id
+        self._seen_products = set()
+        self._seen_barcodes = set()
+        self._update_columns = () # Columns present in the file, set by run()
+        self.result = {
+            'rows': 0,
+            'inserted': 0,
+            'updated': 0,
+            'errors': [], # (line number, products_id, message), at most max_reported_errors
+            'error_count': 0,
+            'store_ids': set(),
+            'elapsed': 0.0,
+            'rows_per_second': 0.0,
+        }
+
+    def _error(self, line, products_id, message):
+        self.result['error_count'] += 1
+        if len(self.result['errors']) < self.max_reported_errors:
+            self.result['errors'].append((line, products_id, message))
+
+    def _store_exists(self, cursor, store_id):
+        if self._stores is None:
+            cursor.execute("SELECT store_id FROM tbl_stores")
+            self._stores = {int(row[0]) for row in cursor.fetchall()}
+        return store_id in self._stores
+
+    def _store_categories(self, cursor, store_id):
+        if store_id not in self._categories:
+            cursor.execute("SELECT category_id FROM tbl_category WHERE store_id = %s", (store_id,))
+            self._categories[store_id] = {int(row[0]) for row in cursor.fetchall()}
+        return self._categories[store_id]
+
+    def _parse(self, cursor, line, raw):
+        """Returns the row as a dict of tbl_products values, or None after reporting why it was rejected."""
+        products_id = (raw.get('products_id') or '').strip()
+        name = (raw.get('products_name') or '').strip()
+        if not products_id.isdigit() or len(products_id) > 255:
+            self._error(line, products_id, "รหัสสินค้าต้องเป็นตัวเลขเท่านั้น")
+            return None
+        if not name or len(name) > 255:
+            self._error(line, products_id, "ชื่อสินค้าต้องไม่ว่างและยาวไม่เกิน 255 ตัวอักษร")
+            return None
+        try:
+            price = Decimal((raw.get('price') or '').strip()).quantize(Decimal('0.01')) # Blank is invalid, not 0.00
+            if not Decimal(0) <= price <= MAX_PRICE:
+                raise InvalidOperation
+        except InvalidOperation:
+            self._error(line, products_id, f"ราคาไม่ถูกต้อง: {raw.get('price')!r}")
+            return None
+        try:
+            stock = int((raw.get('stock') or '0').strip())
+            if not 0 <= stock <= MAX_STOCK:
+                raise ValueError
+        except ValueError:
+            self._error(line, products_id, f"สต็อกไม่ถูกต้อง: {raw.get('stock')!r}")
+            return None
+
+        store_value = (raw.get('store_id') or '').strip()
+        if store_value:
+            if not store_value.isdigit():
+                self._error(line, products_id, f"รหัสร้านค้าไม่ถูกต้อง: {store_value!r}")
+                return None
+            store_id = int(store_value)
+        else:
+            store_id = self.default_store_id
+        if store_id is None:
+            self._error(line, products_id, "ไม่ได้ระบุร้านค้า")
+            return None
+        if self.allowed_store_ids is not None and store_id not in self.allowed_store_ids:
+            self._error(line, products_id, f"ไม่มีสิทธิ์นำเข้าสินค้าของร้านค้า {store_id}")
+            return None
+        if not self._store_exists(cursor, store_id):
+            self._error(line, products_id, f"ไม่พบร้านค้า {store_id}")
+            return None
+
+        category_value = (raw.get('category_id') or '').strip()
+        category_id = None
+        if category_value:
+            if not category_value.lstrip('-').isdigit() or int(category_value) not in self._store_categories(cursor, store_id):
+                self._error(line, products_id, f"ไม่พบหมวดหมู่ {category_value} ในร้านค้า {store_id}")
+                return None
+            category_id = int(category_value)
+
+        barcode_id = (raw.get('barcode_id') or '').strip() or None
+        if barcode_id and len(barcode_id) > 255:
+            self._error(line, products_id, "บาร์โค้ดยาวเกิน 255 ตัวอักษร")
+            return None
+
+        # Duplicates inside the file: the first occurrence wins, later ones are reported
+        if products_id in self._seen_products:
+            self._error(line, products_id, "รหัสสินค้าซ้ำกับแถวก่อนหน้าในไฟล์")
+            return None
+        if barcode_id and (barcode_id, store_id) in self._seen_barcodes:
+            self._error(line, products_id, f"บาร์โค้ด {barcode_id} ซ้ำกับแถวก่อนหน้าในไฟล์")
+            return None
+        self._seen_products.add(products_id)
+        if barcode_id:
+            self._seen_barcodes.add((barcode_id, store_id))
+
+        return {
+            'products_id': products_id,
+            'products_name': name,
+            'price': price,
+            'stock': stock,
+            'category_id': category_id,
+            'barcode_id': barcode_id,
+            'store_id': store_id,
+            'description': (raw.get('description') or '').strip() or None,
+        }
+
+    def _flush(self, cursor, chunk):
+        """Writes one chunk of (line, row) pairs after checking it against existing products."""
+        if not chunk:
+            return
+        try:
+            ids = [row['products_id'] for _, row in chunk]
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"SELECT products_id, store_id FROM tbl_products WHERE products_id IN ({placeholders})", tuple(ids))
+            existing = {products_id: store_id for products_id, store_id in cursor.fetchall()}
+
+            barcodes = [row['barcode_id'] for _, row in chunk if row['barcode_id']]
+            barcode_owners = {}
+            if barcodes:
+                placeholders = ', '.join(['%s'] * len(barcodes))
+                cursor.execute(f"SELECT barcode_id, store_id, products_id FROM tbl_products WHERE barcode_id IN ({placeholders})", tuple(barcodes))
+                barcode_owners = {(barcode_id, store_id): products_id for barcode_id, store_id, products_id in cursor.fetchall()}
+
+            accepted = []
+            for line, row in chunk:
+                owner_store = existing.get(row['products_id'])
+                if row['products_id'] in existing and owner_store != row['store_id']:
+                    self._error(line, row['products_id'], f"รหัสสินค้านี้เป็นของร้านค้า {owner_store}")
+                    continue
+                owner = barcode_owners.get((row['barcode_id'], row['store_id']))
+                if row['barcode_id'] and owner is not None and owner != row['products_id']:
+                    self._error(line, row['products_id'], f"บาร์โค้ด {row['barcode_id']} เป็นของสินค้า {owner}")
+                    continue
+                accepted.append(row)
+            if not accepted:
+                return
+
+            values_sql = ', '.join(['(' + ', '.join(['%s'] * len(UPSERT_COLUMNS)) + ')'] * len(accepted))
+            params = [row[column] for row in accepted for column in UPSERT_COLUMNS]
+            # New products get defaults for the columns the file lacks; existing ones keep theirs
+            updates = ', '.join(f"{column} = VALUES({column})" for column in self._update_columns)
+            cursor.execute(f"""
+                INSERT INTO tbl_products ({', '.join(UPSERT_COLUMNS)}) VALUES {values_sql}
+                ON DUPLICATE KEY UPDATE {updates}
+            """, tuple(params))
+            self.conn.commit()
+        except mysql.connector.Error as err:
+            self.conn.rollback()
+            for line, row in chunk:
+                self._error(line, row['products_id'], f"บันทึกไม่สำเร็จ: {err}")
+            return
+
+        updated = sum(1 for row in accepted if row['products_id'] in existing)
+        self.result['updated'] += updated
+        self.result['inserted'] += len(accepted) - updated
+        self.result['store_ids'].update(row['store_id'] for row in accepted)
+
+    def run(self, lines):
+        """
+        Imports products from `lines` (a text file object or any iterable of CSV lines,
+        read as a stream) and returns the result dict: rows read, inserted, updated,
+        errors, store_ids touched, elapsed seconds and rows_per_second.
+        """
+        started = time.perf_counter()
+        reader = csv.DictReader(lines)
+        if not reader.fieldnames:
+            raise ProductImportError("ไฟล์ CSV ว่างเปล่า")
+        mapping = {name: _normalize_header(name) for name in reader.fieldnames}
+        missing = [column for column in REQUIRED_COLUMNS if column not in mapping.values()]
+        if missing:
+            raise ProductImportError(f"ไฟล์ CSV ไม่มีคอลัมน์ที่จำเป็น: {', '.join(missing)}")
+        self._update_columns = tuple(column for column in UPSERT_COLUMNS
+                                     if column in mapping.values() and column not in _FIXED_COLUMNS)
+
+        cursor = self.conn.cursor()
+        try:
+            chunk = []
+            for record in reader:
+                self.result['rows'] += 1
+                raw = {mapping[name]: value for name, value in record.items() if mapping.get(name)}
+                row = self._parse(cursor, reader.line_num, raw)
+                if row:
+                    chunk.append((reader.line_num, row))
+                if len(chunk) >= self.chunk_size:
+                    self._flush(cursor, chunk)
+                    chunk = []
+            self._flush(cursor, chunk)
+        finally:
+            cursor.close()
+
+        self.result['errors'].sort(key=lambda error: error[0]) # Database-side rejections are found per chunk
+        self.result['elapsed'] = time.perf_counter() - started
+        self.result['rows_per_second'] = self.result['rows'] / self.result['elapsed'] if self.result['elapsed'] else 0.0
+        return self.result
@@ -46,6 +46,25 @@ INSERT INTO `tbl_bin` (`category_id`, `id`, `value`) VALUES
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `tbl_bin_levels`
+--
+
+CREATE TABLE `tbl_bin_levels` (
+  `store_id` int(11) NOT NULL,
+  `kiosk_id` varchar(64) NOT NULL,
+  `category_id` int(11) NOT NULL,
+  `fill_count` int(11) NOT NULL DEFAULT 0,
+  `total_count` bigint(20) NOT NULL DEFAULT 0,
+  `capacity` int(11) NOT NULL DEFAULT 200,
+  `collect_at` int(11) NOT NULL DEFAULT 160,
+  `needs_collection` tinyint(1) GENERATED ALWAYS AS (`fill_count` >= `collect_at`) STORED,
+  `last_emptied_at` datetime DEFAULT NULL,
+  `updated_at` datetime NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp()
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `tbl_category`
 --
@@ -72,6 +91,64 @@ INSERT INTO `tbl_category` (`id`, `category_id`, `category_name`, `store_id`) VA
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `tbl_disposal_events`
+--
+
+CREATE TABLE `tbl_disposal_events` (
+  `id` bigint(20) UNSIGNED NOT NULL,
+  `order_row_id` int(11) NOT NULL,
+  `barcode_id` varchar(255) DEFAULT NULL,
+  `products_id` varchar(255) DEFAULT NULL,
+  `category_id` int(11) DEFAULT NULL,
+  `store_id` int(11) DEFAULT NULL,
+  `kiosk_id` varchar(64) NOT NULL DEFAULT 'web',
+  `quantity` int(11) NOT NULL,
+  `source` varchar(16) NOT NULL DEFAULT 'scan',
+  `compacted` tinyint(1) NOT NULL DEFAULT 0,
+  `created_at` datetime(3) NOT NULL DEFAULT current_timestamp(3)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `tbl_export_jobs`
+--
+
+CREATE TABLE `tbl_export_jobs` (
+  `id` int(11) NOT NULL,
+  `job_type` varchar(50) NOT NULL,
+  `status` enum('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+  `requested_by` int(11) DEFAULT NULL,
+  `store_id` int(11) DEFAULT NULL,
+  `runner_id` varchar(64) DEFAULT NULL,
+  `row_count` int(11) NOT NULL DEFAULT 0,
+  `file_path` varchar(512) DEFAULT NULL,
+  `error` text DEFAULT NULL,
+  `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  `started_at` timestamp NULL DEFAULT NULL,
+  `finished_at` timestamp NULL DEFAULT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `tbl_kiosk_scans`
+--
+
+CREATE TABLE `tbl_kiosk_scans` (
+  `store_id` int(11) NOT NULL,
+  `scan_key` varchar(64) NOT NULL,
+  `kiosk_id` varchar(64) NOT NULL,
+  `barcode_id` varchar(255) NOT NULL,
+  `status` varchar(16) NOT NULL DEFAULT 'applied',
+  `applied_total` int(11) NOT NULL DEFAULT 0,
+  `result` text DEFAULT NULL,
+  `created_at` datetime NOT NULL DEFAULT current_timestamp()
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `tbl_order`
 --
@@ -92,6 +169,58 @@ CREATE TABLE `tbl_order` (
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `tbl_payout_balances`
+--
+
+CREATE TABLE `tbl_payout_balances` (
+  `store_id` int(11) NOT NULL,
+  `kiosk_id` varchar(64) NOT NULL,
+  `slot` tinyint(3) UNSIGNED NOT NULL DEFAULT 0,
+  `packages` bigint(20) NOT NULL DEFAULT 0,
+  `credited` decimal(14,2) NOT NULL DEFAULT 0.00,
+  `settled` decimal(14,2) NOT NULL DEFAULT 0.00
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `tbl_payout_batches`
+--
+
+CREATE TABLE `tbl_payout_batches` (
+  `id` int(11) NOT NULL,
+  `store_id` int(11) NOT NULL,
+  `kiosk_id` varchar(64) NOT NULL,
+  `entry_count` int(11) NOT NULL DEFAULT 0,
+  `packages` int(11) NOT NULL DEFAULT 0,
+  `amount` decimal(12,2) NOT NULL DEFAULT 0.00,
+  `counted_amount` decimal(12,2) DEFAULT NULL,
+  `settled_by` varchar(255) DEFAULT NULL,
+  `created_at` datetime NOT NULL DEFAULT current_timestamp()
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `tbl_payout_ledger`
+--
+
+CREATE TABLE `tbl_payout_ledger` (
+  `id` bigint(20) UNSIGNED NOT NULL,
+  `store_id` int(11) NOT NULL,
+  `kiosk_id` varchar(64) NOT NULL DEFAULT 'web',
+  `entry_type` varchar(16) NOT NULL,
+  `barcode_id` varchar(255) DEFAULT NULL,
+  `order_row_id` int(11) DEFAULT NULL,
+  `packages` int(11) NOT NULL DEFAULT 0,
+  `amount` decimal(12,2) NOT NULL,
+  `batch_id` int(11) DEFAULT NULL,
+  `created_at` datetime(3) NOT NULL DEFAULT current_timestamp(3)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `tbl_products`
 --
@@ -121,6 +250,45 @@ INSERT INTO `tbl_products` (`id`, `products_id`, `products_name`, `price`, `stoc
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `tbl_sequences`
+--
+
+CREATE TABLE `tbl_sequences` (
+  `seq_name` varchar(64) NOT NULL,
+  `next_value` bigint(20) UNSIGNED NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+--
+-- Dumping data for table `tbl_sequences`
+--
+
+INSERT INTO `tbl_sequences` (`seq_name`, `next_value`) VALUES
+('order_barcode', 1000000000000);
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `tbl_stat_counters`
+--
+
+CREATE TABLE `tbl_stat_counters` (
+  `stat_name` varchar(64) NOT NULL,
+  `slot` tinyint(3) UNSIGNED NOT NULL DEFAULT 0,
+  `value` bigint(20) NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+--
+-- Dumping data for table `tbl_stat_counters`
+--
+
+INSERT INTO `tbl_stat_counters` (`stat_name`, `slot`, `value`) VALUES
+('total_disquantity', 0, 0),
+('total_quantity', 0, 0),
+('total_users', 0, 8);
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `tbl_stores`
 --
@@ -143,6 +311,20 @@ INSERT INTO `tbl_stores` (`store_id`, `store_name`, `location`, `contact_email`,
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `tbl_user_stats`
+--
+
+CREATE TABLE `tbl_user_stats` (
+  `email` varchar(255) NOT NULL,
+  `order_count` int(11) NOT NULL DEFAULT 0,
+  `total_quantity` bigint(20) NOT NULL DEFAULT 0,
+  `total_disquantity` bigint(20) NOT NULL DEFAULT 0,
+  `recycling_rate` int(11) GENERATED ALWAYS AS (CASE WHEN `total_quantity` > 0 THEN FLOOR(100 * `total_disquantity` / `total_quantity`) ELSE 0 END) VIRTUAL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `tbl_users`
 --
@@ -183,6 +365,13 @@ ALTER TABLE `tbl_bin`
   ADD PRIMARY KEY (`id`),
   ADD UNIQUE KEY `category_id` (`category_id`);
 
+--
+-- Indexes for table `tbl_bin_levels`
+--
+ALTER TABLE `tbl_bin_levels`
+  ADD PRIMARY KEY (`store_id`,`kiosk_id`,`category_id`),
+  ADD KEY `idx_bin_collection` (`needs_collection`,`store_id`);
+
 --
 -- Indexes for table `tbl_category`
 --
@@ -190,12 +379,59 @@ ALTER TABLE `tbl_category`
   ADD PRIMARY KEY (`id`),
   ADD UNIQUE KEY `category_id` (`category_id`);
 
+--
+-- Indexes for table `tbl_disposal_events`
+--
+ALTER TABLE `tbl_disposal_events`
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `idx_disposal_pending` (`compacted`,`order_row_id`),
+  ADD KEY `idx_disposal_store_time` (`store_id`,`created_at`);
+
+--
+-- Indexes for table `tbl_export_jobs`
+--
+ALTER TABLE `tbl_export_jobs`
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `idx_export_jobs_user` (`requested_by`,`status`);
+
+--
+-- Indexes for table `tbl_kiosk_scans`
+--
+ALTER TABLE `tbl_kiosk_scans`
+  ADD PRIMARY KEY (`store_id`,`scan_key`),
+  ADD KEY `idx_kiosk_scans_barcode` (`barcode_id`);
+
 --
 -- Indexes for table `tbl_order`
 --
 ALTER TABLE `tbl_order`
   ADD PRIMARY KEY (`id`),
-  ADD UNIQUE KEY `order_id` (`order_id`,`products_id`,`email`,`store_id`);
+  ADD UNIQUE KEY `order_id` (`order_id`,`products_id`,`email`,`store_id`),
+  ADD KEY `idx_order_barcode` (`barcode_id`,`products_id`,`store_id`),
+  ADD KEY `idx_order_email` (`email`),
+  ADD KEY `idx_order_store_order` (`store_id`,`order_id`);
+
+--
+-- Indexes for table `tbl_payout_balances`
+--
+ALTER TABLE `tbl_payout_balances`
+  ADD PRIMARY KEY (`store_id`,`kiosk_id`,`slot`);
+
+--
+-- Indexes for table `tbl_payout_batches`
+--
+ALTER TABLE `tbl_payout_batches`
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `idx_payout_batches_kiosk` (`store_id`,`kiosk_id`);
+
+--
+-- Indexes for table `tbl_payout_ledger`
+--
+ALTER TABLE `tbl_payout_ledger`
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `idx_payout_unsettled` (`store_id`,`kiosk_id`,`entry_type`,`batch_id`),
+  ADD KEY `idx_payout_batch` (`batch_id`),
+  ADD KEY `idx_payout_barcode` (`store_id`,`barcode_id`);
 
 --
 -- Indexes for table `tbl_products`
@@ -203,13 +439,33 @@ ALTER TABLE `tbl_order`
 ALTER TABLE `tbl_products`
   ADD PRIMARY KEY (`id`),
   ADD UNIQUE KEY `products_id` (`products_id`),
-  ADD UNIQUE KEY `barcode_id` (`barcode_id`,`store_id`);
+  ADD UNIQUE KEY `barcode_id` (`barcode_id`,`store_id`),
+  ADD KEY `idx_products_category` (`category_id`);
+
+--
+-- Indexes for table `tbl_sequences`
+--
+ALTER TABLE `tbl_sequences`
+  ADD PRIMARY KEY (`seq_name`);
+
+--
+-- Indexes for table `tbl_stat_counters`
+--
+ALTER TABLE `tbl_stat_counters`
+  ADD PRIMARY KEY (`stat_name`,`slot`);
 
 --
 -- Indexes for table `tbl_stores`
 --
 ALTER TABLE `tbl_stores`
-  ADD PRIMARY KEY (`store_id`);
+  ADD PRIMARY KEY (`store_id`),
+  ADD KEY `idx_stores_moderator` (`moderator_user_id`);
+
+--
+-- Indexes for table `tbl_user_stats`
+--
+ALTER TABLE `tbl_user_stats`
+  ADD PRIMARY KEY (`email`);
 
 --
 -- Indexes for table `tbl_users`
@@ -228,12 +484,36 @@ ALTER TABLE `tbl_users`
 ALTER TABLE `tbl_category`
   MODIFY `id` int(11) NOT NULL AUTO_INCREMENT, AUTO_INCREMENT=13;
 
+--
+-- AUTO_INCREMENT for table `tbl_disposal_events`
+--
+ALTER TABLE `tbl_disposal_events`
+  MODIFY `id` bigint(20) UNSIGNED NOT NULL AUTO_INCREMENT;
+
+--
+-- AUTO_INCREMENT for table `tbl_export_jobs`
+--
+ALTER TABLE `tbl_export_jobs`
+  MODIFY `id` int(11) NOT NULL AUTO_INCREMENT;
+
 --
 -- AUTO_INCREMENT for table `tbl_order`
 --
 ALTER TABLE `tbl_order`
   MODIFY `id` int(11) NOT NULL AUTO_INCREMENT, AUTO_INCREMENT=4;
 
+--
+-- AUTO_INCREMENT for table `tbl_payout_batches`
+--
+ALTER TABLE `tbl_payout_batches`
+  MODIFY `id` int(11) NOT NULL AUTO_INCREMENT;
+
+--
+-- AUTO_INCREMENT for table `tbl_payout_ledger`
+--
+ALTER TABLE `tbl_payout_ledger`
+  MODIFY `id` bigint(20) UNSIGNED NOT NULL AUTO_INCREMENT;
+
 --
 -- AUTO_INCREMENT for table `tbl_products`
 --
@@ -0,0 +1,162 @@
+# Receipt Renderer
+# Project Bin - สร้างใบเสร็จเป็นภาพขาวดำกว้าง 384px สำหรับเครื่องพิมพ์ความร้อน 58mm (PNG / ESC-POS)
+
+import os
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+from barcodes import code128_width, draw_code128
+
+# Thai-capable fonts commonly installed on Debian / Raspberry Pi OS (fonts-tlwg, fonts-noto)
+DEFAULT_FONT_PATHS = (
+    '/usr/share/fonts/truetype/tlwg/Garuda.ttf',
+    '/usr/share/fonts/truetype/tlwg/Loma.ttf',
+    '/usr/share/fonts/truetype/noto/NotoSansThai-Regular.ttf',
+    '/usr/share/fonts/opentype/noto/NotoSansThai-Regular.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+ESC_POS_BAND_HEIGHT = 256 # rows per GS v 0 command; some printers reject taller bands
+
+
+def find_font(paths=DEFAULT_FONT_PATHS):
+    """Returns the first existing font file in `paths`, or None (PIL's built-in font is used)."""
+    for path in paths:
+        if path and os.path.exists(path):
+            return path
+    return None
+
+
+@lru_cache(maxsize=16)
+def _load_font(path, size):
+    if path:
+        return ImageFont.truetype(path, size)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError: # Pillow < 10.1: fixed-size bitmap font only
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=4096)
+def _text_image(path, size, text):
+    """
+    Renders one line of text to a 1-bit image. Cached: product names, labels and
+    digits repeat from receipt to receipt, so most lines are drawn only once.
+    """
+    font = _load_font(path, size)
+    ascent, descent = font.getmetrics()
+    width = max(1, int(font.getlength(text)) + 1)
+    image = Image.new('1', (width, ascent + descent), 1)
+    ImageDraw.Draw(image).text((0, 0), text, font=font, fill=0)
+    return image
+
+
+class ReceiptRenderer:
+    """
+    Draws receipts (the dict kept in the receipt store) as 1-bit images sized for a
+    58mm thermal printer: `width` dots per line (384 at 203 dpi). The order barcode
+    is drawn natively as Code 128.
+    """
+
+    def __init__(self, width=384, font_path=None, font_size=22, margin=8):
+        self.width = width
+        self.font_path = font_path or find_font()
+        self.font_size = font_size
+        self.margin = margin
+
+    def _text(self, text, size=None):
+        return _text_image(self.font_path, size or self.font_size, text)
+
+    def _fit(self, text, max_width, size=None):
+        # Shorten long product names so the amount column stays aligned
+        if self._text(text, size).width <= max_width:
+            return self._text(text, size)
+        while len(text) > 1 and self._text(text + '…', size).width > max_width:
+            text = text[:-1]
+        return self._text(text + '…', size)
+
+    def render(self, receipt):
+        """Returns the receipt as a PIL image in mode '1' (black on white)."""
+        content_width = self.width - 2 * self.margin
+        blocks = [] # (kind, payload, height)
+
+        def line(left, right=None, size=None, align='left'):
+            right_image = self._text(right, size) if right else None
+            room = content_width - (right_image.width + 8 if right_image else 0)
+            left_image = self._fit(left, room, size)
+            blocks.append(('line', (left_image, right_image, align), max(left_image.height, right_image.height if right_image else 0)))
+
+        barcode_id = str(receipt.get('barcode_id') or '')
+        module_width = 2 if code128_width(barcode_id, 2) <= content_width else 1
+        if barcode_id:
+            blocks.append(('barcode', (barcode_id, module_width), 80))
+            line(barcode_id, size=self.font_size - 4, align='center')
+        blocks.append(('space', None, 6))
+        line(f"รหัสคำสั่งซื้อ: {receipt.get('current_order_id', '')}", size=self.font_size - 2)
+        line('รายการสินค้า', size=self.font_size + 4)
+        blocks.append(('rule', None, 9))
+
+        for item in receipt.get('orders', []):
+            quantity = int(item.get('quantity') or 0)
+            price = float(item.get('price') or 0.0)
+            line(f"{quantity} {item.get('products_name', '')}", f"฿{quantity * price:.2f}")
+            if quantity > 1:
+                line(f"    @{price:.2f}", size=self.font_size - 4)
+
+        blocks.append(('rule', None, 9))
+        line(f"Total ({receipt.get('total_quantity', 0)})", f"{float(receipt.get('total_price') or 0.0):.2f} บ.", size=self.font_size + 4)
+        blocks.append(('space', None, 24)) # Paper feed before the tear bar
+
+        height = sum(block[2] for block in blocks) + 2 * self.margin
+        image = Image.new('1', (self.width, height), 1)
+        draw = ImageDraw.Draw(image)
+        y = self.margin
+        for kind, payload, block_height in blocks:
+            if kind == 'line':
+                left_image, right_image, align = payload
+                x = self.margin + (content_width - left_image.width) // 2 if align == 'center' else self.margin
+                image.paste(left_image, (x, y))
+                if right_image:
+                    image.paste(right_image, (self.width - self.margin - right_image.width, y))
+            elif kind == 'barcode':
+                data, module = payload
+                x = self.margin + (content_width - code128_width(data, module)) // 2
+                draw_code128(draw, data, x, y, block_height - 8, module_width=module)
+            elif kind == 'rule':
+                draw.line([(self.margin, y + block_height // 2), (self.width - self.margin, y + block_height // 2)], fill=0, width=2)
+            y += block_height
+        return image
+
+    def render_png(self, receipt):
+        """Returns the receipt as PNG bytes (1-bit, a few KB)."""
+        buffer = BytesIO()
+        self.render(receipt).save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue()
+
+    def render_escpos(self, receipt, cut=True):
+        """Returns ESC/POS bytes: init, the image as GS v 0 raster bands, feed and (optionally) cut."""
+        return to_escpos_raster(self.render(receipt), cut=cut)
+
+
+def to_escpos_raster(image, cut=True):
+    """Converts a 1-bit PIL image to ESC/POS raster commands (GS v 0)."""
+    image = image.convert('1')
+    width_bytes = (image.width + 7) // 8
+    if image.width % 8:
+        padded = Image.new('1', (width_bytes * 8, image.height), 1)
+        padded.paste(image, (0, 0))
+        image = padded
+    # PIL packs white as 1; the printer prints 1 bits, so invert
+    raster = bytes(byte ^ 0xFF for byte in image.tobytes())
+
+    output = bytearray(b'\x1b@') # ESC @: initialize
+    for top in range(0, image.height, ESC_POS_BAND_HEIGHT):
+        rows = min(ESC_POS_BAND_HEIGHT, image.height - top)
+        output += b'\x1dv0\x00' + bytes((width_bytes & 0xFF, width_bytes >> 8, rows & 0xFF, rows >> 8))
+        output += raster[top * width_bytes:(top + rows) * width_bytes]
+    output += b'\x1bd\x03' # ESC d 3: feed three lines
+    if cut:
+        output += b'\x1dV\x42\x00' # GS V 66 0: partial cut after feeding
+    return bytes(output)
@@ -0,0 +1,89 @@
+# Receipt Store
+# Project Bin - ที่เก็บข้อมูลใบเสร็จฝั่งเซิร์ฟเวอร์ (SQLite) แทนการเก็บใน cookie session
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ReceiptStore:
+    """
+    Keeps completed-order receipts on the server, in a local SQLite file.
+
+    put() stores a receipt under its order barcode and returns a short random token;
+    only the token goes into the (cookie) session. Receipts expire after `ttl`
+    seconds; expired rows are purged at most once per `purge_interval` seconds
+    during writes. Values are stored as JSON: Decimal and datetime fields come back
+    as strings.
+    """
+
+    def __init__(self, path, ttl=86400, purge_interval=300):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS receipts (
+                    token TEXT PRIMARY KEY,
+                    barcode_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_receipts_barcode ON receipts (barcode_id)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_receipts_expires ON receipts (expires_at)")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call: sqlite3 connections cannot be shared across threads
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db: # Commits on success, rolls back on error
+                yield db
+        finally:
+            db.close()
+
+    def put(self, barcode_id, receipt):
+        """Stores `receipt` (a JSON-serializable dict) for order `barcode_id` and returns its token."""
+        token = secrets.token_urlsafe(12)
+        payload = json.dumps(receipt, default=str, ensure_ascii=False, separators=(',', ':'))
+        now = time.time()
+        with self._connect() as db:
+            # A barcode has at most one receipt: completing the same order again replaces it
+            db.execute("DELETE FROM receipts WHERE barcode_id = ?", (str(barcode_id),))
+            db.execute("INSERT INTO receipts (token, barcode_id, payload, expires_at) VALUES (?, ?, ?, ?)",
+                       (token, str(barcode_id), payload, now + self.ttl))
+            self._maybe_purge(db, now)
+        return token
+
+    def get(self, token):
+        """Returns the receipt stored under `token`, or None if it is unknown or expired."""
+        return self._load("SELECT payload FROM receipts WHERE token = ? AND expires_at > ?", token)
+
+    def get_by_barcode(self, barcode_id):
+        """Returns the receipt of order `barcode_id`, or None if it is unknown or expired."""
+        return self._load("SELECT payload FROM receipts WHERE barcode_id = ? AND expires_at > ?", str(barcode_id))
+
+    def _load(self, query, key):
+        if not key:
+            return None
+        with self._connect() as db:
+            row = db.execute(query, (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _maybe_purge(self, db, now):
+        with self._lock:
+            if now - self._last_purge < self.purge_interval:
+                return
+            self._last_purge = now
+        db.execute("DELETE FROM receipts WHERE expires_at <= ?", (now,))
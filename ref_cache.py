@@ -0,0 +1,105 @@
+# Reference Data Cache
+# Project Bin - แคชข้อมูลอ้างอิง (ร้านค้า หมวดหมู่ สินค้า ผู้ใช้) สำหรับ dropdown ในหน้าจัดการข้อมูล
+
+import threading
+import time
+
+ALL_STORES = '*' # Scope of entries that cover every store (admin views)
+
+
+def _scope(store_id):
+    # store_id arrives as int from the session and as str from forms
+    return ALL_STORES if store_id in (None, ALL_STORES) else str(store_id)
+
+
+class ReferenceCache:
+    """
+    In-process cache for the small lists that fill dropdowns (stores, categories,
+    products, users).
+
+    Entries are grouped by namespace (e.g. 'products') and scope (a store_id or
+    ALL_STORES) and further keyed by anything the caller varies on (role, sort order).
+    Every (namespace, scope) pair has a version number; invalidate() bumps it, so
+    entries loaded under an older version are never served again. A value is stored
+    with the version read *before* it was loaded, which means a write committed while
+    the loader was running still invalidates it.
+
+    Invalidation only reaches the current process; `ttl` bounds how long another
+    worker process can serve a list that changed elsewhere.
+    """
+
+    def __init__(self, ttl=60, max_entries=2048):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {} # (namespace, scope, key) -> (version, expires_at, rows)
+        self._versions = {} # (namespace, scope) -> int
+        self._generations = {} # namespace -> int, bumped by namespace-wide invalidations
+        self._lock = threading.Lock()
+        self._counters = {} # namespace -> {'hits': n, 'misses': n, 'invalidations': n}
+
+    def _count(self, namespace, counter):
+        counters = self._counters.setdefault(namespace, {'hits': 0, 'misses': 0, 'invalidations': 0})
+        counters[counter] += 1
+
+    def _version(self, namespace, scope):
+        # An entry for one store also depends on namespace-wide invalidations
+        return (self._generations.get(namespace, 0), self._versions.get((namespace, scope), 0))
+
+    def get(self, namespace, scope, key, loader):
+        """
+        Returns the rows cached under (namespace, scope, key), calling loader() on a miss.
+        loader must return a list of dict rows; callers receive shallow copies so they
+        can modify the rows freely.
+        """
+        scope = _scope(scope)
+        cache_key = (namespace, scope, key)
+        now = time.monotonic()
+        with self._lock:
+            version = self._version(namespace, scope)
+            entry = self._entries.get(cache_key)
+            if entry and entry[0] == version and entry[1] > now:
+                self._count(namespace, 'hits')
+                return [dict(row) for row in entry[2]]
+            self._count(namespace, 'misses')
+
+        rows = tuple(dict(row) for row in loader())
+
+        with self._lock:
+            if len(self._entries) >= self.max_entries and cache_key not in self._entries:
+                self._evict(now)
+            self._entries[cache_key] = (version, now + self.ttl, rows)
+        return [dict(row) for row in rows]
+
+    def _evict(self, now):
+        # Drop expired/outdated entries first; if that frees nothing, drop the oldest half
+        stale = [key for key, (version, expires_at, _) in self._entries.items()
+                 if expires_at <= now or version != self._version(key[0], key[1])]
+        for key in stale:
+            del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            by_expiry = sorted(self._entries, key=lambda key: self._entries[key][1])
+            for key in by_expiry[:len(by_expiry) // 2]:
+                del self._entries[key]
+
+    def invalidate(self, namespace, store_id=None):
+        """
+        Marks cached lists of `namespace` as outdated: those of one store (and the
+        all-store lists that include it), or every list when store_id is None.
+        """
+        with self._lock:
+            if store_id is None:
+                self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            else:
+                # Admin lists are cached under ALL_STORES and hold rows of every store
+                for scope in (_scope(store_id), ALL_STORES):
+                    self._versions[(namespace, scope)] = self._versions.get((namespace, scope), 0) + 1
+            self._count(namespace, 'invalidations')
+
+    def stats(self):
+        """Returns hit/miss/invalidation counters per namespace and the current entry count."""
+        with self._lock:
+            namespaces = {}
+            for namespace, counters in self._counters.items():
+                lookups = counters['hits'] + counters['misses']
+                namespaces[namespace] = dict(counters, hit_rate=counters['hits'] / lookups if lookups else 0.0)
+            return {'entries': len(self._entries), 'ttl': self.ttl, 'namespaces': namespaces}
@@ -0,0 +1,84 @@
+# Search Subsystem
+# Project Bin - ตัวสร้างเงื่อนไขค้นหาที่ใช้ร่วมกันในหน้าจัดการข้อมูล
+
+# Searchable columns per management page.
+#   key      - primary key of the page's main table, matched against the fulltext hits
+#   fulltext - subqueries returning matching keys as hit_id, each reading ONE table through its
+#              FULLTEXT index (see migrations/003); the %s is bound to the phrase query
+#   exact    - subqueries for ids and enums compared with '=' (plain index lookups)
+#   like     - columns used by the LIKE '%term%' fallback (the original behaviour)
+# MySQL cannot use a FULLTEXT index for a MATCH that is OR-ed with other predicates or
+# with a MATCH on another table, so in fulltext mode each predicate is its own indexed
+# subquery and their keys are UNIONed (see search_clause()).
+SEARCH_FIELDS = {
+    'orders': {
+        'key': 'o.id',
+        'fulltext': ["SELECT id AS hit_id FROM tbl_order WHERE MATCH(order_id, products_name, email) AGAINST (%s IN BOOLEAN MODE)"],
+        'exact': [],
+        'like': ['o.order_id', 'o.products_name', 'o.email'],
+    },
+    'products': {
+        'key': 'p.id',
+        'fulltext': [
+            "SELECT id AS hit_id FROM tbl_products WHERE MATCH(products_name, products_id) AGAINST (%s IN BOOLEAN MODE)",
+            "SELECT fp.id AS hit_id FROM tbl_category fc JOIN tbl_products fp ON fp.category_id = fc.category_id "
+            "WHERE MATCH(fc.category_name) AGAINST (%s IN BOOLEAN MODE)",
+        ],
+        'exact': [],
+        'like': ['p.products_name', 'p.products_id', 'c.category_name'],
+    },
+    'users': {
+        'key': 'u.id',
+        'fulltext': ["SELECT id AS hit_id FROM tbl_users WHERE MATCH(firstname, lastname, email) AGAINST (%s IN BOOLEAN MODE)"],
+        'exact': ["SELECT id AS hit_id FROM tbl_users WHERE role = %s"],
+        'like': ['u.firstname', 'u.lastname', 'u.email', 'u.role'],
+    },
+    'categories': {
+        'key': 'c.id',
+        'fulltext': ["SELECT id AS hit_id FROM tbl_category WHERE MATCH(category_name) AGAINST (%s IN BOOLEAN MODE)"],
+        'exact': ["SELECT id AS hit_id FROM tbl_category WHERE category_id = %s"],
+        'like': ['c.category_name', 'c.category_id'],
+    },
+    'stores': {
+        'key': 's.store_id',
+        'fulltext': [
+            "SELECT store_id AS hit_id FROM tbl_stores WHERE MATCH(store_name, address, phone) AGAINST (%s IN BOOLEAN MODE)",
+            "SELECT fs.store_id AS hit_id FROM tbl_users fu JOIN tbl_stores fs ON fs.moderator_user_id = fu.id "
+            "WHERE MATCH(fu.email) AGAINST (%s IN BOOLEAN MODE)",
+        ],
+        'exact': [],
+        'like': ['s.store_name', 's.address', 's.phone', 'u.email'],
+    },
+}
+
+# innodb_ft_min_token_size / ngram_token_size: shorter terms cannot use the index
+FULLTEXT_MIN_TERM_LENGTH = 2
+
+
+def _like_clause(fields, term):
+    pattern = '%' + term + '%'
+    return "(" + " OR ".join(f"{column} LIKE %s" for column in fields['like']) + ")", [pattern] * len(fields['like'])
+
+
+def search_clause(entity, term, backend='like'):
+    """
+    Builds the WHERE fragment for a search box on one management page.
+    Returns (sql, params); sql is wrapped in parentheses so it can be AND-ed with
+    other filters. backend='fulltext' matches the page's primary key against the UNION
+    of its indexed subqueries (MATCH ... AGAINST on the ngram FULLTEXT indexes, '=' on
+    ids) and falls back to LIKE for terms too short to be indexed.
+
+    The UNION is wrapped in a derived table so MySQL materializes it once and joins the
+    hits to the main table by primary key, instead of re-running it for every row.
+    """
+    fields = SEARCH_FIELDS[entity]
+    term = term.strip()
+    if backend != 'fulltext' or len(term) < FULLTEXT_MIN_TERM_LENGTH:
+        return _like_clause(fields, term)
+
+    # Phrase query: with the ngram parser this matches the term as a substring
+    phrase = '"' + term.replace('"', ' ') + '"'
+    subqueries = fields['fulltext'] + fields['exact']
+    params = [phrase] * len(fields['fulltext']) + [term] * len(fields['exact'])
+    hits = " UNION ".join(subqueries)
+    return f"({fields['key']} IN (SELECT hit_id FROM ({hits}) AS search_hits))", params
@@ -0,0 +1,87 @@
+# Persistent Sequences
+# Project Bin - ตัวนับลำดับที่เก็บในฐานข้อมูล (tbl_sequences)
+
+import threading
+
+import mysql.connector
+
+
+class SequenceAllocator:
+    """
+    Hands out values from named counters stored in tbl_sequences.
+
+    Each database round-trip atomically advances a counter by `block_size` using
+    UPDATE ... LAST_INSERT_ID(), so concurrent workers never receive the same value.
+    The reserved block is then served from memory until it runs out. Values lost
+    when a process exits with part of a block unused simply leave gaps.
+    """
+
+    def __init__(self, connection_factory):
+        # connection_factory() must return a DB-API connection (e.g. a pooled one) and
+        # raise mysql.connector.Error if none is available
+        self.connection_factory = connection_factory
+        self._blocks = {} # seq_name -> [next_value, end_value)
+        self._lock = threading.Lock()
+
+    def next_value(self, name, block_size=1, initial=1):
+        """
+        Returns the next value of sequence `name`.
+        `initial` is the first value of a sequence that does not exist yet; it may be a
+        callable taking a cursor, evaluated only when the sequence row is created.
+        """
+        with self._lock:
+            block = self._blocks.get(name)
+            if not block or block[0] >= block[1]:
+                block = list(self._reserve(name, block_size, initial))
+                self._blocks[name] = block
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def _reserve(self, name, block_size, initial):
+        conn = self.connection_factory()
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT next_value FROM tbl_sequences WHERE seq_name = %s", (name,))
+            if cursor.fetchone() is None:
+                first_value = initial(cursor) if callable(initial) else initial
+                # INSERT IGNORE: another worker may have created the row in the meantime
+                cursor.execute("INSERT IGNORE INTO tbl_sequences (seq_name, next_value) VALUES (%s, %s)", (name, first_value))
+
+            cursor.execute("UPDATE tbl_sequences SET next_value = LAST_INSERT_ID(next_value + %s) WHERE seq_name = %s", (block_size, name))
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            end_value = int(cursor.fetchone()[0])
+            conn.commit() # Release the row lock immediately
+            return end_value - block_size, end_value
+        except mysql.connector.Error:
+            conn.rollback()
+            raise
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
+
+    def advance_past(self, name, value):
+        """
+        Makes sure sequence `name` never reserves `value` or anything below it again
+        (used when a value was entered manually). Only this process's cached block for
+        `name` is dropped: other processes keep serving the blocks they reserved earlier,
+        which may include `value`, so callers that need unique values must still check
+        them where they are used (see next_order_id() in app.py).
+        """
+        with self._lock:
+            self._blocks.pop(name, None)
+        conn = self.connection_factory()
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE tbl_sequences SET next_value = GREATEST(next_value, %s) WHERE seq_name = %s", (value + 1, name))
+            conn.commit()
+        except mysql.connector.Error:
+            conn.rollback()
+            raise
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
@@ -0,0 +1,280 @@
+# Server-side Sessions
+# Project Bin - เก็บข้อมูล session ฝั่งเซิร์ฟเวอร์ (SQLite / Redis) cookie เก็บเพียงรหัส session
+
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+
+# Short names for the keys every logged-in session carries. Keys outside this table
+# are stored as-is; per-store keys are shortened by prefix (current_order_id_2 -> :oi.2).
+_KEY_ALIASES = {
+    'loggedin': 'l',
+    'id': 'i',
+    'email': 'e',
+    'firstname': 'f',
+    'lastname': 'n',
+    'role': 'r',
+    'store_id': 's',
+    'store_name': 'sn',
+    'receipt_token': 'rt',
+    '_flashes': 'fl',
+    '_permanent': 'p',
+}
+_KEY_NAMES = {alias: name for name, alias in _KEY_ALIASES.items()}
+_PREFIX_ALIASES = (('current_order_id_', 'oi'), ('current_order_barcode_', 'ob'))
+
+_SID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{32,64}$')
+
+
+def _encode_key(key):
+    if key in _KEY_ALIASES:
+        return ':' + _KEY_ALIASES[key]
+    for prefix, code in _PREFIX_ALIASES:
+        if key.startswith(prefix):
+            return f":{code}.{key[len(prefix):]}"
+    return ':' + key if key.startswith(':') else key # Escape keys that look like aliases
+
+
+def _decode_key(key):
+    if not key.startswith(':'):
+        return key
+    body = key[1:]
+    if body.startswith(':'):
+        return body
+    if body in _KEY_NAMES:
+        return _KEY_NAMES[body]
+    code, _, rest = body.partition('.')
+    for prefix, prefix_code in _PREFIX_ALIASES:
+        if code == prefix_code:
+            return prefix + rest
+    return body
+
+
+class SQLiteSessionBackend:
+    """
+    Session records in a local SQLite file, exposing the subset of the Redis API the
+    session interface needs (get / setex / delete), so a redis.Redis client can be
+    used in its place. Expired rows are purged at most once per `purge_interval`.
+    """
+
+    def __init__(self, path, purge_interval=300):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call: sqlite3 connections cannot be shared across threads
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db: # Commits on success, rolls back on error
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key):
+        with self._connect() as db:
+            row = db.execute("SELECT value FROM sessions WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def setex(self, key, seconds, value):
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO sessions (key, value, expires_at) VALUES (?, ?, ?)", (key, value, now + seconds))
+            with self._lock:
+                purge = now - self._last_purge >= self.purge_interval
+                if purge:
+                    self._last_purge = now
+            if purge:
+                db.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def delete(self, key):
+        with self._connect() as db:
+            db.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+
+class ServerSideSession(SessionMixin, MutableMapping):
+    """
+    Session whose data lives in a backend. The record is loaded lazily, on the first
+    access, so requests that never look at the session never touch the backend.
+    """
+
+    def __init__(self, sid, loader=None):
+        self.sid = sid
+        self._loader = loader
+        self._data = None if loader else {}
+        self.new = loader is None
+        self.modified = False
+        self.accessed = False
+        self.written_at = None # When the stored record was last written (set by the loader)
+        self.replaced_sid = None # Id given up by regenerate(), its record is deleted on save
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def _items(self):
+        self.accessed = True
+        if self._data is None:
+            self._data, self.written_at = self._loader()
+            self._loader = None
+            if self.written_at is None:
+                # Unknown or expired id: never adopt an id chosen by the client
+                self.sid = secrets.token_urlsafe(32)
+                self.new = True
+        return self._data
+
+    def __getitem__(self, key):
+        return self._items()[key]
+
+    def __setitem__(self, key, value):
+        self._items()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._items()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._items())
+
+    def __len__(self):
+        return len(self._items())
+
+    def clear(self):
+        self._data = {}
+        self._loader = None
+        self.accessed = True
+        self.modified = True
+
+    def regenerate(self):
+        """
+        Moves the session data to a new random id (call on login and logout, against
+        session fixation). The record stored under the old id is deleted when saved.
+        """
+        self._items()
+        if not self.new:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface that keeps session data in `backend` (anything with the
+    Redis-style get / setex / delete methods) and sends only a random session id in
+    the cookie. Records expire `ttl` seconds after their last write; sessions that are
+    only read are rewritten once a quarter of the ttl has passed, to keep them alive.
+
+    stats() compares the size of the cookie actually sent with the signed cookie the
+    default Flask session would have sent for the same data.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, backend, ttl=604800, key_prefix='session:'):
+        self.backend = backend
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self._cookie_interface = SecureCookieSessionInterface()
+        self._lock = threading.Lock()
+        self._metrics = {
+            'loads': 0,
+            'writes': 0,
+            'deletes': 0,
+            'cookies_sent': 0,
+            'cookie_bytes': 0,
+            'cookie_session_bytes': 0,
+        }
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._metrics[name] += delta
+
+    def _load(self, sid):
+        self._count(loads=1)
+        raw = self.backend.get(self.key_prefix + sid)
+        if raw is None:
+            return {}, None
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        record = self.serializer.loads(raw)
+        return {_decode_key(key): value for key, value in record['d'].items()}, record['t']
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SID_PATTERN.match(sid):
+            return ServerSideSession(sid, loader=lambda: self._load(sid))
+        return ServerSideSession(secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session.loaded:
+            return # Never accessed during this request
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.replaced_sid:
+            self.backend.delete(self.key_prefix + session.replaced_sid)
+            self._count(deletes=1)
+
+        if not session:
+            if session.modified and (not session.new or session.replaced_sid):
+                self.backend.delete(self.key_prefix + session.sid)
+                self._count(deletes=1)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app), httponly=self.get_cookie_httponly(app))
+            return
+
+        now = time.time()
+        stale = session.written_at is None or now - session.written_at > self.ttl / 4
+        if session.modified or stale:
+            record = {'d': {_encode_key(key): value for key, value in session.items()}, 't': now}
+            self.backend.setex(self.key_prefix + session.sid, self.ttl, self.serializer.dumps(record))
+            self._count(writes=1)
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(name, session.sid,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain, path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+            # What the default signed-cookie session would have sent for the same data
+            legacy_cookie = self._cookie_interface.get_signing_serializer(app).dumps(dict(session))
+            self._count(cookies_sent=1, cookie_bytes=len(session.sid), cookie_session_bytes=len(legacy_cookie))
+
+    def stats(self):
+        """Returns backend usage and the cookie size compared with the default cookie session."""
+        with self._lock:
+            snapshot = dict(self._metrics)
+        sent = snapshot['cookies_sent']
+        snapshot['avg_cookie_bytes'] = snapshot['cookie_bytes'] / sent if sent else 0.0
+        snapshot['avg_cookie_session_bytes'] = snapshot['cookie_session_bytes'] / sent if sent else 0.0
+        # Every later request carries the cookie back, so this is also the per-request header saving
+        snapshot['avg_bytes_saved_per_request'] = snapshot['avg_cookie_session_bytes'] - snapshot['avg_cookie_bytes']
+        return snapshot
@@ -0,0 +1,137 @@
+import sys
+import threading
+import types
+
+try:
+    import mysql.connector
+except ImportError:
+    # The tests drive an in-memory database; sequences.py only needs mysql.connector.Error
+    connector = types.ModuleType("mysql.connector")
+    connector.Error = type("Error", (Exception,), {})
+    mysql = types.ModuleType("mysql")
+    mysql.connector = connector
+    sys.modules["mysql"] = mysql
+    sys.modules["mysql.connector"] = connector
+
+from sequences import SequenceAllocator
+
+
+class FakeDatabase:
+    """tbl_sequences in memory, with LAST_INSERT_ID() kept per connection like MySQL."""
+
+    def __init__(self):
+        self.rows = {}
+        self.lock = threading.Lock()
+        self.reservations = 0
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.last_insert_id = 0
+        self.commits = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = None
+
+    def execute(self, query, params=()):
+        db = self.conn.db
+        query = ' '.join(query.split())
+        with db.lock:
+            if query.startswith("SELECT next_value FROM tbl_sequences"):
+                name, = params
+                self.result = (db.rows[name],) if name in db.rows else None
+            elif query.startswith("INSERT IGNORE INTO tbl_sequences"):
+                name, value = params
+                db.rows.setdefault(name, value)
+            elif query.startswith("UPDATE tbl_sequences SET next_value = LAST_INSERT_ID"):
+                block_size, name = params
+                db.rows[name] += block_size
+                db.reservations += 1
+                self.conn.last_insert_id = db.rows[name]
+            elif query.startswith("SELECT LAST_INSERT_ID()"):
+                self.result = (self.conn.last_insert_id,)
+            elif query.startswith("UPDATE tbl_sequences SET next_value = GREATEST"):
+                value, name = params
+                if name in db.rows:
+                    db.rows[name] = max(db.rows[name], value)
+            else:
+                raise AssertionError(f"unexpected query: {query}")
+
+    def fetchone(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+def test_values_are_served_from_reserved_blocks():
+    db = FakeDatabase()
+    allocator = SequenceAllocator(db.connect)
+    values = [allocator.next_value('order_id:1', block_size=3, initial=100) for _ in range(7)]
+    assert values == list(range(100, 107))
+    assert db.reservations == 3 # 100-102, 103-105, 106-108
+    assert db.rows['order_id:1'] == 109
+
+
+def test_initial_callable_only_runs_when_the_row_is_created():
+    db = FakeDatabase()
+    calls = []
+    def initial(cursor):
+        calls.append(cursor)
+        return 500
+    allocator = SequenceAllocator(db.connect)
+    assert allocator.next_value('order_id:2', initial=initial) == 500
+    assert SequenceAllocator(db.connect).next_value('order_id:2', initial=initial) == 501
+    assert len(calls) == 1
+
+
+def test_allocators_sharing_a_counter_never_overlap():
+    db = FakeDatabase()
+    allocators = [SequenceAllocator(db.connect) for _ in range(3)]
+    seen = []
+    seen_lock = threading.Lock()
+
+    def work(allocator):
+        for _ in range(200):
+            value = allocator.next_value('order_barcode', block_size=7, initial=1)
+            with seen_lock:
+                seen.append(value)
+
+    threads = [threading.Thread(target=work, args=(allocator,)) for allocator in allocators for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(seen) == len(set(seen)) == 1200
+
+
+def test_advance_past_drops_the_local_block_only():
+    db = FakeDatabase()
+    first, second = SequenceAllocator(db.connect), SequenceAllocator(db.connect)
+    assert first.next_value('order_id:3', block_size=10, initial=1) == 1
+    assert second.next_value('order_id:3', block_size=10, initial=1) == 11
+
+    first.advance_past('order_id:3', 50)
+    assert first.next_value('order_id:3', block_size=10, initial=1) == 51
+    # The other process still serves the block it reserved before; next_order_id() checks tbl_order for these
+    assert second.next_value('order_id:3', block_size=10, initial=1) == 12